@@ -1,6 +1,9 @@
 from .euipo import EUIPOTradeMarkSource
-from .base import BaseSource
+from .base import BaseSource, NormalizedHit
+from .federated import federated_search, federated_search_all
 import os
+import threading
+from typing import Optional
 
 # "Nhà máy" này sẽ tạo ra các source dựa trên biến môi trường
 def build_sources() -> list[BaseSource]:
@@ -16,5 +19,20 @@ def build_sources() -> list[BaseSource]:
             
     return sources
 
-# Khởi tạo các nguồn tra cứu một lần duy nhất khi ứng dụng khởi động
-available_sources = build_sources()
\ No newline at end of file
+# Khởi tạo các nguồn tra cứu một lần duy nhất, ở lần dùng đầu tiên
+_available_sources: Optional[list[BaseSource]] = None
+_sources_lock = threading.Lock()
+
+def get_available_sources() -> list[BaseSource]:
+    global _available_sources
+    if _available_sources is None:
+        with _sources_lock:
+            if _available_sources is None:
+                _available_sources = build_sources()
+    return _available_sources
+
+def __getattr__(name: str):
+    # giữ tương thích với `from api_src import available_sources`
+    if name == "available_sources":
+        return get_available_sources()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
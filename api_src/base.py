@@ -19,5 +19,15 @@ class NormalizedHit:
 
 class BaseSource:
     """Lớp cơ sở cho mọi nguồn tra cứu (EUIPO, USPTO, ...)."""
+    name: str = "base"
+    jurisdiction: str = "-"
+    # Số biến thể tên tối đa mỗi lần tra cứu và deadline (giây) khi chạy liên nguồn (None = mặc định)
+    max_brands: int = 3
+    deadline_s: Optional[float] = None
+
     def search(self, brands: List[str], nice_class: Optional[int] = None) -> List[NormalizedHit]:
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def search_brand(self, brand: str, nice_class: Optional[int] = None) -> List[NormalizedHit]:
+        """Tra cứu một biến thể tên; api_src.federated gọi song song hàm này."""
+        return self.search([brand], nice_class)
\ No newline at end of file
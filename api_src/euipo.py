@@ -1,9 +1,10 @@
 import os
 import time
-import requests
 from typing import List, Dict, Any, Optional
 from requests.exceptions import RequestException
 from .base import BaseSource, NormalizedHit
+from .http_client import http_get, http_post
+from .register_mirror import get_register_mirror, REGISTER_SOURCE_LIMIT
 
 class EUIPOTradeMarkSource(BaseSource):
     """
@@ -11,6 +12,9 @@ class EUIPOTradeMarkSource(BaseSource):
     """
     def __init__(self):
         self.name = "EUIPO Sandbox TM Search"
+        self.jurisdiction = "EU"
+        self.max_brands = 3
+        self.deadline_s = float(os.environ["EUIPO_DEADLINE_S"]) if os.environ.get("EUIPO_DEADLINE_S") else None
         self.base_url = os.environ.get("EUIPO_API_BASE", "")
         self.auth_url = os.environ.get("EUIPO_AUTH_URL", "")
         self.client_id = os.environ.get("EU_SANDBOX_ID", "")
@@ -32,7 +36,7 @@ class EUIPOTradeMarkSource(BaseSource):
         data = {'grant_type': 'client_credentials', 'client_id': self.client_id, 'client_secret': self.client_secret, 'scope': self.scope}
         
         try:
-            response = requests.post(self.auth_url, headers=headers, data=data, timeout=10)
+            response = http_post(self.auth_url, headers=headers, data=data)
             response.raise_for_status()
             response_data = response.json()
             self._cached_token = response_data.get("access_token", "")
@@ -46,6 +50,11 @@ class EUIPOTradeMarkSource(BaseSource):
             return ""
 
     def _do_search(self, query_text: str, nice_class: Optional[int] = None) -> List[Dict[str, Any]]:
+        mirror = get_register_mirror()
+        if mirror is not None:
+            # như list API (size=10): kết quả đi thẳng vào ToolMessage, không qua bước chấm điểm/ngưỡng
+            return mirror.search(query_text, [nice_class] if nice_class else None, REGISTER_SOURCE_LIMIT)
+
         rsql_query = f"wordMarkSpecification.verbalElement==*{query_text}*"
 
         params = {"query": rsql_query, "size": 10}
@@ -56,7 +65,7 @@ class EUIPOTradeMarkSource(BaseSource):
                 if not token: raise ValueError("Không thể lấy access token.")
 
                 headers = {'Accept': 'application/json', 'Authorization': f'Bearer {token}', 'X-IBM-Client-Id': self.client_id}
-                response = requests.get(self.base_url, headers=headers, params=params, timeout=20)
+                response = http_get(self.base_url, headers=headers, params=params)
 
                 if response.status_code == 401 and attempt == 0:
                     print("--- [SOURCE LOG] Lỗi 401, tự động làm mới token và thử lại...")
@@ -82,17 +91,18 @@ class EUIPOTradeMarkSource(BaseSource):
             classes=[str(c) for c in item.get("niceClasses", [])], abstract=None
         )
 
+    def search_brand(self, brand_name: str, nice_class: Optional[int] = None) -> List[NormalizedHit]:
+        try:
+            return [self._normalize_item(item) for item in self._do_search(brand_name, nice_class)]
+        except Exception as e:
+            return [NormalizedHit(
+                source=self.name, kind="info", id="-", title=f"Lỗi khi tra cứu '{brand_name}': {e}",
+                url=None, jurisdiction="EU", status=None, filing_date=None,
+                owner=None, classes=None, abstract=None
+            )]
+
     def search(self, brands: List[str], nice_class: Optional[int] = None) -> List[NormalizedHit]:
         hits: List[NormalizedHit] = []
-        for brand_name in brands[:3]:
-            try:
-                raw_items = self._do_search(brand_name, nice_class)
-                for item in raw_items:
-                    hits.append(self._normalize_item(item))
-            except Exception as e:
-                hits.append(NormalizedHit(
-                    source=self.name, kind="info", id="-", title=f"Lỗi khi tra cứu '{brand_name}': {e}",
-                    url=None, jurisdiction="EU", status=None, filing_date=None,
-                    owner=None, classes=None, abstract=None
-                ))
+        for brand_name in brands[:self.max_brands]:
+            hits.extend(self.search_brand(brand_name, nice_class))
         return hits
\ No newline at end of file
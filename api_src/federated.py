@@ -0,0 +1,114 @@
+"""
+Điều phối tra cứu liên nguồn: mọi (nguồn × biến thể tên) chạy song song,
+mỗi nguồn có deadline riêng, kết quả được trả dần (stream) ngay khi về,
+khử trùng theo (jurisdiction, id). Nguồn chậm chỉ làm thiếu kết quả của chính nó.
+Mỗi nguồn có pool luồng riêng (FEDERATED_SOURCE_WORKERS luồng): task đang chạy không huỷ được,
+nên một nguồn bị treo chỉ chiếm hết pool của chính nó, không chặn task của các nguồn khác.
+"""
+import os
+import time
+import threading
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from .base import BaseSource, NormalizedHit
+
+FEDERATED_DEADLINE_S = float(os.getenv("FEDERATED_DEADLINE_S", "15"))
+FEDERATED_SOURCE_WORKERS = int(os.getenv("FEDERATED_SOURCE_WORKERS", "4"))
+
+_POOLS: "weakref.WeakKeyDictionary[BaseSource, ThreadPoolExecutor]" = weakref.WeakKeyDictionary()
+_POOL_LOCK = threading.Lock()
+
+def _pool(source: BaseSource) -> ThreadPoolExecutor:
+    """Pool riêng của nguồn (tạo ở lần dùng đầu); `source.max_workers` ghi đè số luồng mặc định."""
+    with _POOL_LOCK:
+        pool = _POOLS.get(source)
+        if pool is None:
+            workers = int(getattr(source, "max_workers", None) or FEDERATED_SOURCE_WORKERS)
+            pool = ThreadPoolExecutor(max_workers=max(1, workers),
+                                      thread_name_prefix=f"federated-{type(source).__name__}")
+            _POOLS[source] = pool
+        return pool
+
+def _source_name(source: BaseSource) -> str:
+    return getattr(source, "name", type(source).__name__)
+
+def _info_hit(source: BaseSource, title: str) -> NormalizedHit:
+    return NormalizedHit(
+        source=_source_name(source), kind="info", id="-", title=title, url=None,
+        jurisdiction=getattr(source, "jurisdiction", "-"), status=None, filing_date=None,
+        owner=None, classes=None, abstract=None,
+    )
+
+
+def federated_search(
+    brands: List[str],
+    nice_class: Optional[int] = None,
+    sources: Optional[List[BaseSource]] = None,
+    deadline_s: Optional[float] = None,
+) -> Iterator[NormalizedHit]:
+    """
+    Trả dần NormalizedHit từ mọi nguồn. Deadline của nguồn lấy theo thuộc tính
+    `deadline_s` của nguồn, nếu không có thì theo tham số/biến môi trường.
+    Nguồn quá hạn → 1 hit kind="info" báo thiếu kết quả, các task còn lại bị bỏ.
+    """
+    if sources is None:
+        from . import get_available_sources
+        sources = get_available_sources()
+    brands = [b for b in dict.fromkeys(b.strip() for b in brands if b and b.strip())]
+    if not sources or not brands:
+        return
+
+    start = time.monotonic()
+    default_deadline = deadline_s if deadline_s is not None else FEDERATED_DEADLINE_S
+    pending: Dict[Future, BaseSource] = {}
+    deadlines: Dict[int, float] = {}
+    for src in sources:
+        deadlines[id(src)] = start + float(getattr(src, "deadline_s", None) or default_deadline)
+        for brand in brands[: getattr(src, "max_brands", len(brands))]:
+            pending[_pool(src).submit(src.search_brand, brand, nice_class)] = src
+
+    seen: Set[Tuple[str, str]] = set()
+    while pending:
+        now = time.monotonic()
+        # Nguồn đã quá hạn: huỷ task còn lại và báo kết quả một phần
+        expired = {id(s) for s in pending.values() if deadlines[id(s)] <= now}
+        for sid in expired:
+            futs = [f for f, s in pending.items() if id(s) == sid]
+            src = pending[futs[0]]
+            for f in futs:
+                f.cancel()
+                del pending[f]
+            print(f"--- [FEDERATED WARN] {_source_name(src)} quá hạn, bỏ {len(futs)} truy vấn ---")
+            yield _info_hit(src, f"{_source_name(src)}: quá thời gian chờ, kết quả có thể chưa đầy đủ.")
+        if not pending:
+            break
+
+        next_deadline = min(deadlines[id(s)] for s in pending.values())
+        done, _ = wait(list(pending), timeout=max(0.0, next_deadline - time.monotonic()),
+                       return_when=FIRST_COMPLETED)
+        for fut in done:
+            src = pending.pop(fut)
+            try:
+                hits = fut.result()
+            except Exception as e:
+                yield _info_hit(src, f"Lỗi khi tra cứu {_source_name(src)}: {e}")
+                continue
+            for hit in hits:
+                if hit.kind != "info":
+                    key = (hit.jurisdiction, hit.id)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                yield hit
+
+
+def federated_search_all(
+    brands: List[str],
+    nice_class: Optional[int] = None,
+    sources: Optional[List[BaseSource]] = None,
+    deadline_s: Optional[float] = None,
+) -> List[NormalizedHit]:
+    """Phiên bản gom đủ của federated_search (đã khử trùng, giữ thứ tự về)."""
+    return list(federated_search(brands, nice_class, sources, deadline_s))
@@ -0,0 +1,176 @@
+"""
+Lớp HTTP dùng chung cho mọi lời gọi EUIPO (tools/trademark.py, api_src/euipo.py).
+- Một requests.Session duy nhất: kết nối keep-alive được giữ trong pool theo host.
+- Kích thước pool và số request đồng thời tối đa cấu hình được theo từng host.
+- Timeout mặc định (connect, read) khi caller không truyền.
+- Retry có backoff cho 429/5xx (tôn trọng Retry-After).
+- Bộ đếm: số lần lấy kết nối, số kết nối mới, số lần tái sử dụng, số TLS handshake.
+"""
+import os
+import threading
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# --- Cấu hình (biến môi trường) ---
+HTTP_POOL_SIZE      = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_MAX_PER_HOST   = int(os.getenv("HTTP_MAX_PER_HOST", "4"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT   = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+HTTP_RETRIES        = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF        = float(os.getenv("HTTP_BACKOFF", "0.5"))
+# Kích thước pool + số request đồng thời riêng cho từng host, ví dụ: "api-sandbox.euipo.europa.eu=32,auth-sandbox.euipo.europa.eu=2"
+HTTP_HOST_POOL_SIZES = os.getenv("HTTP_HOST_POOL_SIZES", "")
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _parse_host_sizes(spec: str) -> Dict[str, int]:
+    sizes: Dict[str, int] = {}
+    for part in spec.split(","):
+        host, _, size = part.partition("=")
+        if host.strip() and size.strip().isdigit():
+            sizes[host.strip().lower()] = int(size.strip())
+    return sizes
+
+
+# ===================== Counters =====================
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+def _bump(host: str, key: str) -> None:
+    with _stats_lock:
+        h = _stats.setdefault(host, {"requests": 0, "checkouts": 0, "new_connections": 0, "tls_handshakes": 0})
+        h[key] += 1
+
+def http_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Trả về bộ đếm theo host. `reused` = số lần lấy kết nối đã có sẵn trong pool
+    (checkouts - new_connections); `tls_handshakes` đếm kết nối HTTPS mới.
+    """
+    with _stats_lock:
+        out = {}
+        for host, h in _stats.items():
+            row = dict(h)
+            row["reused"] = max(0, h["checkouts"] - h["new_connections"])
+            out[host] = row
+        return out
+
+def reset_http_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        _bump(self.host, "checkouts")
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        _bump(self.host, "new_connections")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        _bump(self.host, "checkouts")
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        _bump(self.host, "new_connections")
+        _bump(self.host, "tls_handshakes")
+        return super()._new_conn()
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter dùng pool có bộ đếm và timeout mặc định."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        _bump(urlsplit(request.url).hostname or "", "requests")
+        return super().send(request, **kwargs)
+
+
+def _make_adapter(pool_size: int) -> _PooledAdapter:
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=0,
+        status=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,  # trả response cuối cùng để caller tự raise_for_status
+    )
+    return _PooledAdapter(pool_connections=8, pool_maxsize=pool_size, pool_block=False, max_retries=retry)
+
+
+# ===================== Session dùng chung =====================
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_mounted_hosts: set = set()
+_host_sizes = _parse_host_sizes(HTTP_HOST_POOL_SIZES)
+
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_host_slots_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                default = _make_adapter(HTTP_POOL_SIZE)
+                s.mount("http://", default)
+                s.mount("https://", default)
+                _session = s
+    return _session
+
+def _ensure_host_adapter(session: requests.Session, url: str) -> None:
+    """Mount adapter riêng cho host có cấu hình kích thước pool."""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if host not in _host_sizes or host in _mounted_hosts:
+        return
+    with _session_lock:
+        if host not in _mounted_hosts:
+            prefix = f"{parts.scheme}://{parts.netloc}"
+            session.mount(prefix, _make_adapter(_host_sizes[host]))
+            _mounted_hosts.add(host)
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host = (urlsplit(url).hostname or "").lower()
+    with _host_slots_lock:
+        sem = _host_slots.get(host)
+        if sem is None:
+            limit = max(1, _host_sizes.get(host, HTTP_MAX_PER_HOST))
+            sem = _host_slots[host] = threading.BoundedSemaphore(limit)
+    return sem
+
+Timeout = Union[None, float, Tuple[float, float]]
+
+def http_request(method: str, url: str, timeout: Timeout = None, **kwargs) -> requests.Response:
+    """Gửi request qua session dùng chung, giới hạn số request đồng thời theo host."""
+    session = get_session()
+    _ensure_host_adapter(session, url)
+    with _host_slot(url):
+        return session.request(method, url, timeout=timeout, **kwargs)
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    return http_request("GET", url, **kwargs)
+
+def http_post(url: str, **kwargs) -> requests.Response:
+    return http_request("POST", url, **kwargs)
@@ -0,0 +1,191 @@
+"""
+Bản sao cục bộ sổ đăng ký nhãn hiệu (dựng offline bởi register_builder.py từ file bulk export).
+Thư mục REGISTER_MIRROR_DIR gồm:
+  marks.sqlite       bản ghi rút gọn (id = số thứ tự 0..N-1), kèm synced_at
+  gram_vocab.npy     (G,) S12 (utf-8), đã sắp xếp — trigram của verbalElement đã chuẩn hoá
+  gram_offsets.npy   (G + 1,) int64
+  postings.i32       (P,) int32 memmap — id bản ghi theo từng trigram
+  nice_mask.u64      (N,) uint64 memmap — bit (c - 1) bật nếu có Nhóm Nice c
+  meta.json          {"count", "postings", "built_at"}
+Sinh ứng viên: gộp posting của các trigram trong tên truy vấn, đếm số trigram trùng,
+lọc Nhóm Nice bằng mặt nạ bit, lấy top theo độ trùng — tất cả chạy trong process.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from thefuzz import utils as fuzz_utils
+
+REGISTER_MIRROR_DIR = os.getenv("REGISTER_MIRROR_DIR", os.path.join("data", "register_mirror"))
+REGISTER_MIN_OVERLAP = float(os.getenv("REGISTER_MIN_OVERLAP", "0.3"))
+REGISTER_MAX_CANDIDATES = int(os.getenv("REGISTER_MAX_CANDIDATES", "2000"))
+# Nguồn tra cứu liên nguồn (EUIPOTradeMarkSource) không chấm điểm: chỉ lấy ít ứng viên đầu (theo trigram)
+REGISTER_SOURCE_LIMIT = int(os.getenv("REGISTER_SOURCE_LIMIT", "10"))
+
+
+def normalize_verbal(s: str) -> str:
+    # cùng bước tiền xử lý với chấm điểm tên (tools/compare.score_names)
+    return fuzz_utils.full_process((s or "").lower(), force_ascii=True)
+
+def trigrams(s: str) -> List[str]:
+    """Trigram theo từng token, có đệm khoảng trắng hai đầu ("  ab " → "  a", " ab", "ab ")."""
+    grams = set()
+    for tok in normalize_verbal(s).split():
+        t = f"  {tok} "
+        for i in range(len(t) - 2):
+            grams.add(t[i:i + 3])
+    return sorted(grams)
+
+def nice_mask(classes: Iterable[Any]) -> int:
+    m = 0
+    for c in classes or []:
+        try:
+            c = int(c)
+        except (TypeError, ValueError):
+            continue
+        if 1 <= c <= 45:
+            m |= 1 << (c - 1)
+    return m
+
+
+class RegisterMirror:
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.count = int(meta["count"])
+        self.built_at = float(meta.get("built_at", 0))
+        self.vocab = np.load(os.path.join(directory, "gram_vocab.npy"))
+        self.offsets = np.load(os.path.join(directory, "gram_offsets.npy"))
+        self.postings = np.memmap(os.path.join(directory, "postings.i32"), dtype=np.int32, mode="r",
+                                  shape=(int(meta["postings"]),))
+        self.masks = np.memmap(os.path.join(directory, "nice_mask.u64"), dtype=np.uint64, mode="r",
+                               shape=(self.count,))
+        self.db_path = os.path.join(directory, "marks.sqlite")
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def candidate_ids(self, name: str, nice_classes: Optional[Sequence[int]] = None, limit: int = 1000,
+                      min_overlap: float = REGISTER_MIN_OVERLAP) -> np.ndarray:
+        """id bản ghi xếp theo số trigram trùng giảm dần (ít nhất min_overlap * số trigram truy vấn)."""
+        grams = trigrams(name)
+        if not grams:
+            return np.zeros((0,), dtype=np.int32)
+        keys = np.array([g.encode("utf-8") for g in grams], dtype=self.vocab.dtype)
+        pos = np.searchsorted(self.vocab, keys)
+        parts = [
+            self.postings[self.offsets[p]:self.offsets[p + 1]]
+            for p, k in zip(pos, keys)
+            if p < self.vocab.shape[0] and self.vocab[p] == k
+        ]
+        if not parts:
+            return np.zeros((0,), dtype=np.int32)
+        ids, counts = np.unique(np.concatenate(parts), return_counts=True)
+        keep = counts >= max(1, int(np.ceil(min_overlap * len(grams))))
+        ids, counts = ids[keep], counts[keep]
+        if nice_classes:
+            want = np.uint64(nice_mask(nice_classes))
+            hit = (self.masks[ids] & want) != 0
+            ids, counts = ids[hit], counts[hit]
+        order = np.lexsort((ids, -counts))[:limit]
+        return ids[order]
+
+    def fetch(self, ids: Sequence[int]) -> List[Dict[str, Any]]:
+        """Bản ghi dạng giống item của API EUIPO (+ `_synced_at`), giữ thứ tự ids."""
+        ids = [int(i) for i in ids]
+        rows: Dict[int, Dict[str, Any]] = {}
+        conn = self._conn()
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            q = f"SELECT id, record, synced_at FROM marks WHERE id IN ({','.join('?' * len(part))})"
+            for rid, record, synced_at in conn.execute(q, part):
+                rec = json.loads(record)
+                rec["_synced_at"] = synced_at
+                rows[rid] = rec
+        return [rows[i] for i in ids if i in rows]
+
+    def update_records(self, updates: Dict[str, Dict[str, Any]], synced_at: Optional[float] = None) -> int:
+        """
+        Ghi các trường đã làm mới từ EUIPO (vd. status, niceClasses) vào marks.sqlite theo mã đơn và đặt
+        lại synced_at, để mỗi bản ghi chỉ bị kiểm tra lại một lần trong mỗi cửa sổ REGISTER_MAX_AGE_DAYS.
+        """
+        if not updates:
+            return 0
+        synced_at = time.time() if synced_at is None else synced_at
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        except sqlite3.Error as e:
+            print(f"--- [MIRROR WARN] Không ghi được mirror: {e}")
+            return 0
+        written = 0
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for app_no, fields in updates.items():
+                row = conn.execute("SELECT record FROM marks WHERE app_no=?", (str(app_no),)).fetchone()
+                if row is None:
+                    continue
+                rec = json.loads(row[0])
+                rec.update(fields)
+                conn.execute("UPDATE marks SET record=?, synced_at=? WHERE app_no=?",
+                             (json.dumps(rec, ensure_ascii=False), synced_at, str(app_no)))
+                written += 1
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"--- [MIRROR WARN] Cập nhật bản ghi mirror lỗi: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return 0
+        finally:
+            conn.close()
+        return written
+
+    def search(self, name: str, nice_classes: Optional[Sequence[int]] = None, limit: int = 1000,
+               mark_feature: Optional[str] = None, exclude_feature: Optional[str] = None,
+               mark_basis: Optional[str] = None) -> List[Dict[str, Any]]:
+        t0 = time.perf_counter()
+        # lấy dư để còn đủ sau khi lọc markFeature/markBasis
+        over = limit * 3 if (mark_feature or exclude_feature or mark_basis) else limit
+        recs = self.fetch(self.candidate_ids(name, nice_classes, limit=over))
+        out = []
+        for r in recs:
+            mf = (r.get("markFeature") or "").upper()
+            if mark_feature and mf != mark_feature:
+                continue
+            if exclude_feature and mf == exclude_feature:
+                continue
+            if mark_basis and r.get("markBasis") != mark_basis:
+                continue
+            out.append(r)
+            if len(out) >= limit:
+                break
+        print(f"--- [MIRROR LOG] '{name}' → {len(out)} ứng viên trong {(time.perf_counter() - t0) * 1000:.1f}ms ---")
+        return out
+
+
+_MIRROR: Optional[RegisterMirror] = None
+_MIRROR_LOCK = threading.Lock()
+
+def get_register_mirror() -> Optional[RegisterMirror]:
+    """Mirror dùng chung trong process; None nếu chưa dựng (khi đó dùng truy vấn EUIPO)."""
+    global _MIRROR
+    if _MIRROR is None:
+        if not os.path.exists(os.path.join(REGISTER_MIRROR_DIR, "meta.json")):
+            return None
+        with _MIRROR_LOCK:
+            if _MIRROR is None:
+                try:
+                    _MIRROR = RegisterMirror(REGISTER_MIRROR_DIR)
+                    print(f"--- [MIRROR LOG] Đã mở mirror: {_MIRROR.count} bản ghi ---")
+                except Exception as e:
+                    print(f"--- [MIRROR ERROR] Không mở được mirror {REGISTER_MIRROR_DIR}: {e}")
+                    return None
+    return _MIRROR
@@ -1,13 +1,21 @@
+import queue
+import asyncio
+import threading
 import streamlit as st
-from graph import app
+from graph import astream_answer
 from langchain_core.messages import HumanMessage, AIMessage
 from PIL import Image, ImageOps
 import io, base64
 from tools import trademark as search_tools 
+from tools.lazy import startup_report
+from pipeline import ProductProfile, agent_prompt, astream_summary, run_direct_analysis
 
 st.set_page_config(page_title="Trợ lý AI Tư vấn SHTT", page_icon="⚖️", layout="wide")
 st.title("⚖️ Trợ lý AI Tư vấn Sở hữu trí tuệ")
 
+with st.sidebar.expander("Thời gian khởi tạo thành phần"):
+    st.dataframe(startup_report(), hide_index=True)
+
 if "messages" not in st.session_state:
     st.session_state.messages = []
 if "analysis_done" not in st.session_state:
@@ -23,6 +31,65 @@ def file_to_b64jpeg(uploaded_file):
     img.save(out, format="JPEG", quality=85)
     return "data:image/jpeg;base64," + base64.b64encode(out.getvalue()).decode("ascii")
 
+@st.cache_resource
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Một event loop dùng chung cho mọi phiên, chạy mãi trên luồng nền: client async của LLM
+    (dựng một lần trong graph/pipeline) luôn gắn với cùng loop, không bị đóng sau mỗi lần chạy.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="app-asyncio", daemon=True).start()
+    return loop
+
+_END = object()
+
+def iter_async(agen):
+    """
+    Chạy async generator trên loop nền, trả từng phần tử về luồng script để vẽ UI (lệnh Streamlit
+    phải gọi từ luồng script). Luồng script vẫn chờ tới khi stream xong — Streamlit chạy script tuần tự.
+    """
+    items: queue.Queue = queue.Queue()
+
+    async def _pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        finally:
+            items.put(_END)
+
+    fut = asyncio.run_coroutine_threadsafe(_pump(), _event_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                break
+            yield item
+        fut.result()  # lỗi trong stream được ném lại ở đây
+    finally:
+        fut.cancel()
+
+def render_stream(pieces, placeholder) -> str:
+    text = ""
+    for piece in iter_async(pieces):
+        text += piece
+        placeholder.markdown(text + "▌")
+    placeholder.markdown(text)
+    return text
+
+def render_agent_stream(messages, placeholder, status) -> dict:
+    text = ""
+    done: dict = {}
+    for ev in iter_async(astream_answer(messages)):
+        if ev["type"] == "token":
+            text += ev["text"]
+            placeholder.markdown(text + "▌")
+        elif ev["type"] == "tool_start":
+            status.caption(f"Đang tra cứu: {ev['tool']}...")
+        elif ev["type"] == "done":
+            done = ev
+    placeholder.markdown(text)
+    return done
+
 def _strip_data_url_prefix(s: str) -> str:
     if s and s.startswith("data:"):
         return s.split(",", 1)[1]
@@ -48,38 +115,56 @@ if not st.session_state.analysis_done:
                 caption="Logo người dùng (preview)",
                 width="stretch",)
 
+        direct_mode = st.checkbox("Phân tích nhanh (chạy thẳng quy trình, không qua agent)", value=True)
+        with_summary = st.checkbox("Kèm nhận xét ngắn của AI", value=False, disabled=not direct_mode)
+
         submitted = st.form_submit_button("🚀 Bắt đầu Phân tích")
 
-        if submitted:
-            initial_prompt = f"""
-            Hãy tra cứu độ tương đồng của hồ sơ sản phẩm sau đây.
-            Bắt đầu bằng việc sử dụng các công cụ tra cứu.
-            Không được nhắc đến tool sử dụng trong câu trả lời.
-
-            HỒ SƠ:
-            - Tên: {product_name}
-            - Mô tả: {description}
-            - Thị trường: {market}
-            - Logo_b64_present: {"yes" if user_logo_b64 else "no"}
-            """
+        if submitted and direct_mode:
+            profile = ProductProfile(name=product_name, description=description, market=market,
+                                     logo_b64=user_logo_b64)
+            st.session_state.messages.append(HumanMessage(content=(
+                f"Tra cứu hồ sơ: Tên: {product_name} | Mô tả: {description} | Thị trường: {market}"
+            )))
+            with st.chat_message("ai"):
+                with st.spinner("Đang tra cứu..."):
+                    result = run_direct_analysis(profile, summary=False)
+                full_response = (f"**Nhóm Nice:** {', '.join(map(str, result.nice_classes)) or '—'}\n\n"
+                                 + result.markdown())
+                st.markdown(full_response)
+                for err in result.errors:
+                    st.warning(err)
+                st.caption(f"Thời gian: {result.timings.get('total', 0):.1f}s")
+                if with_summary and result.marks:
+                    # bảng đã hiện; nhận xét của LLM hiện dần theo token
+                    summary_placeholder = st.empty()
+                    try:
+                        result.summary = render_stream(astream_summary(result), summary_placeholder).strip()
+                        full_response += "\n\n" + result.summary
+                    except Exception as e:
+                        st.warning(f"Nhận xét: {e}")
+            st.session_state.messages.append(AIMessage(content=full_response))
+            st.session_state.analysis_done = True
+            user_logo_b64 = None
+
+        elif submitted:
+            initial_prompt = agent_prompt(ProductProfile(name=product_name, description=description,
+                                                         market=market, logo_b64=user_logo_b64))
             st.session_state.messages.append(HumanMessage(content=initial_prompt))
 
             with st.chat_message("ai"):
-                with st.spinner("Agent đang phân tích..."):
-                    message_placeholder = st.empty()
-                    full_response = ""
-                    stream = app.stream({"messages": st.session_state.messages})
-                    for chunk in stream:
-                        node = list(chunk.keys())[0]
-                        if node == "agent" and chunk["agent"]["messages"][-1].content:
-                            content = chunk["agent"]["messages"][-1].content
-                            full_response += content
-                            message_placeholder.markdown(full_response + "▌")
-                    message_placeholder.markdown(full_response)
-                    if full_response:
-                        st.session_state.messages.append(AIMessage(content=full_response))
-                        st.session_state.analysis_done = True
-                        # xoá bản sao b64 khỏi state sau khi phân tích xong (RAM hygiene)
-                        user_logo_b64 = None
-                    else:
-                        st.error("Agent không thể hoàn thành phân tích. Vui lòng kiểm tra lại.")
+                status = st.empty()
+                message_placeholder = st.empty()
+                status.caption("Agent đang phân tích...")
+                # astream_events chạy trên loop nền: token hiện ngay khi LLM sinh ra (script chờ tới khi xong)
+                done = render_agent_stream(st.session_state.messages, message_placeholder, status)
+                full_response = done.get("text", "")
+                if full_response:
+                    status.caption(f"Token đầu tiên sau {done['ttft_s']}s · tổng {done['total_s']:.1f}s")
+                    st.session_state.messages.append(AIMessage(content=full_response))
+                    st.session_state.analysis_done = True
+                    # xoá bản sao b64 khỏi state sau khi phân tích xong (RAM hygiene)
+                    user_logo_b64 = None
+                else:
+                    status.empty()
+                    st.error("Agent không thể hoàn thành phân tích. Vui lòng kiểm tra lại.")
@@ -0,0 +1,215 @@
+"""
+Stub cục bộ cho EUIPO Sandbox và Ollama (OpenAI-compatible) để chạy thử app/API không cần mạng.
+Chỉ dùng thư viện chuẩn; dữ liệu sinh tất định từ truy vấn.
+
+    python dev_stub.py --port 8089            # STUB_LATENCY_MS=200 để mô phỏng độ trễ mạng
+
+rồi trỏ các biến môi trường về stub:
+
+    EUIPO_TM_API=http://127.0.0.1:8089/trademark-search/trademarks
+    EUIPO_TOKEN_URL=http://127.0.0.1:8089/oidc/accessToken
+    EU_SANDBOX_ID=stub EU_SANDBOX_SECRET=stub
+    OLLAMA_BASE_URL=http://127.0.0.1:8089/v1
+"""
+import re
+import sys
+import json
+import time
+import zlib
+import argparse
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "0"))
+
+_SUFFIXES = ["", "X", " PRO", "TECH", " ONE", "IA", " LAB", "O"]
+_PREFIXES = ["", "NEO", "MY", "E-"]
+_STATUSES = ["REGISTERED", "APPLICATION_PUBLISHED", "EXPIRED", "REGISTERED"]
+
+
+def _grab(pattern: str, text: str, default: str = "") -> str:
+    m = re.search(pattern, text or "")
+    return m.group(1).strip() if m else default
+
+
+def _seed(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def fake_trademarks(query: str, size: int) -> List[Dict[str, Any]]:
+    """Sinh các nhãn hiệu gần tên trong truy vấn RSQL (verbalElement==*TÊN*)."""
+    name = _grab(r"verbalElement==\*([^*]*)\*", query).upper()
+    if not name:
+        return []
+    classes = [int(c) for c in re.findall(r"\d+", _grab(r"niceClasses=(?:=|in=)\(?([\d,]+)", query))] or [9]
+    if "markFeature==WORD" in query:
+        feature = "WORD"
+    elif "markFeature!=WORD" in query:
+        feature = "FIGURATIVE"
+    else:
+        feature = None
+    out = []
+    for i, (pre, suf) in enumerate((p, s) for p in _PREFIXES for s in _SUFFIXES):
+        app_no = f"{_seed(name + pre + suf) % 10**9:09d}"
+        out.append({
+            "applicationNumber": app_no,
+            "wordMarkSpecification": {"verbalElement": f"{pre}{name}{suf}"},
+            "niceClasses": classes[: 1 + (i % len(classes))],
+            "status": _STATUSES[i % len(_STATUSES)],
+            "markFeature": feature or ("WORD" if i % 3 else "FIGURATIVE"),
+            "markBasis": "EU_TRADEMARK",
+        })
+    return out[:size]
+
+
+def _chat_reply(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Trả lời tất định: {"content": str} hoặc {"tool_calls": [...]}."""
+    messages = body.get("messages") or []
+    last = messages[-1] if messages else {}
+    text = last.get("content") if isinstance(last.get("content"), str) else json.dumps(last.get("content"))
+    if body.get("tools"):
+        # Agent: Nice → tra cứu nhãn hiệu → trả lời
+        tool_msgs = [m for m in messages if m.get("role") == "tool"]
+        first_user = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+        name = _grab(r"Tên:\s*(.+)", first_user, "STUB")
+        if not tool_msgs:
+            desc = _grab(r"Mô tả:\s*(.+)", first_user) or name
+            return {"tool_calls": [("suggest_nice_class_tool", {"product_description": desc})]}
+        if len(tool_msgs) == 1:
+            classes = tool_msgs[0].get("content") or "9"
+            return {"tool_calls": [("trademark_search_tool",
+                                    {"name": name, "nice_class": classes, "threshold": 0.8})]}
+        try:
+            rows = json.loads(re.sub(r"^\[[^\]]*\]\n", "", tool_msgs[-1].get("content") or "[]"))
+        except ValueError:
+            rows = []
+        lines = ["| Tên nhãn hiệu | Mã đơn | Lớp Nice | Trạng thái | Điểm tương đồng tên | Điểm tương đồng Logo |",
+                 "|---|---|---|---|---|---|"]
+        for r in rows if isinstance(rows, list) else []:
+            if isinstance(r, dict) and r.get("applicationNumber"):
+                lines.append(f"| {r.get('verbalElement')} | {r['applicationNumber']} | "
+                             f"{', '.join(map(str, r.get('niceClasses') or []))} | {r.get('status')} | "
+                             f"{r.get('name_similarity')} | {r.get('logo_similarity') or '—'} |")
+        return {"content": "\n".join(lines)}
+    if "Danh sách các Nhóm Nice" in text:
+        found = re.findall(r"Nhóm (\d+):", text)
+        return {"content": ", ".join(found[:2]) or "9"}
+    return {"content": "Nhận xét (stub): có một số nhãn hiệu trùng/tương tự trong cùng nhóm, "
+                       "nên cân nhắc tra cứu chuyên sâu trước khi nộp đơn."}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "ip-stub/1.0"
+
+    def log_message(self, fmt: str, *args: Any) -> None:
+        print(f"--- [STUB] {self.command} {self.path[:120]} ---", file=sys.stderr)
+
+    def _delay(self) -> None:
+        if STUB_LATENCY_MS > 0:
+            time.sleep(STUB_LATENCY_MS / 1000)
+
+    def _json(self, obj: Any, status: int = 200) -> None:
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def do_GET(self) -> None:
+        self._delay()
+        parts = urlsplit(self.path)
+        qs = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        path = parts.path.rstrip("/")
+        if path == "/v1/models":
+            return self._json({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        if path == "/trademark-search/trademarks":
+            items = fake_trademarks(qs.get("query", ""), int(qs.get("size", "100")))
+            return self._json({"trademarks": items, "totalElements": len(items)})
+        m = re.fullmatch(r"/trademark-search/trademarks/([^/]+)(/image(/thumbnail)?)?", path)
+        if m and not m.group(2):
+            return self._json({"applicationNumber": m.group(1), "status": "REGISTERED", "niceClasses": [9]})
+        self._json({"error": "not found"}, status=404)
+
+    def do_POST(self) -> None:
+        self._delay()
+        path = urlsplit(self.path).path.rstrip("/")
+        raw = self._body()
+        if path == "/oidc/accessToken":
+            return self._json({"access_token": "stub-token", "token_type": "Bearer", "expires_in": 3600})
+        if path == "/v1/chat/completions":
+            body = json.loads(raw or b"{}")
+            return self._chat(body)
+        self._json({"error": "not found"}, status=404)
+
+    def _chat(self, body: Dict[str, Any]) -> None:
+        reply = _chat_reply(body)
+        model = body.get("model", "stub")
+        calls = [
+            {"id": f"call_{i}", "type": "function",
+             "function": {"name": n, "arguments": json.dumps(a, ensure_ascii=False)}}
+            for i, (n, a) in enumerate(reply.get("tool_calls") or [])
+        ]
+        content = reply.get("content")
+        usage = {"prompt_tokens": len(json.dumps(body.get("messages"))) // 3, "completion_tokens": 16,
+                 "total_tokens": len(json.dumps(body.get("messages"))) // 3 + 16}
+        finish = "tool_calls" if calls else "stop"
+        if not body.get("stream"):
+            msg: Dict[str, Any] = {"role": "assistant", "content": content}
+            if calls:
+                msg["tool_calls"] = calls
+            return self._json({"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                               "model": model, "choices": [{"index": 0, "message": msg, "finish_reason": finish}],
+                               "usage": usage})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def _send(delta: Dict[str, Any], finish_reason: Optional[str] = None, with_usage: bool = False) -> None:
+            chunk: Dict[str, Any] = {"id": "chatcmpl-stub", "object": "chat.completion.chunk",
+                                     "created": int(time.time()), "model": model,
+                                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if with_usage:
+                chunk["choices"], chunk["usage"] = [], usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        _send({"role": "assistant", "content": ""})
+        if calls:
+            _send({"tool_calls": [dict(c, index=i) for i, c in enumerate(calls)]})
+        else:
+            for piece in re.findall(r"\S+\s*", content or ""):
+                _send({"content": piece})
+                time.sleep(0.01)
+        _send({}, finish_reason=finish)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            _send({}, with_usage=True)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def serve(host: str = "127.0.0.1", port: int = 8089) -> None:
+    httpd = ThreadingHTTPServer((host, port), StubHandler)
+    print(f"--- [STUB] EUIPO + Ollama stub tại http://{host}:{port} ---")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stub EUIPO Sandbox + Ollama cho chạy thử cục bộ")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    args = ap.parse_args()
+    serve(args.host, args.port)
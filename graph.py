@@ -1,47 +1,52 @@
 import operator
 import os
+import time
+import inspect
 from dotenv import load_dotenv
 load_dotenv()
 
-from typing import TypedDict, List, Dict, Any, Annotated
-from langchain_openai import ChatOpenAI
+from typing import TypedDict, List, Dict, Any, Annotated, AsyncIterator, Optional
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.messages import AIMessage, BaseMessage
-from langgraph.prebuilt import ToolNode
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, message_chunk_to_message
 from langgraph.graph import StateGraph, END
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableLambda
 import warnings
 warnings.filterwarnings('ignore')
 
 from tools import tools
+from tools.lazy import lazy_component, warm_up_from_env
+from tools.executor import ParallelToolExecutor
+from tools.compaction import fit_messages, message_tokens
 
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], operator.add]
+    # Thời gian chạy từng tool ở mỗi lượt: {"tool", "tool_call_id", "seconds", "timed_out", "error"}
+    tool_timings: Annotated[List[Dict[str, Any]], operator.add]
+    # Mỗi lần gọi LLM: số token (ước lượng) đã gửi, số message gửi/bỏ, usage server trả về (nếu có)
+    prompt_stats: Annotated[List[Dict[str, Any]], operator.add]
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
 OLLAMA_MODEL    = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
 OLLAMA_API_KEY  = os.getenv("OLLAMA_API_KEY", "ollama")
 
-llm = ChatOpenAI(
-    base_url=OLLAMA_BASE_URL,
-    api_key=OLLAMA_API_KEY,
-    model=OLLAMA_MODEL,
-    temperature=0,
-)
-llm_with_tools = llm.bind_tools(tools)
-
-def agent_node(state: AgentState) -> dict:
-    """
-    Nhận toàn bộ lịch sử hội thoại, áp dụng một bộ quy tắc,
-    và quyết định hành động tiếp theo.
-    """
-    print("--- AGENT: Đang quyết định hành động tiếp theo... ---")
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system",
-        """Bạn là trợ lý AI SHTT.
+@lazy_component("agent_llm")
+def llm_with_tools():
+    from langchain_openai import ChatOpenAI
+    llm = ChatOpenAI(
+        base_url=OLLAMA_BASE_URL,
+        api_key=OLLAMA_API_KEY,
+        model=OLLAMA_MODEL,
+        temperature=0,
+        stream_usage=True,
+    )
+    return llm.bind_tools(tools)
+
+# System prompt + schema tool cố định từng byte (không chèn giá trị động) để server
+# OpenAI-compatible/Ollama tái dùng KV cache của phần tiền tố giữa các lượt và người dùng.
+AGENT_SYSTEM_PROMPT = inspect.cleandoc("""Bạn là trợ lý AI SHTT.
 
         NHIỆM VỤ:
         - Nhận thông tin sản phẩm, tự động tra cứu và hiển thị toàn bộ kết quả tìm được dưới dạng 1 bảng Markdown
@@ -54,6 +59,7 @@ def agent_node(state: AgentState) -> dict:
             • nice_class = kết quả từ bước 2 (Đây có thể là 1 chuỗi như '9', '42')
             • threshold = 0.8
             • user_logo_b64 = Logo_b64 (nếu present)
+        3b) Nếu Logo_b64_present = yes, gọi thêm `visual_trademark_search_tool` để tìm các nhãn hiệu có logo giống về hình ảnh (kể cả khác tên).
         4) Trình bày toàn bộ kết quả dưới dạng 1 bảng Markdown
 
         QUY TẮC
@@ -69,18 +75,67 @@ def agent_node(state: AgentState) -> dict:
         | [Tên nhãn hiệu 1] | [Mã đơn 1] | [Lớp Nice 1] | [Trạng thái 1] | [Điểm 1] | [Điểm 1] |
         | [Tên nhãn hiệu 2] | [Mã đơn 2] | [Lớp Nice 2] | [Trạng thái 2] | [Điểm 2] | [Điểm 2] |
         
-        """),
+        """)
+
+@lazy_component("agent_chain")
+def agent_chain():
+    """prompt | llm (đã bind tools), dựng một lần cho cả process."""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", AGENT_SYSTEM_PROMPT),
         MessagesPlaceholder(variable_name="messages"),
     ])
+    return prompt | llm_with_tools()
 
-    # Tạo một chain mới kết hợp prompt và llm (đã được bind tools)
-    agent_chain = prompt | llm_with_tools
+SYSTEM_PROMPT_TOKENS = message_tokens(SystemMessage(content=AGENT_SYSTEM_PROMPT))
 
-    # Gọi chain với toàn bộ state['messages']
-    response = agent_chain.invoke({"messages": state['messages']})
-    
+def _prepare(state: AgentState) -> tuple:
+    print("--- AGENT: Đang quyết định hành động tiếp theo... ---")
+    # Chỉ gửi phần lịch sử vừa ngân sách token (kết quả tool lớn đã được rút gọn theo ref)
+    messages, stats = fit_messages(state['messages'])
+    stats["system_tokens"] = SYSTEM_PROMPT_TOKENS
+    return messages, stats
+
+def _finish(full, ttft: Optional[float], t0: float, stats: Dict[str, Any]) -> dict:
+    response = message_chunk_to_message(full) if full is not None else AIMessage(content="")
+    stats["ttft_s"] = None if ttft is None else round(ttft, 3)
+    stats["total_s"] = round(time.perf_counter() - t0, 3)
+    stats["usage"] = getattr(response, "usage_metadata", None)
+    print(f"--- AGENT: gửi ~{stats['tokens_est'] + stats['system_tokens']} token, "
+          f"{stats['messages_sent']} message (bỏ {stats['messages_dropped']}, bung {stats['hydrated']}) | "
+          f"TTFT {stats['ttft_s']}s, tổng {stats['total_s']}s ---")
     # Trả về một AIMessage (có thể chứa tool_call hoặc không)
-    return {"messages": [response]}
+    return {"messages": [response], "prompt_stats": [stats]}
+
+def _is_first_token(chunk) -> bool:
+    return bool(chunk.content or getattr(chunk, "tool_call_chunks", None))
+
+def agent_node(state: AgentState) -> dict:
+    """
+    Nhận toàn bộ lịch sử hội thoại, áp dụng một bộ quy tắc,
+    và quyết định hành động tiếp theo.
+    """
+    messages, stats = _prepare(state)
+    # Stream để đo time-to-first-token (phần lớn là prefill của tiền tố); gộp chunk thành một AIMessage
+    t0 = time.perf_counter()
+    ttft = None
+    full = None
+    for chunk in agent_chain().stream({"messages": messages}):
+        if ttft is None and _is_first_token(chunk):
+            ttft = time.perf_counter() - t0
+        full = chunk if full is None else full + chunk
+    return _finish(full, ttft, t0, stats)
+
+async def aagent_node(state: AgentState) -> dict:
+    """Bản async của agent_node; token được phát ra qua astream_events khi đang sinh."""
+    messages, stats = _prepare(state)
+    t0 = time.perf_counter()
+    ttft = None
+    full = None
+    async for chunk in agent_chain().astream({"messages": messages}):
+        if ttft is None and _is_first_token(chunk):
+            ttft = time.perf_counter() - t0
+        full = chunk if full is None else full + chunk
+    return _finish(full, ttft, t0, stats)
 
 def should_continue(state: AgentState) -> str:
     last_message = state['messages'][-1]
@@ -95,8 +150,11 @@ def should_continue(state: AgentState) -> str:
 workflow = StateGraph(AgentState)
 
 # Chỉ cần 2 node: "agent" để suy nghĩ và "executor" để hành động
-workflow.add_node("agent", agent_node)
-workflow.add_node("executor", ToolNode(tools))
+# (executor chạy song song các tool_call của cùng một lượt, có timeout từng tool)
+# (mỗi node có cả bản sync cho invoke/stream và bản async cho ainvoke/astream_events)
+executor = ParallelToolExecutor(tools)
+workflow.add_node("agent", RunnableLambda(agent_node, afunc=aagent_node, name="agent"))
+workflow.add_node("executor", RunnableLambda(executor.__call__, afunc=executor.acall, name="executor"))
 
 # Đặt điểm bắt đầu
 workflow.set_entry_point("agent")
@@ -116,4 +174,31 @@ workflow.add_edge("executor", "agent")
 
 # Biên dịch agent
 app = workflow.compile()
-print("\nAgent đã được biên dịch thành công với kiến trúc mới!")
\ No newline at end of file
+print("\nAgent đã được biên dịch thành công với kiến trúc mới!")
+
+# Warm-up tuỳ chọn ở luồng nền (LAZY_WARMUP=all hoặc danh sách tên thành phần)
+warm_up_from_env()
+
+
+async def astream_answer(messages: List[BaseMessage]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Chạy agent bất đồng bộ (astream_events) và phát sự kiện gọn cho UI/API:
+    {"type": "token", "text"} khi LLM đang sinh, {"type": "tool_start"|"tool_end", "tool"},
+    cuối cùng {"type": "done", "text", "ttft_s"} với ttft_s = thời gian tới token hiển thị đầu tiên.
+    """
+    t0 = time.perf_counter()
+    ttft = None
+    text = ""
+    async for ev in app.astream_events({"messages": messages}, version="v2"):
+        kind = ev["event"]
+        if kind == "on_chat_model_stream" and ev.get("metadata", {}).get("langgraph_node") == "agent":
+            piece = ev["data"]["chunk"].content
+            if isinstance(piece, str) and piece:
+                if ttft is None:
+                    ttft = time.perf_counter() - t0
+                text += piece
+                yield {"type": "token", "text": piece}
+        elif kind in ("on_tool_start", "on_tool_end"):
+            yield {"type": kind[3:], "tool": ev.get("name")}
+    yield {"type": "done", "text": text, "ttft_s": None if ttft is None else round(ttft, 3),
+           "total_s": round(time.perf_counter() - t0, 3)}
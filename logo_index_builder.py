@@ -0,0 +1,213 @@
+"""
+Dựng offline index IVF cho tra cứu logo theo hình ảnh (tools/visual.py).
+
+Nguồn ảnh:
+  --images DIR     thư mục ảnh, tên file (bỏ đuôi) là applicationNumber
+  --from-cache     logo đã chuẩn hoá trong cache EUIPO (tools/euipo_cache.py)
+
+Các bước đều chạy theo khối nên RAM không phụ thuộc số lượng ảnh:
+  1) embed CLIP theo lô → file tạm float16 (memmap)
+  2) k-means (cosine) trên một mẫu giới hạn (≤ KMEANS_MAX_SAMPLE) để có centroids
+  3) gán từng khối vào danh sách gần nhất, đếm → offsets
+  4) ghi lại vectors/ids theo thứ tự danh sách
+"""
+import os
+import io
+import json
+import base64
+import shutil
+import sqlite3
+import argparse
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from tools.compare import _embed_many
+from tools.euipo_cache import EUIPO_CACHE_PATH
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+ID_WIDTH = 24
+CHUNK = 65536
+KMEANS_MAX_SAMPLE = int(os.getenv("LOGO_INDEX_KMEANS_SAMPLE", "100000"))
+
+
+def iter_image_dir(directory: str) -> Iterator[Tuple[str, str]]:
+    from PIL import Image, ImageOps
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTS):
+                continue
+            app_no = os.path.splitext(name)[0]
+            try:
+                img = Image.open(os.path.join(root, name))
+                img = ImageOps.exif_transpose(img).convert("RGB")
+                img.thumbnail((512, 512))
+                out = io.BytesIO()
+                img.save(out, format="JPEG", quality=85)
+                yield app_no, base64.b64encode(out.getvalue()).decode("ascii")
+            except Exception as e:
+                print(f"[WARN] bỏ qua {name}: {e}")
+
+def iter_euipo_cache(path: str) -> Iterator[Tuple[str, str]]:
+    conn = sqlite3.connect(path)
+    try:
+        for app_no, logo_b64 in conn.execute("SELECT app_no, logo_b64 FROM marks WHERE has_image=1"):
+            yield app_no, logo_b64
+    finally:
+        conn.close()
+
+
+def stage_embeddings(items: Iterator[Tuple[str, str]], work_dir: str, batch_size: int) -> int:
+    """Embed theo lô, nối vào staging.f16 + staging_ids.bin. Trả về số vector."""
+    vec_f = open(os.path.join(work_dir, "staging.f16"), "wb")
+    ids_f = open(os.path.join(work_dir, "staging_ids.bin"), "wb")
+    count, dim = 0, None
+    # Chống trùng applicationNumber trên đĩa (không giữ cả tập mã đơn trong RAM)
+    seen_path = os.path.join(work_dir, "seen.sqlite")
+    if os.path.exists(seen_path):
+        os.remove(seen_path)
+    seen = sqlite3.connect(seen_path, isolation_level=None)
+    seen.execute("PRAGMA journal_mode=OFF")
+    seen.execute("PRAGMA synchronous=OFF")
+    seen.execute("CREATE TABLE seen (app_no TEXT PRIMARY KEY) WITHOUT ROWID")
+    seen.execute("BEGIN")
+
+    def _flush(batch: List[Tuple[str, str]]) -> None:
+        nonlocal count, dim
+        embs = _embed_many([b64 for _, b64 in batch], batch_size)
+        for (app_no, _), emb in zip(batch, embs):
+            if np.isnan(emb[0]):
+                continue
+            dim = emb.shape[0]
+            vec_f.write(emb.astype(np.float16).tobytes())
+            ids_f.write(np.array([app_no.encode("ascii", "ignore")[:ID_WIDTH]], dtype=f"S{ID_WIDTH}").tobytes())
+            count += 1
+        print(f"--- [INDEX LOG] embedded {count} ---")
+
+    batch: List[Tuple[str, str]] = []
+    try:
+        for app_no, b64 in items:
+            if seen.execute("INSERT OR IGNORE INTO seen(app_no) VALUES (?)", (app_no,)).rowcount == 0:
+                continue
+            batch.append((app_no, b64))
+            if len(batch) >= batch_size * 8:
+                _flush(batch)
+                batch = []
+                seen.execute("COMMIT")
+                seen.execute("BEGIN")
+        if batch:
+            _flush(batch)
+    finally:
+        vec_f.close()
+        ids_f.close()
+        seen.execute("COMMIT")
+        seen.close()
+        os.remove(seen_path)
+    with open(os.path.join(work_dir, "staging.json"), "w") as f:
+        json.dump({"count": count, "dim": dim}, f)
+    return count
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, sample: int, iters: int = 12, seed: int = 0) -> np.ndarray:
+    """
+    K-means cầu (cosine) trên mẫu ngẫu nhiên (tối đa KMEANS_MAX_SAMPLE dòng, giữ float16).
+    Bước gán theo khối như khi gán toàn bộ index, nên bộ nhớ tạm chỉ là CHUNK × nlist.
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    sample = max(nlist, min(sample, KMEANS_MAX_SAMPLE))
+    idx = np.sort(rng.choice(n, size=min(n, sample), replace=False))
+    x = np.asarray(vectors[idx], dtype=np.float16)
+    m = x.shape[0]
+    cent = x[rng.choice(m, size=nlist, replace=False)].astype(np.float32)
+    for it in range(iters):
+        sums = np.zeros_like(cent)
+        counts = np.zeros(nlist, dtype=np.int64)
+        for s in range(0, m, CHUNK):
+            block = x[s:s + CHUNK].astype(np.float32)
+            assign = np.argmax(block @ cent.T, axis=1)
+            np.add.at(sums, assign, block)
+            counts += np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = x[rng.integers(m, size=int(empty.sum()))].astype(np.float32)
+        cent = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)
+        print(f"--- [INDEX LOG] k-means iter {it + 1}/{iters} ---")
+    return cent
+
+
+def build_ivf(work_dir: str, out_dir: str, nlist: int) -> None:
+    with open(os.path.join(work_dir, "staging.json")) as f:
+        st = json.load(f)
+    n, dim = st["count"], st["dim"]
+    vecs = np.memmap(os.path.join(work_dir, "staging.f16"), dtype=np.float16, mode="r", shape=(n, dim))
+    ids = np.memmap(os.path.join(work_dir, "staging_ids.bin"), dtype=f"S{ID_WIDTH}", mode="r", shape=(n,))
+
+    nlist = max(1, min(nlist or int(4 * np.sqrt(n)), n))
+    cent = train_centroids(vecs, nlist, sample=max(nlist * 64, 10000))
+
+    # Gán danh sách theo khối
+    assign = np.empty(n, dtype=np.int32)
+    for s in range(0, n, CHUNK):
+        block = np.asarray(vecs[s:s + CHUNK], dtype=np.float32)
+        assign[s:s + CHUNK] = np.argmax(block @ cent.T, axis=1)
+    counts = np.bincount(assign, minlength=nlist)
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    out_vecs = np.memmap(os.path.join(tmp_dir, "vectors.f16"), dtype=np.float16, mode="w+", shape=(n, dim))
+    out_ids = np.memmap(os.path.join(tmp_dir, "ids.bin"), dtype=f"S{ID_WIDTH}", mode="w+", shape=(n,))
+
+    # Ghi lại theo thứ tự danh sách (counting sort theo khối)
+    cursor = offsets[:-1].copy()
+    for s in range(0, n, CHUNK):
+        a = assign[s:s + CHUNK]
+        order = np.argsort(a, kind="stable")
+        a_sorted = a[order]
+        first = np.searchsorted(a_sorted, a_sorted, side="left")
+        pos = cursor[a_sorted] + (np.arange(a_sorted.shape[0]) - first)
+        out_vecs[pos] = vecs[s:s + CHUNK][order]
+        out_ids[pos] = ids[s:s + CHUNK][order]
+        np.add.at(cursor, a_sorted, 1)
+    out_vecs.flush()
+    out_ids.flush()
+    del out_vecs, out_ids
+
+    np.save(os.path.join(tmp_dir, "centroids.npy"), cent.astype(np.float32))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"dim": dim, "count": n, "nlist": nlist, "id_width": ID_WIDTH}, f)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    print(f"Hoàn tất! Logo index {n} ảnh, {nlist} danh sách tại '{out_dir}'")
+
+
+if __name__ == "__main__":
+    from tools.visual import LOGO_INDEX_DIR
+
+    parser = argparse.ArgumentParser(description="Dựng logo index IVF cho visual_trademark_search_tool")
+    parser.add_argument("--images", help="Thư mục ảnh (tên file = applicationNumber)")
+    parser.add_argument("--from-cache", action="store_true", help="Lấy logo từ cache EUIPO")
+    parser.add_argument("--out", default=LOGO_INDEX_DIR)
+    parser.add_argument("--nlist", type=int, default=0, help="Số danh sách IVF (mặc định 4*sqrt(N))")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    def _sources() -> Iterator[Tuple[str, str]]:
+        if args.images:
+            yield from iter_image_dir(args.images)
+        if args.from_cache and os.path.exists(EUIPO_CACHE_PATH):
+            yield from iter_euipo_cache(EUIPO_CACHE_PATH)
+
+    work_dir = args.out + ".work"
+    os.makedirs(work_dir, exist_ok=True)
+    total = stage_embeddings(_sources(), work_dir, args.batch_size)
+    if not total:
+        print("Không có ảnh nào để index.")
+    else:
+        build_ivf(work_dir, args.out, args.nlist)
+    shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,250 @@
+"""
+Phân tích trực tiếp (không qua vòng lập kế hoạch của agent) cho hồ sơ sản phẩm.
+Quy trình trong system prompt của agent là cố định — Nhóm Nice → tra cứu nhãn hiệu → bảng —
+nên ở đây chạy thẳng bằng code:
+- Song song: phân loại Nice, lấy token EUIPO, nạp mirror đăng bạ, tìm logo giống (nếu có logo).
+- Có Nhóm Nice → trademark_search_tool; bảng Markdown dựng tất định từ kết quả.
+- LLM chỉ dùng cho đoạn nhận xét ngắn (tuỳ chọn, ANALYSIS_SUMMARY=1).
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from tools.lazy import lazy_component
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
+OLLAMA_MODEL    = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
+OLLAMA_API_KEY  = os.getenv("OLLAMA_API_KEY", "ollama")
+
+ANALYSIS_THRESHOLD  = float(os.getenv("ANALYSIS_THRESHOLD", "0.8"))
+ANALYSIS_VISUAL_TOP = int(os.getenv("ANALYSIS_VISUAL_TOP", "10"))
+ANALYSIS_MAX_ROWS   = int(os.getenv("ANALYSIS_MAX_ROWS", "100"))
+ANALYSIS_SUMMARY    = os.getenv("ANALYSIS_SUMMARY", "0").strip().lower() in {"1", "true", "yes"}
+
+TABLE_HEADER = (
+    "| Tên nhãn hiệu | Mã đơn | Lớp Nice | Trạng thái | Điểm tương đồng tên | Điểm tương đồng Logo |\n"
+    "|---|---|---|---|---|---|"
+)
+
+
+@dataclass
+class ProductProfile:
+    name: str
+    description: str = ""
+    market: str = "EU"
+    logo_b64: Optional[str] = None
+
+
+@dataclass
+class AnalysisResult:
+    profile: ProductProfile
+    nice_classes: List[int] = field(default_factory=list)
+    nice_source: str = ""
+    marks: List[Dict[str, Any]] = field(default_factory=list)
+    message: Optional[str] = None          # "không tìm thấy" / lỗi từ nguồn tra cứu
+    table: str = ""
+    summary: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Dạng JSON cho API; không trả lại base64 của logo."""
+        out = asdict(self)
+        out["profile"].pop("logo_b64", None)
+        out["profile"]["has_logo"] = bool(self.profile.logo_b64)
+        return out
+
+    def markdown(self) -> str:
+        parts = [self.table]
+        if self.message:
+            parts.append(f"_{self.message}_")
+        if self.summary:
+            parts.append(self.summary)
+        return "\n\n".join(p for p in parts if p)
+
+
+def agent_prompt(profile: ProductProfile) -> str:
+    """Tin nhắn mở đầu cho đồ thị agent (chế độ không đi đường tắt)."""
+    return f"""
+            Hãy tra cứu độ tương đồng của hồ sơ sản phẩm sau đây.
+            Bắt đầu bằng việc sử dụng các công cụ tra cứu.
+            Không được nhắc đến tool sử dụng trong câu trả lời.
+
+            HỒ SƠ:
+            - Tên: {profile.name}
+            - Mô tả: {profile.description}
+            - Thị trường: {profile.market}
+            - Logo_b64_present: {"yes" if profile.logo_b64 else "no"}
+            """
+
+
+@lazy_component("summary_llm")
+def summary_llm():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        base_url=OLLAMA_BASE_URL,
+        api_key=OLLAMA_API_KEY,
+        model=OLLAMA_MODEL,
+        temperature=0,
+    )
+
+
+def _fmt_score(value: Any) -> str:
+    return "—" if value is None else f"{float(value):.3f}"
+
+def _cell(value: Any) -> str:
+    if value is None or value == "" or value == []:
+        return "—"
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(v) for v in value)
+    return str(value).replace("|", "\\|").replace("\n", " ")
+
+
+def merge_marks(marks: List[Dict[str, Any]], visual: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Gộp kết quả tìm theo tên và theo hình (khớp mã đơn); giữ điểm logo cao nhất."""
+    rows = [dict(m) for m in marks if m.get("applicationNumber")]
+    by_app = {str(r["applicationNumber"]): r for r in rows}
+    for v in visual:
+        app_no = str(v.get("applicationNumber") or "")
+        if not app_no:
+            continue
+        row = by_app.get(app_no)
+        if row is None:
+            row = {"applicationNumber": app_no, "verbalElement": None, "niceClasses": [], "status": None,
+                   "name_similarity": None, "logo_similarity": None, "combined_score": 0.0}
+            by_app[app_no] = row
+            rows.append(row)
+        if row.get("logo_similarity") is None or v["logo_similarity"] > row["logo_similarity"]:
+            row["logo_similarity"] = v["logo_similarity"]
+    for r in rows:
+        r["_rank"] = max(r.get("combined_score") or 0.0, r.get("name_similarity") or 0.0,
+                         r.get("logo_similarity") or 0.0)
+    rows.sort(key=lambda r: r["_rank"], reverse=True)
+    for r in rows:
+        r.pop("_rank", None)
+    return rows
+
+
+def render_table(marks: List[Dict[str, Any]], max_rows: int = ANALYSIS_MAX_ROWS) -> str:
+    lines = [TABLE_HEADER]
+    for m in marks[:max_rows]:
+        lines.append(
+            f"| {_cell(m.get('verbalElement'))} | {_cell(m.get('applicationNumber'))} | "
+            f"{_cell(m.get('niceClasses'))} | {_cell(m.get('status'))} | "
+            f"{_fmt_score(m.get('name_similarity'))} | {_fmt_score(m.get('logo_similarity'))} |"
+        )
+    if len(marks) > max_rows:
+        lines.append(f"\n_… và {len(marks) - max_rows} kết quả khác._")
+    return "\n".join(lines)
+
+
+def _summary_chain():
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+
+    prompt = ChatPromptTemplate.from_template(
+        """Bạn là trợ lý AI SHTT. Dựa trên bảng kết quả tra cứu dưới đây, viết 3-5 câu nhận xét
+        bằng tiếng Việt về mức độ rủi ro trùng/tương tự của nhãn hiệu "{name}" (Nhóm Nice {classes}).
+        Không lặp lại bảng, không bịa thông tin ngoài bảng.
+
+        {table}
+        """
+    )
+    return prompt | summary_llm() | StrOutputParser()
+
+def _summary_inputs(result: AnalysisResult) -> Dict[str, str]:
+    return {"name": result.profile.name, "classes": _cell(result.nice_classes),
+            "table": render_table(result.marks, max_rows=20)}
+
+def summarize(result: AnalysisResult) -> Optional[str]:
+    """Đoạn nhận xét ngắn (3-5 câu) dựa trên bảng đã dựng; không sinh lại bảng."""
+    return _summary_chain().invoke(_summary_inputs(result)).strip()
+
+async def astream_summary(result: AnalysisResult) -> AsyncIterator[str]:
+    """Như summarize() nhưng phát từng đoạn token để UI hiển thị dần."""
+    async for piece in _summary_chain().astream(_summary_inputs(result)):
+        yield piece
+
+
+def run_direct_analysis(profile: ProductProfile, summary: Optional[bool] = None,
+                        nice: Optional[Any] = None) -> AnalysisResult:
+    """`nice`: NiceResult đã tính sẵn (vd. classify_many cho cả lô) — khi có thì bỏ bước phân loại."""
+    from tools.nice_service import get_nice_service
+    from tools.trademark import _get_euipo_sandbox_access_token, trademark_search_tool
+    from tools.visual import visual_trademark_search_tool
+    from api_src.register_mirror import get_register_mirror
+
+    result = AnalysisResult(profile=profile)
+    t0 = time.perf_counter()
+
+    def _timed(key: str, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            result.timings[key] = round(time.perf_counter() - start, 3)
+
+    print(f"--- [PIPELINE LOG] Phân tích trực tiếp: '{profile.name}' ---")
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix="pipeline") as pool:
+        if nice is None:
+            nice_f = pool.submit(_timed, "nice", get_nice_service().classify, profile.description or profile.name)
+        else:
+            nice_f = pool.submit(lambda: nice)
+        # Làm nóng trong lúc chờ Nhóm Nice: token EUIPO và mirror đăng bạ dùng ở bước tra cứu
+        pool.submit(_timed, "euipo_token", _get_euipo_sandbox_access_token)
+        pool.submit(_timed, "register_mirror", get_register_mirror)
+        visual_f = None
+        if profile.logo_b64:
+            visual_f = pool.submit(_timed, "visual_search", visual_trademark_search_tool.invoke,
+                                   {"top_k": ANALYSIS_VISUAL_TOP, "user_logo_b64": profile.logo_b64})
+
+        try:
+            nice = nice_f.result()
+            result.nice_classes, result.nice_source = list(nice.classes), nice.source
+            if nice.error:
+                result.errors.append(f"Nice: {nice.error}")
+        except Exception as e:
+            result.errors.append(f"Nice: {e}")
+
+        args: Dict[str, Any] = {"name": profile.name, "threshold": ANALYSIS_THRESHOLD}
+        if result.nice_classes:
+            args["nice_class"] = ", ".join(str(c) for c in result.nice_classes)
+        if profile.logo_b64:
+            args["user_logo_b64"] = profile.logo_b64
+        marks: List[Dict[str, Any]] = []
+        try:
+            marks = _timed("trademark_search", trademark_search_tool.invoke, args) or []
+        except Exception as e:
+            result.errors.append(f"Tra cứu nhãn hiệu: {e}")
+
+        visual: List[Dict[str, Any]] = []
+        if visual_f is not None:
+            try:
+                visual = [v for v in (visual_f.result() or []) if "applicationNumber" in v]
+            except Exception as e:
+                result.errors.append(f"Tìm logo: {e}")
+
+    for m in marks:
+        note = m.get("error") or m.get("message") or m.get("note")
+        if note:
+            result.message = note
+    result.marks = merge_marks([m for m in marks if "applicationNumber" in m], visual)
+    if not result.marks and not result.message:
+        result.message = "Không tìm thấy nhãn hiệu nào có tên tương tự."
+    result.table = render_table(result.marks)
+
+    if (ANALYSIS_SUMMARY if summary is None else summary) and result.marks:
+        try:
+            result.summary = _timed("summary", summarize, result)
+        except Exception as e:
+            result.errors.append(f"Nhận xét: {e}")
+
+    result.timings["total"] = round(time.perf_counter() - t0, 3)
+    print(f"--- [PIPELINE LOG] Xong: {len(result.marks)} dòng, Nice {result.nice_classes} "
+          f"({result.nice_source}) | {result.timings} ---")
+    return result
@@ -1,62 +1,753 @@
 import os
-from langchain_community.document_loaders import PyPDFLoader
+import re
+import json
+import time
+import queue
+import hashlib
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pypdf import PdfReader
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 
+from tools.lexical_index import LEXICAL_DB_NAME, LexicalIndex
+from tools.quantized_store import QUANT_DIR_NAME, QuantizedVectorStore
+
+# Cấu hình mặc định (ghi đè bằng biến môi trường hoặc tham số dòng lệnh)
+SRC_DIR        = os.getenv("RAG_SRC_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+VECTOR_DB_PATH = os.getenv("RAG_VECTOR_DB", "./vector_db")
+DEVICE         = os.getenv("RAG_DEVICE", "cpu")
+PARSE_WORKERS  = int(os.getenv("RAG_PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+EMBED_BATCH    = int(os.getenv("RAG_EMBED_BATCH", "64"))
+QUEUE_SIZE     = int(os.getenv("RAG_QUEUE_SIZE", "8"))   # số phần tử tối đa giữa hai stage
+VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")  # chroma | int8 | both
+MODEL_NAME     = "bkai-foundation-models/vietnamese-bi-encoder"
+CHUNK_SIZE, CHUNK_OVERLAP = 1000, 200
+
+MANIFEST_NAME = "ingest_manifest.sqlite"
+LEGACY_MANIFEST_NAME = "ingest_manifest.json"   # định dạng cũ, tự chuyển sang SQLite ở lần chạy đầu
+# Đổi cách chunk/embedding → đổi version để các file được index lại
+PIPELINE_VERSION = f"{MODEL_NAME}|structural-{CHUNK_SIZE}-{CHUNK_OVERLAP}|v2"
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_pdf(path: str, doc_number: str) -> list:
+    """
+    Đọc 1 PDF (chạy trong process con) thành danh sách trang, gắn số hiệu văn bản.
+    Trang lỗi chỉ bị bỏ qua (có cảnh báo), không làm hỏng cả file.
+    """
+    docs = []
+    reader = PdfReader(path)
+    for i, page in enumerate(reader.pages):
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            print(f"[WARN] Bỏ trang {i} của {os.path.basename(path)}: {e}")
+            continue
+        docs.append(Document(page_content=text, metadata={
+            "source": path, "page": i, "document_number": doc_number,
+        }))
+    return docs
 
-def load_and_enrich_docs(directory_path: str, document_map: dict) -> list:
+
+def load_and_enrich_docs(directory_path: str, document_map: dict, files: Optional[List[str]] = None) -> list:
+    """Đọc song song các PDF (mặc định: tất cả trong thư mục) bằng process pool."""
+    if files is None:
+        files = sorted(f for f in os.listdir(directory_path) if f.endswith(".pdf"))
     all_docs = []
-    for filename in os.listdir(directory_path):
-        if filename.endswith(".pdf"):
-            doc_number = document_map.get(filename, filename)
-            loader = PyPDFLoader(os.path.join(directory_path, filename))
-            docs = loader.load()
-            
-            # Add metadata for every page
-            for doc in docs:
-                doc.metadata['document_number'] = doc_number
-            
-            all_docs.extend(docs)
-    return all_docs 
+    for _, docs in iter_parsed_pdfs(directory_path, document_map, files):
+        all_docs.extend(docs)
+    return all_docs
+
+
+def iter_parsed_pdfs(directory_path: str, document_map: dict, files: List[str]) -> Iterator[Tuple[str, list]]:
+    """
+    Sinh (filename, pages) theo thứ tự file nào xong trước; file lỗi bị bỏ qua và báo lỗi.
+    Chỉ giữ tối đa 2 * PARSE_WORKERS file đang xử lý để RAM không tăng theo số file.
+    """
+    if not files:
+        return
+    workers = min(PARSE_WORKERS, len(files))
+    todo = iter(files)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        inflight = {}
+
+        def _fill() -> None:
+            while len(inflight) < 2 * workers:
+                f = next(todo, None)
+                if f is None:
+                    return
+                inflight[pool.submit(load_pdf, os.path.join(directory_path, f), document_map.get(f, f))] = f
+
+        _fill()
+        while inflight:
+            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            for fut in done:
+                filename = inflight.pop(fut)
+                try:
+                    pages = fut.result()
+                except Exception as e:
+                    print(f"[WARN] Không đọc được {filename}: {e}")
+                    continue
+                yield filename, pages
+            _fill()
 
 
 # Split into chunks
 def split_text_into_chunks(all_docs: list) -> list:
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size = 1000,
-        chunk_overlap = 200
+        chunk_size = CHUNK_SIZE,
+        chunk_overlap = CHUNK_OVERLAP
     )
     
     split_doc = text_splitter.split_documents(all_docs)
     return split_doc
 
 
-# Store into a ChromaDB
-def create_and_persist_db(chunk: list, persist_directory: str):
-    model_name = 'bkai-foundation-models/vietnamese-bi-encoder'
-    model_kwargs = {'device': 'cuda'}
-    encode_kwargs = {'normalize_embeddings': False}
-    
-    embeddings = HuggingFaceEmbeddings(
-        model_name = model_name,
-        model_kwargs = model_kwargs,
-        encode_kwargs = encode_kwargs
-    )
-    persist_directory = "./vector_db"
-    
-    Chroma.from_documents(
-        documents=chunk,
-        embedding=embeddings,
-        persist_directory=persist_directory
+# ===================== Structural chunking (Chương / Mục / Điều / Khoản) =====================
+_CHAPTER = re.compile(r"^\s*(?:Chương|CHƯƠNG)\s+([IVXLCDM]+|\d+)\b\.?\s*(.*)$")
+_SECTION = re.compile(r"^\s*(?:Mục|MỤC)\s+(\d+)\b\.?\s*(.*)$")
+_ARTICLE = re.compile(r"^\s*(?:Điều|ĐIỀU)\s+(\d+[a-zđ]?)\s*[\.:]\s*(.*)$")
+_CLAUSE  = re.compile(r"^\s*(\d{1,3})\.\s+\S")
+
+
+def _page_lines(pages: list) -> List[Tuple[str, int]]:
+    return [(line, doc.metadata.get("page", 0)) for doc in pages for line in doc.page_content.splitlines()]
+
+
+def _split_clauses(body: List[Tuple[str, int]]) -> List[Tuple[Optional[str], List[Tuple[str, int]]]]:
+    """Tách thân Điều thành các Khoản "1.", "2.", ... (chỉ nhận số liên tiếp để tránh nhầm ngày/số)."""
+    parts: List[Tuple[Optional[str], List[Tuple[str, int]]]] = [(None, [])]
+    expect = 1
+    for line, page in body:
+        m = _CLAUSE.match(line)
+        if m and int(m.group(1)) == expect:
+            parts.append((m.group(1), []))
+            expect += 1
+        parts[-1][1].append((line, page))
+    return [(c, lines) for c, lines in parts if any(l.strip() for l, _ in lines)]
+
+
+def split_structural(pages: list) -> Tuple[List[Document], List[Dict[str, Any]]]:
+    """
+    Chia một văn bản luật theo cấu trúc: chunk con = một Khoản (kèm tiêu đề Điều), Điều không có
+    Khoản thì cả Điều; phần quá dài mới cắt tiếp bằng RecursiveCharacterTextSplitter.
+    Trả về (chunk con, Điều cha). Metadata số Điều/Khoản/số hiệu được gắn sẵn để trích dẫn
+    không phụ thuộc LLM; chunk con trỏ về Điều cha qua `parent_index`.
+    Văn bản không có "Điều" (hoặc phần trước Điều đầu tiên) được chia như cũ.
+    """
+    if not pages:
+        return [], []
+    base = dict(pages[0].metadata)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chapter = section = ""
+    preamble: List[Tuple[str, int]] = []
+    articles: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    for line, page in _page_lines(pages):
+        m = _ARTICLE.match(line)
+        if m:
+            current = {"number": m.group(1), "title": m.group(2).strip(), "chapter": chapter,
+                       "section": section, "page": page, "lines": [(line, page)]}
+            articles.append(current)
+            continue
+        mc, ms = _CHAPTER.match(line), _SECTION.match(line)
+        if mc or ms:
+            if mc:
+                chapter, section = f"Chương {mc.group(1)}", ""
+            else:
+                section = f"Mục {ms.group(1)}"
+            current = None  # tiêu đề Chương/Mục không thuộc Điều trước; đã lưu vào metadata
+            continue
+        if current is not None:
+            current["lines"].append((line, page))
+        elif not articles:
+            preamble.append((line, page))
+
+    children: List[Document] = []
+    if preamble and any(l.strip() for l, _ in preamble):
+        text = "\n".join(l for l, _ in preamble)
+        for piece in splitter.split_text(text):
+            children.append(Document(page_content=piece, metadata={
+                **base, "page": preamble[0][1], "article": "", "clause": "", "chapter": "", "section": "",
+                "parent_index": -1,
+            }))
+
+    parents: List[Dict[str, Any]] = []
+    for art in articles:
+        label = f"Điều {art['number']}"
+        heading = art["lines"][0][0].strip()
+        parent_text = "\n".join(l for l, _ in art["lines"]).strip()
+        pidx = len(parents)
+        parents.append({"article": label, "title": art["title"], "chapter": art["chapter"],
+                        "section": art["section"], "page": art["page"], "content": parent_text})
+        meta = {**base, "article": label, "chapter": art["chapter"], "section": art["section"],
+                "parent_index": pidx}
+        clauses = _split_clauses(art["lines"][1:])
+        if not any(c for c, _ in clauses):
+            clauses = [(None, art["lines"][1:])]
+        for clause, lines in clauses:
+            body = "\n".join(l for l, _ in lines).strip()
+            pieces = [body] if len(body) + len(heading) <= CHUNK_SIZE else splitter.split_text(body)
+            for piece in pieces or [""]:
+                children.append(Document(page_content=f"{heading}\n{piece}".strip(), metadata={
+                    **meta, "clause": f"Khoản {clause}" if clause else "", "page": lines[0][1] if lines else art["page"],
+                }))
+    return children, parents
+
+
+def chunk_ids_for(filename: str, file_hash: str, n_chunks: int) -> List[str]:
+    """ID ổn định: cùng file + cùng nội dung → cùng ID, nên upsert/xoá được chính xác."""
+    return [f"{filename}::{file_hash[:16]}::{i:05d}" for i in range(n_chunks)]
+
+
+def parent_ids_for(filename: str, file_hash: str, n_parents: int) -> List[str]:
+    return [f"{filename}::{file_hash[:16]}::art{i:04d}" for i in range(n_parents)]
+
+
+def build_embeddings() -> HuggingFaceEmbeddings:
+    return HuggingFaceEmbeddings(
+        model_name = MODEL_NAME,
+        model_kwargs = {'device': DEVICE},
+        encode_kwargs = {'normalize_embeddings': False}
     )
-    print(f"Hoàn tất! Đã lưu thành công Vector DB vào thư mục '{persist_directory}'")
 
-    
+
+# ===================== Manifest =====================
+class Manifest:
+    """
+    Manifest của index tăng dần: một dòng mỗi file (sha256, version, số hiệu, số chunk) trong SQLite.
+    Index xong một file chỉ ghi một dòng; chunk_id không lưu mà suy lại bằng chunk_ids_for(),
+    nên chi phí ghi và bộ nhớ không tăng theo kích thước corpus. `generation` tăng sau mỗi lần
+    ghi để tools/rag.py biết corpus đã đổi.
+    """
+
+    def __init__(self, persist_directory: str):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.path = os.path.join(persist_directory, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        # ghi từ luồng chính (file đã xoá) và luồng upsert (file xong), luôn dưới self._lock
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                filename        TEXT PRIMARY KEY,
+                sha256          TEXT NOT NULL,
+                version         TEXT NOT NULL,
+                document_number TEXT,
+                n_chunks        INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        self._import_legacy(os.path.join(persist_directory, LEGACY_MANIFEST_NAME))
+
+    def _import_legacy(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            legacy = json.load(f).get("files", {})
+        for filename, info in legacy.items():
+            self.put(filename, info.get("sha256", ""), info.get("version", ""),
+                     info.get("document_number"), len(info.get("chunk_ids") or []))
+        os.replace(path, path + ".bak")
+        print(f"--- Đã chuyển manifest cũ ({len(legacy)} file) sang {MANIFEST_NAME} ---")
+
+    def _bump(self) -> None:
+        self._conn.execute("INSERT INTO meta(key, value) VALUES ('generation', '1') "
+                           "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    def files(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT filename, sha256, version, document_number, n_chunks FROM files").fetchall()
+        return {f: {"sha256": h, "version": v, "document_number": dn, "n_chunks": n} for f, h, v, dn, n in rows}
+
+    def chunk_ids(self, filename: str) -> List[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT sha256, n_chunks FROM files WHERE filename=?", (filename,)).fetchone()
+        return chunk_ids_for(filename, row[0], row[1]) if row else []
+
+    def put(self, filename: str, sha256: str, version: str, document_number: Optional[str], n_chunks: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files(filename, sha256, version, document_number, n_chunks) "
+                "VALUES (?, ?, ?, ?, ?)", (filename, sha256, version, document_number, n_chunks),
+            )
+            self._bump()
+
+    def remove(self, filename: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE filename=?", (filename,))
+            self._bump()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def plan_changes(directory_path: str, known: Dict[str, Dict[str, Any]]) -> Tuple[List[str], List[str], Dict[str, str]]:
+    """Trả về (file mới/đổi cần index, file đã xoá, hash hiện tại của mọi file). `known`: Manifest.files()."""
+    current = {
+        f: file_sha256(os.path.join(directory_path, f))
+        for f in sorted(os.listdir(directory_path)) if f.endswith(".pdf")
+    }
+    # file index bằng pipeline cũ (version khác) cũng được index lại
+    changed = [
+        f for f, h in current.items()
+        if known.get(f, {}).get("sha256") != h or known.get(f, {}).get("version") != PIPELINE_VERSION
+    ]
+    removed = [f for f in known if f not in current]
+    return changed, removed, current
+
+
+# ===================== Sinks =====================
+class ChromaSink:
+    """Ghi vector đã tính sẵn vào Chroma (upsert theo ID, không embed lại)."""
+
+    def __init__(self, persist_directory: str):
+        self.db = Chroma(persist_directory=persist_directory)
+        self.collection = self.db._collection
+
+    def upsert(self, ids: List[str], docs: List[Document], vectors: List[List[float]]) -> None:
+        self.collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=[d.page_content for d in docs],
+            metadatas=[d.metadata for d in docs],
+        )
+
+    def delete(self, ids: List[str]) -> None:
+        for k in range(0, len(ids), 5000):
+            self.collection.delete(ids=ids[k:k + 5000])
+
+    def reset(self, page_size: int = 5000) -> int:
+        """Xoá mọi chunk trong collection (theo trang ID), trả về số chunk đã xoá."""
+        total = 0
+        while True:
+            ids = self.collection.get(include=[], limit=page_size).get("ids") or []
+            if not ids:
+                return total
+            self.collection.delete(ids=ids)
+            total += len(ids)
+
+
+class LexicalSink:
+    """Chỉ mục BM25 (SQLite FTS5) đặt cạnh Chroma, cùng chunk_id — xem tools/lexical_index.py."""
+
+    def __init__(self, persist_directory: str):
+        self.index = LexicalIndex(os.path.join(persist_directory, LEXICAL_DB_NAME))
+
+    def upsert(self, ids: List[str], docs: List[Document], vectors: List[List[float]]) -> None:
+        self.index.upsert(ids, [d.page_content for d in docs], [d.metadata for d in docs])
+
+    def delete(self, ids: List[str]) -> None:
+        self.index.delete(ids)
+
+    def backfill_from(self, chroma: ChromaSink, page_size: int = 1000) -> int:
+        """Dựng chỉ mục BM25 từ Chroma có sẵn (DB dựng trước khi có hybrid), không embed lại."""
+        total, offset = 0, 0
+        while True:
+            got = chroma.collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            ids = got.get("ids") or []
+            if not ids:
+                return total
+            self.index.upsert(ids, got.get("documents") or [""] * len(ids), got.get("metadatas") or [{}] * len(ids))
+            total += len(ids)
+            offset += len(ids)
+
+    def reset(self) -> int:
+        return self.index.clear()
+
+
+class QuantizedSink:
+    """Vector int8 memmap (tools/quantized_store.py); nội dung chunk đọc từ chỉ mục lexical."""
+
+    def __init__(self, persist_directory: str):
+        self.store = QuantizedVectorStore(os.path.join(persist_directory, QUANT_DIR_NAME))
+
+    def upsert(self, ids: List[str], docs: List[Document], vectors: List[List[float]]) -> None:
+        self.store.upsert(ids, vectors, [d.metadata.get("document_number") for d in docs])
+
+    def delete(self, ids: List[str]) -> None:
+        self.store.delete(ids)
+
+    def backfill_from(self, chroma: ChromaSink, page_size: int = 1000) -> int:
+        """Chép vector có sẵn trong Chroma sang int8, không embed lại."""
+        total, offset = 0, 0
+        while True:
+            got = chroma.collection.get(include=["embeddings", "metadatas"], limit=page_size, offset=offset)
+            ids = got.get("ids") or []
+            if not ids:
+                return total
+            metas = got.get("metadatas") or [{}] * len(ids)
+            self.store.upsert(ids, got["embeddings"], [(m or {}).get("document_number") for m in metas])
+            total += len(ids)
+            offset += len(ids)
+
+    def reset(self) -> int:
+        return self.store.clear()
+
+
+# ===================== Streaming pipeline =====================
+_DONE = object()
+
+
+class StreamingIndexer:
+    """
+    chunk → (hàng đợi có giới hạn) → embed theo lô → (hàng đợi có giới hạn) → upsert.
+    Producer bị chặn khi hàng đợi đầy (backpressure), nên RAM phụ thuộc batch_size
+    và queue_size chứ không phụ thuộc kích thước corpus. Marker ("file_done", ...)
+    đi cùng luồng dữ liệu để biết khi nào mọi chunk của một file đã được ghi.
+    """
+
+    def __init__(self, embeddings, sinks: List[Any], batch_size: int = EMBED_BATCH,
+                 queue_size: int = QUEUE_SIZE, on_file_done=None):
+        self.embeddings = embeddings
+        self.sinks = sinks
+        self.batch_size = max(1, batch_size)
+        self.on_file_done = on_file_done
+        self.q_chunks: "queue.Queue" = queue.Queue(maxsize=queue_size * self.batch_size)
+        self.q_upsert: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.error: Optional[BaseException] = None
+        self.failed_files: set = set()
+        self.metrics = {"chunks": 0, "batches": 0, "embed_s": 0.0, "upsert_s": 0.0}
+        self._t0 = time.perf_counter()
+        self._threads = [
+            threading.Thread(target=self._embed_loop, name="rag-embed", daemon=True),
+            threading.Thread(target=self._upsert_loop, name="rag-upsert", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    # --- producer API ---
+    def put_chunk(self, filename: str, chunk_id: str, doc: Document) -> None:
+        self._put(self.q_chunks, ("chunk", filename, chunk_id, doc))
+
+    def file_done(self, filename: str, ids: List[str]) -> None:
+        self._put(self.q_chunks, ("file_done", filename, ids, None))
+
+    def close(self) -> Dict[str, Any]:
+        if self.error is None:
+            try:
+                self._put(self.q_chunks, _DONE)
+            except RuntimeError:
+                pass
+        for t in self._threads:
+            t.join()
+        self._check()
+        return self.report()
+
+    def _check(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(f"Pipeline dừng do lỗi: {self.error}") from self.error
+
+    def _get(self, q: "queue.Queue") -> Any:
+        # None = stage khác đã lỗi, dừng luồng hiện tại
+        while self.error is None:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return None
+
+    def _put(self, q: "queue.Queue", item: Any) -> None:
+        # chặn khi hàng đợi đầy (backpressure) nhưng thoát ngay nếu stage sau đã chết
+        while True:
+            self._check()
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    # --- stages ---
+    def _embed_loop(self) -> None:
+        batch: List[Tuple[str, str, Document]] = []
+
+        def _flush() -> None:
+            if not batch:
+                return
+            t0 = time.perf_counter()
+            try:
+                vectors = self.embeddings.embed_documents([d.page_content for _, _, d in batch])
+            except Exception as e:
+                print(f"[WARN] Embed lô lỗi ({len(batch)} chunk): {e}")
+                self.failed_files.update(f for f, _, _ in batch)
+                batch.clear()
+                return
+            self.metrics["embed_s"] += time.perf_counter() - t0
+            self._put(self.q_upsert, ("batch", list(batch), vectors))
+            batch.clear()
+
+        try:
+            while True:
+                item = self._get(self.q_chunks)
+                if item is None:
+                    return
+                if item is _DONE:
+                    _flush()
+                    self._put(self.q_upsert, _DONE)
+                    return
+                kind, filename, payload, doc = item
+                if kind == "chunk":
+                    batch.append((filename, payload, doc))
+                    if len(batch) >= self.batch_size:
+                        _flush()
+                else:
+                    _flush()  # mọi chunk của file phải đi trước marker
+                    self._put(self.q_upsert, ("file_done", filename, payload))
+        except BaseException as e:
+            if self.error is None:
+                self.error = e
+
+    def _upsert_loop(self) -> None:
+        try:
+            while True:
+                item = self._get(self.q_upsert)
+                if item is None or item is _DONE:
+                    return
+                if item[0] == "batch":
+                    _, batch, vectors = item
+                    t0 = time.perf_counter()
+                    ids = [cid for _, cid, _ in batch]
+                    docs = [d for _, _, d in batch]
+                    try:
+                        for sink in self.sinks:
+                            sink.upsert(ids, docs, vectors)
+                    except Exception as e:
+                        print(f"[WARN] Upsert lô lỗi ({len(batch)} chunk): {e}")
+                        self.failed_files.update(f for f, _, _ in batch)
+                        continue
+                    self.metrics["upsert_s"] += time.perf_counter() - t0
+                    self.metrics["chunks"] += len(batch)
+                    self.metrics["batches"] += 1
+                    elapsed = time.perf_counter() - self._t0
+                    print(f"--- [INGEST] lô {self.metrics['batches']}: {len(batch)} chunk | "
+                          f"tổng {self.metrics['chunks']} | {self.metrics['chunks'] / max(elapsed, 1e-9):.1f} chunk/s | "
+                          f"hàng đợi chunk={self.q_chunks.qsize()} upsert={self.q_upsert.qsize()} ---")
+                else:
+                    _, filename, ids = item
+                    if self.on_file_done is not None:
+                        self.on_file_done(filename, ids, filename not in self.failed_files)
+        except BaseException as e:
+            if self.error is None:
+                self.error = e
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self._t0
+        m = dict(self.metrics)
+        m["elapsed_s"] = round(elapsed, 2)
+        m["chunks_per_s"] = round(m["chunks"] / max(elapsed, 1e-9), 1)
+        m["embed_s"] = round(m["embed_s"], 2)
+        m["upsert_s"] = round(m["upsert_s"], 2)
+        m["failed_files"] = sorted(self.failed_files)
+        return m
+
+
+# ===================== Sync =====================
+def sync_vector_db(directory_path: str, document_map: dict, persist_directory: str = VECTOR_DB_PATH,
+                   batch_size: int = EMBED_BATCH, backend: str = VECTOR_BACKEND) -> Dict[str, Any]:
+    """
+    Index tăng dần: chỉ parse/embed file mới hoặc đã đổi, xoá chunk của file đã xoá/đổi.
+    Chạy theo luồng trang → chunk → lô embedding → upsert; manifest được ghi khi mọi chunk
+    của một file đã vào DB, nên chạy lại sau khi bị ngắt sẽ tiếp tục từ chỗ dừng.
+    backend: "chroma", "int8" (memmap lượng tử) hoặc "both". Bật int8 trên DB Chroma có sẵn
+    thì vector được chép sang, không embed lại; Chroma có sẵn vẫn được giữ đồng bộ.
+    """
+    manifest = Manifest(persist_directory)
+    known = manifest.files()
+    changed, removed, hashes = plan_changes(directory_path, known)
+    stats: Dict[str, Any] = {"indexed_files": 0, "removed_files": 0, "added_chunks": 0, "deleted_chunks": 0}
+
+    has_chroma = os.path.exists(os.path.join(persist_directory, "chroma.sqlite3"))
+    chroma = ChromaSink(persist_directory) if backend != "int8" or has_chroma else None
+    lexical = LexicalSink(persist_directory)
+    quant = QuantizedSink(persist_directory) if backend != "chroma" else None
+    if not known:
+        # Có DB mà mất manifest: chunk cũ không còn ID để xoá theo file → xoá sạch mọi sink rồi dựng lại
+        for label, sink in (("Chroma", chroma), ("BM25", lexical), ("int8", quant)):
+            n = sink.reset() if sink is not None else 0
+            if n:
+                print(f"--- Không có manifest: đã xoá {n} chunk cũ trong {label} trước khi index lại ---")
+    if known:
+        if lexical.index.count() == 0 and chroma is not None:
+            n = lexical.backfill_from(chroma)
+            print(f"--- Đã dựng chỉ mục BM25 từ {n} chunk có sẵn ---")
+        if quant is not None and quant.store.count() == 0:
+            n = quant.backfill_from(chroma) if chroma is not None else 0
+            print(f"--- Đã chép {n} vector từ Chroma sang int8 ---")
+            if not n:
+                changed = sorted(hashes)  # không có nguồn để chép: embed lại toàn bộ
+        if backend != "int8" and chroma.collection.count() == 0:
+            changed = sorted(hashes)
+    print(f"--- {len(changed)} file cần index, {len(removed)} file đã xoá, "
+          f"{len(hashes) - len(changed)} file không đổi (backend: {backend}) ---")
+    if not changed and not removed:
+        manifest.close()
+        return stats
+
+    # Chroma có sẵn vẫn được cập nhật khi chạy --backend int8, để dense_search lùi về Chroma
+    # (khi thiếu int8/lexical) không đọc phải chunk cũ
+    sinks = [sink for sink in (chroma, lexical, quant) if sink is not None]
+    def _delete(ids: List[str]) -> None:
+        if ids:
+            for sink in sinks:
+                sink.delete(ids)
+            stats["deleted_chunks"] += len(ids)
+
+    for filename in removed:
+        _delete(manifest.chunk_ids(filename))
+        lexical.index.delete_parents(filename)
+        manifest.remove(filename)
+        stats["removed_files"] += 1
+
+    def _on_file_done(filename: str, ids: List[str], ok: bool) -> None:
+        # chạy ở luồng upsert: chunk mới đã ghi xong → xoá chunk cũ không còn dùng
+        if not ok:
+            print(f"[WARN] {filename} có lô lỗi, sẽ index lại ở lần chạy sau")
+            return
+        keep = set(ids)
+        _delete([i for i in manifest.chunk_ids(filename) if i not in keep])
+        lexical.index.delete_parents(filename, keep_hash=hashes[filename])
+        manifest.put(filename, hashes[filename], PIPELINE_VERSION, document_map.get(filename, filename), len(ids))
+        stats["indexed_files"] += 1
+        stats["added_chunks"] += len(ids)
+        print(f"--- Đã index {filename}: {len(ids)} chunk ---")
+
+    indexer = StreamingIndexer(build_embeddings(), sinks, batch_size=batch_size, on_file_done=_on_file_done)
+    try:
+        for filename, pages in iter_parsed_pdfs(directory_path, document_map, changed):
+            chunks, parents = split_structural(pages)
+            del pages
+            ids = chunk_ids_for(filename, hashes[filename], len(chunks))
+            pids = parent_ids_for(filename, hashes[filename], len(parents))
+            # Điều cha ghi trước (không embed), chunk con trỏ về qua parent_id
+            doc_number = document_map.get(filename, filename)
+            lexical.index.put_parents(filename, hashes[filename], [
+                {**p, "parent_id": pid, "document_number": doc_number, "source": filename}
+                for p, pid in zip(parents, pids)
+            ])
+            for doc, cid in zip(chunks, ids):
+                pidx = doc.metadata.pop("parent_index", -1)
+                doc.metadata["parent_id"] = pids[pidx] if pidx >= 0 else ""
+                doc.metadata["chunk_id"] = cid
+                indexer.put_chunk(filename, cid, doc)
+            stats.setdefault("articles", 0)
+            stats["articles"] += len(parents)
+            indexer.file_done(filename, ids)
+    finally:
+        stats["pipeline"] = indexer.close()
+        manifest.close()
+    if quant is not None:
+        quant.store.compact()
+
+    print(f"Hoàn tất! {stats} — Vector DB tại '{persist_directory}'")
+    return stats
+
+
+# ===================== Báo cáo backend =====================
+def _dir_mb(path: str) -> float:
+    total = 0
+    for root, _, names in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, n)) for n in names)
+    return round(total / (1024 * 1024), 1)
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def benchmark_backends(persist_directory: str = VECTOR_DB_PATH, n_queries: int = 200, k: int = 10,
+                       noise: float = 0.5) -> Dict[str, Dict[str, Any]]:
+    """
+    So sánh Chroma và int8 cạnh nhau: recall@k so với duyệt chính xác float32 (cosine), độ trễ
+    trung bình, dung lượng trên đĩa và RSS tăng thêm khi mở + truy vấn. Truy vấn là vector
+    chunk có sẵn cộng nhiễu Gauss (tỉ lệ `noise` so với độ dài vector).
+    """
+    quant_dir = os.path.join(persist_directory, QUANT_DIR_NAME)
+    if not os.path.exists(os.path.join(quant_dir, "rows.sqlite")):
+        raise SystemExit(f"Chưa có backend int8 tại {quant_dir} (chạy với --backend int8|both)")
+    store = QuantizedVectorStore(quant_dir, readonly=True)
+    _, samples = store.sample(n_queries)
+    rng = np.random.default_rng(1)
+    queries = samples + rng.standard_normal(samples.shape).astype(np.float32) * (noise / np.sqrt(samples.shape[1]))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12
+    truth = [{cid for cid, _ in store.exact_search(q, k)} for q in queries]
+
+    def _measure(search) -> Dict[str, Any]:
+        rss0 = _rss_mb()
+        t0 = time.perf_counter()
+        hits = [search(q) for q in queries]
+        elapsed = time.perf_counter() - t0
+        rss1 = _rss_mb()
+        recall = float(np.mean([len(set(h) & t) / max(1, len(t)) for h, t in zip(hits, truth)]))
+        return {"recall_at_k": round(recall, 4), "avg_ms": round(elapsed / max(1, len(queries)) * 1000, 2),
+                "rss_delta_mb": None if rss0 is None or rss1 is None else round(rss1 - rss0, 1)}
+
+    report: Dict[str, Dict[str, Any]] = {}
+    report["int8"] = _measure(lambda q: [cid for cid, _ in store.search(q, k)])
+    report["int8"]["disk_mb"] = store.memory_report()
+    if os.path.exists(os.path.join(persist_directory, "chroma.sqlite3")):
+        collection = ChromaSink(persist_directory).collection
+        report["chroma"] = _measure(
+            lambda q: collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])["ids"][0]
+        )
+        report["chroma"]["disk_mb"] = _dir_mb(persist_directory) - _dir_mb(quant_dir)
+
+    print(f"--- Backend report: {len(queries)} truy vấn, recall@{k} so với float32 chính xác ---")
+    print(f"    {'backend':<8} {'recall':>8} {'avg ms':>8} {'RSS +MB':>9}  disk")
+    for name, row in report.items():
+        rss = "-" if row["rss_delta_mb"] is None else f"{row['rss_delta_mb']:+.0f}"
+        print(f"    {name:<8} {row['recall_at_k']:>8.3f} {row['avg_ms']:>8.2f} {rss:>9}  {row['disk_mb']}")
+    return report
+
+
+# Store into a ChromaDB (ghi toàn bộ danh sách/iterable chunk, cũng đi qua pipeline streaming)
+def create_and_persist_db(chunk: Iterable[Document], persist_directory: str, batch_size: int = EMBED_BATCH):
+    sinks = [ChromaSink(persist_directory), LexicalSink(persist_directory)]
+    indexer = StreamingIndexer(build_embeddings(), sinks, batch_size=batch_size)
+    try:
+        for i, doc in enumerate(chunk):
+            cid = doc.metadata.get("chunk_id") or hashlib.sha1(
+                f"{doc.metadata.get('source')}|{doc.metadata.get('page')}|{i}|{doc.page_content}".encode("utf-8")
+            ).hexdigest()
+            doc.metadata["chunk_id"] = cid
+            indexer.put_chunk(doc.metadata.get("source", "-"), cid, doc)
+    finally:
+        report = indexer.close()
+    print(f"Hoàn tất! Đã lưu thành công Vector DB vào thư mục '{persist_directory}' — {report}")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index tăng dần văn bản luật vào Vector DB")
+    parser.add_argument("--src", default=SRC_DIR, help="Thư mục chứa PDF")
+    parser.add_argument("--db", default=VECTOR_DB_PATH, help="Thư mục Vector DB")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH, help="Số chunk mỗi lô embedding")
+    parser.add_argument("--backend", choices=["chroma", "int8", "both"], default=VECTOR_BACKEND,
+                        help="Nơi lưu vector: Chroma, memmap int8, hoặc cả hai")
+    parser.add_argument("--report", action="store_true",
+                        help="Sau khi index: so sánh recall@k / bộ nhớ của int8 với Chroma")
+    args = parser.parse_args()
+
     # Directory path and document map
-    directory_path = "D:\\Work\\AI agent\\src"
     document_map = {
     "01_2008_TT-BKHCN_62793.pdf": "Thông tư số 01/2008/TT-BKHCN",
     "01_2012_ND-CP_133717.pdf": "Nghị định số 01/2012/NĐ-CP",
@@ -109,13 +800,7 @@ if __name__ == "__main__":
     "Khongso_11754.pdf":"Hiệp định giữa Chính phủ Cộng hòa xã hội chủ nghĩa Việt Nam và Chính phủ Hợp chủng quốc Hoa Kỳ về quan hệ thương mại"
     }
 
-    loaded_documents = load_and_enrich_docs(directory_path, document_map)
-    #print(loaded_documents[0].metadata)
-    
-    # split
-    splitted_docs = split_text_into_chunks(loaded_documents)
-    #print(splitted_docs[0].page_content)
-    
-    # Store vectors in a folder
-    VECTOR_DB_PATH = "./vector_db"
-    create_and_persist_db(chunk=splitted_docs, persist_directory=VECTOR_DB_PATH)
\ No newline at end of file
+    sync_vector_db(args.src, document_map, persist_directory=args.db, batch_size=args.batch_size,
+                   backend=args.backend)
+    if args.report:
+        benchmark_backends(args.db)
@@ -0,0 +1,122 @@
+"""
+Dựng bản sao cục bộ sổ đăng ký nhãn hiệu cho api_src/register_mirror.py.
+
+Đầu vào: thư mục file bulk export (.json / .jsonl / .json.gz / .jsonl.gz), mỗi bản ghi
+có dạng như item của EUIPO trademark-search API (applicationNumber, wordMarkSpecification,
+niceClasses, markFeature, markBasis, status, ...). File .json có thể là list hoặc {"trademarks": [...]}.
+"""
+import os
+import gzip
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+from typing import Any, Dict, Iterator
+
+import numpy as np
+
+from api_src.register_mirror import REGISTER_MIRROR_DIR, trigrams, nice_mask
+
+_KEEP = ("applicationNumber", "wordMarkSpecification", "niceClasses", "markFeature",
+         "markBasis", "markKind", "status", "applicationDate", "registrationDate", "expiryDate")
+
+
+def _open(path: str):
+    return gzip.open(path, "rt", encoding="utf-8") if path.endswith(".gz") else open(path, "r", encoding="utf-8")
+
+def iter_records(directory: str) -> Iterator[Dict[str, Any]]:
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            base = name[:-3] if name.endswith(".gz") else name
+            try:
+                if base.endswith(".jsonl"):
+                    with _open(path) as f:
+                        for line in f:
+                            line = line.strip()
+                            if line:
+                                yield json.loads(line)
+                elif base.endswith(".json"):
+                    with _open(path) as f:
+                        data = json.load(f)
+                    items = data.get("trademarks", []) if isinstance(data, dict) else data
+                    yield from (it for it in items if isinstance(it, dict))
+            except Exception as e:
+                print(f"[WARN] bỏ qua {path}: {e}")
+
+
+def build_mirror(export_dir: str, out_dir: str) -> int:
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    conn = sqlite3.connect(os.path.join(tmp_dir, "marks.sqlite"))
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(
+        "CREATE TABLE marks (id INTEGER PRIMARY KEY, app_no TEXT UNIQUE, verbal TEXT, "
+        "record TEXT NOT NULL, synced_at REAL NOT NULL)"
+    )
+
+    vocab: Dict[str, int] = {}
+    gram_ids: list = []
+    mark_ids: list = []
+    masks: list = []
+    seen = set()
+    n = 0
+    now = time.time()
+    batch = []
+    for rec in iter_records(export_dir):
+        app_no = str(rec.get("applicationNumber") or "")
+        if not app_no or app_no in seen:
+            continue
+        seen.add(app_no)
+        verbal = (rec.get("wordMarkSpecification") or {}).get("verbalElement") or ""
+        trimmed = {k: rec[k] for k in _KEEP if k in rec}
+        batch.append((n, app_no, verbal, json.dumps(trimmed, ensure_ascii=False), now))
+        for g in trigrams(verbal):
+            gram_ids.append(vocab.setdefault(g, len(vocab)))
+            mark_ids.append(n)
+        masks.append(nice_mask(rec.get("niceClasses")))
+        n += 1
+        if len(batch) >= 10000:
+            conn.executemany("INSERT INTO marks VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+            print(f"--- [MIRROR LOG] {n} bản ghi ---")
+    if batch:
+        conn.executemany("INSERT INTO marks VALUES (?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+    # Posting list: sắp xếp theo (trigram theo thứ tự từ điển, id bản ghi)
+    grams_sorted = sorted(vocab, key=lambda g: g.encode("utf-8"))
+    rank = np.empty(len(vocab), dtype=np.int64)
+    for r, g in enumerate(grams_sorted):
+        rank[vocab[g]] = r
+    g_arr = rank[np.asarray(gram_ids, dtype=np.int64)] if gram_ids else np.zeros(0, dtype=np.int64)
+    m_arr = np.asarray(mark_ids, dtype=np.int32)
+    order = np.lexsort((m_arr, g_arr))
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(g_arr, minlength=len(vocab)), out=offsets[1:])
+
+    np.save(os.path.join(tmp_dir, "gram_vocab.npy"),
+            np.array([g.encode("utf-8") for g in grams_sorted], dtype="S12"))
+    np.save(os.path.join(tmp_dir, "gram_offsets.npy"), offsets)
+    m_arr[order].tofile(os.path.join(tmp_dir, "postings.i32"))
+    np.asarray(masks, dtype=np.uint64).tofile(os.path.join(tmp_dir, "nice_mask.u64"))
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"count": n, "postings": int(m_arr.shape[0]), "built_at": now}, f)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    print(f"Hoàn tất! Mirror {n} bản ghi, {len(vocab)} trigram tại '{out_dir}'")
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dựng mirror sổ đăng ký nhãn hiệu từ bulk export")
+    parser.add_argument("export_dir", help="Thư mục chứa file bulk export")
+    parser.add_argument("--out", default=REGISTER_MIRROR_DIR)
+    args = parser.parse_args()
+    build_mirror(args.export_dir, args.out)
@@ -0,0 +1,358 @@
+"""
+API không giao diện (ASGI, FastAPI) cho phân tích nhãn hiệu — dùng cho sàng lọc cả danh mục sản phẩm.
+
+    uvicorn server:api --port 8000        (hoặc: python server.py)
+
+- POST   /analyze              một hồ sơ → kết quả có cấu trúc (mode "direct" mặc định; "agent" chạy đồ thị)
+- POST   /batch                nhiều hồ sơ → job_id; xử lý nền qua hàng đợi, giới hạn số hồ sơ đồng thời
+- GET    /jobs/{id}            trạng thái + tiến độ (done/failed/total, tốc độ, ETA)
+- GET    /jobs/{id}/results    kết quả đã xong, phân trang (offset, limit)
+- DELETE /jobs/{id}            huỷ job (các hồ sơ đang chạy vẫn hoàn tất)
+- GET    /health               thành phần đã nạp, thống kê cache Nice / HTTP, hàng đợi
+
+Job và kết quả lưu SQLite (WAL) nên khởi động lại process thì job dở dang được chạy tiếp.
+Mọi request dùng chung cache trong process (Nice, EUIPO, logo, câu trả lời RAG).
+Chạy thử không cần mạng: xem dev_stub.py.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+
+from pipeline import ProductProfile, agent_prompt, run_direct_analysis
+from tools.lazy import startup_report
+
+API_CONCURRENCY = int(os.getenv("API_CONCURRENCY", "8"))     # số hồ sơ xử lý đồng thời (toàn process)
+API_JOB_WORKERS = int(os.getenv("API_JOB_WORKERS", "1"))     # số job batch chạy song song
+API_BATCH_MAX   = int(os.getenv("API_BATCH_MAX", "10000"))
+API_NICE_CHUNK  = int(os.getenv("API_NICE_CHUNK", "256"))    # số mô tả phân loại Nice trong một lần gọi
+API_JOBS_PATH   = os.getenv("API_JOBS_PATH", os.path.join(".cache", "jobs.sqlite"))
+
+
+class ProfileIn(BaseModel):
+    name: str = Field(min_length=1, description="Tên nhãn hiệu dự kiến")
+    description: str = ""
+    market: str = "EU"
+    logo_b64: Optional[str] = Field(default=None, description="Logo base64 (JPEG/PNG, có thể kèm data URL)")
+
+    def profile(self) -> ProductProfile:
+        return ProductProfile(name=self.name, description=self.description, market=self.market,
+                              logo_b64=self.logo_b64)
+
+class AnalyzeIn(ProfileIn):
+    mode: Literal["direct", "agent"] = "direct"
+    summary: bool = False
+
+class BatchIn(BaseModel):
+    profiles: List[ProfileIn]
+    summary: bool = False
+
+
+class JobStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id          TEXT PRIMARY KEY,
+                status      TEXT NOT NULL,            -- queued | running | done | cancelled | error
+                total       INTEGER NOT NULL,
+                options     TEXT NOT NULL,
+                error       TEXT,
+                created_at  REAL NOT NULL,
+                started_at  REAL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS job_items (
+                job_id  TEXT NOT NULL,
+                idx     INTEGER NOT NULL,
+                profile TEXT NOT NULL,
+                status  TEXT NOT NULL DEFAULT 'pending',   -- pending | ok | error
+                result  TEXT,
+                seconds REAL,
+                PRIMARY KEY (job_id, idx)
+            );
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, profiles: List[Dict[str, Any]], options: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex[:16]
+        conn = self._conn()
+        conn.execute("BEGIN")
+        conn.execute("INSERT INTO jobs(id, status, total, options, created_at) VALUES (?, 'queued', ?, ?, ?)",
+                     (job_id, len(profiles), json.dumps(options), time.time()))
+        conn.executemany("INSERT INTO job_items(job_id, idx, profile) VALUES (?, ?, ?)",
+                         [(job_id, i, json.dumps(p, ensure_ascii=False)) for i, p in enumerate(profiles)])
+        conn.execute("COMMIT")
+        return job_id
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        now = time.time()
+        if status == "running":
+            self._conn().execute("UPDATE jobs SET status=?, started_at=COALESCE(started_at, ?) WHERE id=?",
+                                 (status, now, job_id))
+        else:
+            self._conn().execute("UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=?",
+                                 (status, error, now, job_id))
+
+    def status(self, job_id: str) -> Optional[str]:
+        row = self._conn().execute("SELECT status FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def options(self, job_id: str) -> Dict[str, Any]:
+        row = self._conn().execute("SELECT options FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def pending(self, job_id: str) -> List[Tuple[int, Dict[str, Any]]]:
+        rows = self._conn().execute(
+            "SELECT idx, profile FROM job_items WHERE job_id=? AND status='pending' ORDER BY idx", (job_id,)
+        ).fetchall()
+        return [(i, json.loads(p)) for i, p in rows]
+
+    def put_result(self, job_id: str, idx: int, ok: bool, result: Dict[str, Any], seconds: float) -> None:
+        self._conn().execute(
+            "UPDATE job_items SET status=?, result=?, seconds=? WHERE job_id=? AND idx=?",
+            ("ok" if ok else "error", json.dumps(result, ensure_ascii=False), seconds, job_id, idx),
+        )
+
+    def unfinished(self) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        row = conn.execute("SELECT status, total, error, created_at, started_at, finished_at FROM jobs WHERE id=?",
+                           (job_id,)).fetchone()
+        if not row:
+            return None
+        status, total, error, created_at, started_at, finished_at = row
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM job_items WHERE job_id=? GROUP BY status", (job_id,)
+        ).fetchall())
+        done, failed = counts.get("ok", 0), counts.get("error", 0)
+        finished = done + failed
+        elapsed = ((finished_at or time.time()) - started_at) if started_at else 0.0
+        rate = finished / elapsed if elapsed > 0 else 0.0
+        return {
+            "job_id": job_id, "status": status, "total": total, "done": done, "failed": failed,
+            "progress": round(finished / total, 4) if total else 1.0,
+            "elapsed_s": round(elapsed, 1),
+            "profiles_per_s": round(rate, 3),
+            "eta_s": round((total - finished) / rate, 1) if rate > 0 and status == "running" else None,
+            "error": error, "created_at": created_at,
+        }
+
+    def results(self, job_id: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT idx, status, result, seconds FROM job_items WHERE job_id=? AND status != 'pending' "
+            "ORDER BY idx LIMIT ? OFFSET ?", (job_id, limit, offset),
+        ).fetchall()
+        return [{"index": i, "status": st, "seconds": sec, "result": json.loads(res) if res else None}
+                for i, st, res, sec in rows]
+
+
+class BatchRunner:
+    """Hàng đợi job: API_JOB_WORKERS job chạy cùng lúc, tổng số hồ sơ đồng thời giới hạn bởi semaphore chung."""
+
+    def __init__(self, store: JobStore, concurrency: int = API_CONCURRENCY, workers: int = API_JOB_WORKERS):
+        self.store = store
+        self.sem = asyncio.Semaphore(max(1, concurrency))
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self.workers = max(1, workers)
+        self._tasks: List[asyncio.Task] = []
+        self.active: Dict[str, int] = {}
+
+    def start(self) -> None:
+        for job_id in self.store.unfinished():
+            print(f"--- [API LOG] Chạy tiếp job dở dang {job_id} ---")
+            self.queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def submit(self, job_id: str) -> None:
+        self.queue.put_nowait(job_id)
+
+    async def analyze(self, profile: ProductProfile, summary: bool, nice: Any = None,
+                      job_id: Optional[str] = None) -> Optional[Tuple[Dict[str, Any], float]]:
+        """None nếu job `job_id` bị huỷ trong lúc hồ sơ chờ semaphore."""
+        async with self.sem:
+            if job_id is not None and await asyncio.to_thread(self.store.status, job_id) == "cancelled":
+                return None
+            t0 = time.perf_counter()
+            result = await asyncio.to_thread(run_direct_analysis, profile, summary, nice)
+            return result.to_dict(), time.perf_counter() - t0
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            job_id = await self.queue.get()
+            try:
+                if await asyncio.to_thread(self.store.status, job_id) in ("queued", "running"):
+                    await self._run(job_id)
+            except Exception as e:
+                print(f"--- [API ERROR] Job {job_id} lỗi: {e}")
+                await asyncio.to_thread(self.store.set_status, job_id, "error", str(e))
+            finally:
+                self.active.pop(job_id, None)
+                self.queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        from tools.nice_service import get_nice_service
+
+        # JobStore là SQLite đồng bộ: mọi lần gọi đều đẩy sang thread, không chặn event loop
+        await asyncio.to_thread(self.store.set_status, job_id, "running")
+        summary = bool((await asyncio.to_thread(self.store.options, job_id)).get("summary"))
+        items = await asyncio.to_thread(self.store.pending, job_id)
+        self.active[job_id] = len(items)
+        t0 = time.perf_counter()
+
+        async def _one(idx: int, raw: Dict[str, Any], nice: Any) -> None:
+            try:
+                out = await self.analyze(ProfileIn(**raw).profile(), summary, nice, job_id=job_id)
+            except Exception as e:
+                await asyncio.to_thread(self.store.put_result, job_id, idx, False, {"error": str(e)}, None)
+                return
+            if out is not None:
+                result, secs = out
+                await asyncio.to_thread(self.store.put_result, job_id, idx, True, result, round(secs, 3))
+
+        for i in range(0, len(items), API_NICE_CHUNK):
+            if await asyncio.to_thread(self.store.status, job_id) == "cancelled":
+                break
+            chunk = items[i:i + API_NICE_CHUNK]
+            # Nhóm Nice cho cả đoạn: một lần tra cache + một lần embed cho các mô tả mới
+            try:
+                nice = await asyncio.to_thread(get_nice_service().classify_many,
+                                               [p.get("description") or p["name"] for _, p in chunk])
+            except Exception as e:
+                print(f"--- [API WARN] Phân loại Nice theo lô lỗi, phân loại từng hồ sơ: {e}")
+                nice = [None] * len(chunk)
+            await asyncio.gather(*(_one(idx, raw, n) for (idx, raw), n in zip(chunk, nice)))
+            self.active[job_id] = len(items) - i - len(chunk)
+
+        if await asyncio.to_thread(self.store.status, job_id) != "cancelled":
+            await asyncio.to_thread(self.store.set_status, job_id, "done")
+        print(f"--- [API LOG] Job {job_id}: {len(items)} hồ sơ trong {time.perf_counter() - t0:.1f}s ---")
+
+
+_store: Optional[JobStore] = None
+_runner: Optional[BatchRunner] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _store, _runner
+    _store = JobStore(API_JOBS_PATH)
+    _runner = BatchRunner(_store)
+    _runner.start()
+    yield
+    await _runner.stop()
+
+api = FastAPI(title="Trợ lý SHTT — API phân tích nhãn hiệu", lifespan=lifespan)
+
+
+@api.post("/analyze")
+async def analyze(body: AnalyzeIn) -> Dict[str, Any]:
+    if body.mode == "direct":
+        result, _ = await _runner.analyze(body.profile(), body.summary)
+        return result
+
+    # Agent: logo người dùng được tool đọc từ context toàn cục của UI, không an toàn khi nhiều request
+    if body.logo_b64:
+        raise HTTPException(status_code=400, detail="mode 'agent' không nhận logo; dùng mode 'direct'.")
+    from langchain_core.messages import HumanMessage
+    from graph import app as agent_app
+
+    async with _runner.sem:
+        t0 = time.perf_counter()
+        state = await agent_app.ainvoke({"messages": [HumanMessage(content=agent_prompt(body.profile()))]})
+    return {
+        "profile": {"name": body.name, "description": body.description, "market": body.market},
+        "answer": state["messages"][-1].content,
+        "tool_timings": state.get("tool_timings", []),
+        "prompt_stats": state.get("prompt_stats", []),
+        "seconds": round(time.perf_counter() - t0, 3),
+    }
+
+
+@api.post("/batch", status_code=202)
+async def create_batch(body: BatchIn) -> Dict[str, Any]:
+    if not body.profiles:
+        raise HTTPException(status_code=400, detail="Danh sách hồ sơ rỗng.")
+    if len(body.profiles) > API_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Tối đa {API_BATCH_MAX} hồ sơ mỗi job.")
+    job_id = await asyncio.to_thread(_store.create, [p.model_dump() for p in body.profiles],
+                                     {"summary": body.summary})
+    _runner.submit(job_id)
+    return {"job_id": job_id, "total": len(body.profiles), "queued_jobs": _runner.queue.qsize()}
+
+
+@api.get("/jobs/{job_id}")
+async def job_status(job_id: str) -> Dict[str, Any]:
+    info = await asyncio.to_thread(_store.progress, job_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Không có job này.")
+    return info
+
+
+@api.get("/jobs/{job_id}/results")
+async def job_results(job_id: str, offset: int = 0, limit: int = 100) -> Dict[str, Any]:
+    if await asyncio.to_thread(_store.status, job_id) is None:
+        raise HTTPException(status_code=404, detail="Không có job này.")
+    limit = max(1, min(limit, 1000))
+    items = await asyncio.to_thread(_store.results, job_id, max(0, offset), limit)
+    return {"job_id": job_id, "offset": offset, "items": items}
+
+
+@api.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str) -> Dict[str, Any]:
+    status = await asyncio.to_thread(_store.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Không có job này.")
+    if status in ("queued", "running"):
+        await asyncio.to_thread(_store.set_status, job_id, "cancelled")
+    return await asyncio.to_thread(_store.progress, job_id)
+
+
+@api.get("/health")
+async def health() -> Dict[str, Any]:
+    from tools.nice_service import get_nice_service
+    from api_src.http_client import http_stats
+
+    return {
+        "components": startup_report(),
+        "nice_cache": get_nice_service().stats(),
+        "http": http_stats(),
+        "queue": {"waiting_jobs": _runner.queue.qsize(), "active": dict(_runner.active),
+                  "concurrency": API_CONCURRENCY},
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(api, host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")))
@@ -0,0 +1,54 @@
+"""
+score_names (chấm hàng loạt, rapidfuzz nếu có) phải cho đúng điểm của thefuzz.token_set_ratio / 100
+như bản chấm từng cặp trước đây, kể cả khi cắt theo ngưỡng.
+"""
+import random
+
+import pytest
+
+fuzz = pytest.importorskip("thefuzz.fuzz")
+compare = pytest.importorskip("tools.compare")
+
+EDGE_NAMES = [
+    "", "   ", "PANASONIC", "panasonic", "Pana Sonic", "PANASONIC ELECTRIC WORKS", "Panasonic®",
+    "NEO-PANASONIC", "Café Sông Hồng", "CAFE SONG HONG", "Ääkkönen GmbH", "123", "A", "AB AB AB",
+    "sonic pana", "P.A.N.A.S.O.N.I.C", "panasonic panasonic", "ПАНАСОНИК", "松下", "X Æ A-12",
+]
+_ALPHABET = "abcdeéêfghijklmnoôpqrstuvwxyz0123456789 -.&'"
+
+
+def _random_names(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    words = ["".join(rng.choice(_ALPHABET) for _ in range(rng.randint(1, 9))) for _ in range(200)]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(1, 4))).upper() for _ in range(n)]
+
+
+@pytest.fixture(params=["rapidfuzz", "thefuzz"])
+def backend(request, monkeypatch):
+    if request.param == "thefuzz":
+        monkeypatch.setattr(compare, "_rf_process", None)
+    elif compare._rf_process is None:
+        pytest.skip("rapidfuzz không được cài")
+    return request.param
+
+
+@pytest.mark.parametrize("query", ["Panasonic", "café sông hồng", "AB", "Neo Tech Pro", ""])
+def test_parity_with_thefuzz(backend, query):
+    names = EDGE_NAMES + _random_names(500) + [query.upper(), f"{query} group"]
+    got = compare.score_names(query, names)
+    want = [fuzz.token_set_ratio(query, n) / 100.0 for n in names]
+    assert got.tolist() == want
+
+
+@pytest.mark.parametrize("threshold", [0.0, 0.5, 0.7, 0.85, 1.0])
+def test_threshold_only_zeroes_pairs_below(backend, threshold):
+    query = "Panasonic"
+    names = EDGE_NAMES + _random_names(300, seed=1) + ["PANASONIK", "PANASON", "PANAS"]
+    got = compare.score_names(query, names, threshold=threshold)
+    for name, score in zip(names, got.tolist()):
+        want = fuzz.token_set_ratio(query, name) / 100.0
+        assert score == (want if want >= threshold else 0.0), name
+
+
+def test_empty_names():
+    assert compare.score_names("Panasonic", []).shape == (0,)
@@ -0,0 +1,112 @@
+"""
+Hồi quy cho rag_builder.split_structural: ranh giới Chương/Mục/Điều/Khoản, "Điều 5a", "ĐIỀU" viết hoa,
+Điều vắt qua trang và Điều dài không có Khoản. Metadata này quyết định trích dẫn và parent_id của cả corpus.
+"""
+import pytest
+
+for _mod in ("pypdf", "langchain.text_splitter", "langchain_community.embeddings", "langchain_chroma"):
+    pytest.importorskip(_mod)
+
+from langchain_core.documents import Document
+
+from rag_builder import CHUNK_SIZE, split_structural
+
+LONG_LINES = [f"Câu thứ {i} của quy định dài về quyền sở hữu công nghiệp và các biện pháp bảo vệ."
+              for i in range(60)]
+
+PAGES = [
+    [
+        "LUẬT SỞ HỮU TRÍ TUỆ",
+        "Chương I",
+        "NHỮNG QUY ĐỊNH CHUNG",
+        "Điều 1. Phạm vi điều chỉnh",
+        "Luật này quy định về quyền tác giả và quyền sở hữu công nghiệp.",
+        "Mục 1",
+        "ĐỐI TƯỢNG",
+        "Điều 2. Đối tượng áp dụng",
+        "1. Tổ chức, cá nhân Việt Nam;",
+        "2. Tổ chức, cá nhân nước ngoài",
+    ],
+    [
+        "đáp ứng các điều kiện quy định tại Luật này.",
+        "3. Trường hợp khác theo điều ước quốc tế.",
+        "Điều 5a. Điều khoản bổ sung",
+        "1. Nội dung bổ sung.",
+        "ĐIỀU 6. Áp dụng điều ước quốc tế",
+        "Trường hợp điều ước quốc tế có quy định khác thì áp dụng điều ước quốc tế.",
+    ],
+    ["Chương II", "Điều 7. Quy định dài", *LONG_LINES],
+]
+
+
+@pytest.fixture(scope="module")
+def split():
+    pages = [Document(page_content="\n".join(lines), metadata={"source": "luat.pdf", "page": i,
+                                                                  "document_number": "50/2005/QH11"})
+             for i, lines in enumerate(PAGES)]
+    return split_structural(pages)
+
+
+def _children_of(children, article):
+    return [c for c in children if c.metadata["article"] == article]
+
+
+def test_parents_follow_article_boundaries(split):
+    _, parents = split
+    assert [p["article"] for p in parents] == ["Điều 1", "Điều 2", "Điều 5a", "Điều 6", "Điều 7"]
+    assert [p["chapter"] for p in parents] == ["Chương I"] * 4 + ["Chương II"]
+    assert [p["section"] for p in parents] == ["", "Mục 1", "Mục 1", "Mục 1", ""]
+    assert [p["page"] for p in parents] == [0, 0, 1, 1, 2]
+    # tiêu đề Chương/Mục không lọt vào thân Điều trước
+    assert "Mục 1" not in parents[0]["content"]
+    assert "Chương II" not in parents[3]["content"]
+
+
+def test_preamble_has_no_parent(split):
+    children, _ = split
+    pre = [c for c in children if c.metadata["parent_index"] == -1]
+    assert pre and all(c.metadata["article"] == "" and c.metadata["clause"] == "" for c in pre)
+    assert "LUẬT SỞ HỮU TRÍ TUỆ" in pre[0].page_content
+    assert pre[0].metadata["page"] == 0
+
+
+def test_clauses_and_page_break(split):
+    children, parents = split
+    art2 = _children_of(children, "Điều 2")
+    assert [c.metadata["clause"] for c in art2] == ["Khoản 1", "Khoản 2", "Khoản 3"]
+    assert [c.metadata["page"] for c in art2] == [0, 0, 1]
+    assert {c.metadata["parent_index"] for c in art2} == {1}
+    assert all(c.page_content.startswith("Điều 2. Đối tượng áp dụng\n") for c in art2)
+    # Khoản 2 vắt sang trang sau vẫn là một chunk, Điều cha giữ trọn nội dung
+    assert "đáp ứng các điều kiện" in art2[1].page_content
+    assert "đáp ứng các điều kiện" in parents[1]["content"]
+    assert all(c.metadata["section"] == "Mục 1" and c.metadata["chapter"] == "Chương I" for c in art2)
+
+
+def test_article_suffix_and_uppercase_heading(split):
+    children, _ = split
+    art5a = _children_of(children, "Điều 5a")
+    assert [(c.metadata["clause"], c.metadata["parent_index"], c.metadata["page"]) for c in art5a] == [("Khoản 1", 2, 1)]
+    art6 = _children_of(children, "Điều 6")
+    assert len(art6) == 1
+    assert art6[0].metadata["clause"] == "" and art6[0].metadata["parent_index"] == 3
+    assert art6[0].page_content.startswith("ĐIỀU 6. Áp dụng điều ước quốc tế")
+
+
+def test_article_without_clauses(split):
+    children, _ = split
+    art1 = _children_of(children, "Điều 1")
+    assert len(art1) == 1
+    assert (art1[0].metadata["clause"], art1[0].metadata["parent_index"], art1[0].metadata["page"]) == ("", 0, 0)
+
+
+def test_long_article_is_split_under_chunk_size(split):
+    children, parents = split
+    art7 = _children_of(children, "Điều 7")
+    assert len(art7) > 1
+    for c in art7:
+        assert c.page_content.startswith("Điều 7. Quy định dài\n")
+        assert (c.metadata["clause"], c.metadata["parent_index"], c.metadata["page"]) == ("", 4, 2)
+        assert c.metadata["chapter"] == "Chương II" and c.metadata["document_number"] == "50/2005/QH11"
+        assert len(c.page_content) <= CHUNK_SIZE + len("Điều 7. Quy định dài\n")
+    assert all(line in parents[4]["content"] for line in LONG_LINES)
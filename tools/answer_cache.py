@@ -0,0 +1,280 @@
+"""
+Cache ngữ nghĩa cho câu trả lời của legal_rag_tool.
+- Khoá: embedding câu hỏi (đã normalize); câu hỏi mới trúng cache nếu cosine với một
+  câu hỏi cũ >= RAG_CACHE_THRESHOLD. Câu hỏi trùng nguyên văn (sau chuẩn hoá) trúng
+  ngay, không cần embed.
+- Trúng theo độ tương đồng chỉ được chấp nhận khi hai câu hỏi nêu cùng "Điều N" và cùng số hiệu
+  văn bản (câu hỏi về Điều 74 không được trả lời bằng câu trả lời cho Điều 75).
+- Mỗi bản ghi gắn `corpus_version` (manifest của Vector DB + model/tham số truy xuất);
+  đổi corpus → bản ghi cũ bị xoá ở lần tra cứu tiếp theo.
+- Hết hạn theo TTL, giới hạn số bản ghi bằng LRU; SQLite WAL để nhiều worker dùng chung.
+- Ma trận embedding của phiên bản hiện tại được giữ trong RAM (vài nghìn × 768 float32).
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .lexical_index import article_refs, match_document_numbers
+
+RAG_CACHE_PATH        = os.getenv("RAG_CACHE_PATH", os.path.join(".cache", "rag_answers.sqlite"))
+RAG_CACHE_DISABLE     = os.getenv("RAG_CACHE_DISABLE", "0").strip().lower() in {"1", "true", "yes"}
+RAG_CACHE_THRESHOLD   = float(os.getenv("RAG_CACHE_THRESHOLD", "0.95"))
+RAG_CACHE_TTL_H       = float(os.getenv("RAG_CACHE_TTL_H", str(3 * 24)))
+RAG_CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "5000"))
+RAG_CACHE_CANDIDATES  = int(os.getenv("RAG_CACHE_CANDIDATES", "5"))   # số câu hỏi gần nhất được xét
+
+
+def normalize_question(q: str) -> str:
+    return re.sub(r"\s+", " ", (q or "").strip().lower()).rstrip(" ?.!")
+
+
+def question_scope(question: str, known_documents: Sequence[str] = ()) -> tuple:
+    """(các "Điều N", các số hiệu văn bản) mà câu hỏi nêu — hai câu hỏi chỉ dùng chung câu trả lời khi trùng."""
+    return (frozenset(article_refs(question)), frozenset(match_document_numbers(question, known_documents)))
+
+
+def _unit(vec: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    return v / (np.linalg.norm(v) + 1e-12)
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    citations: List[Dict[str, Any]] = field(default_factory=list)
+    similarity: float = 1.0
+    gen_seconds: float = 0.0
+
+
+class AnswerCache:
+    _EVICT_EVERY = 50
+
+    def __init__(self, path: str, threshold: float, ttl_s: float, max_entries: int):
+        self.path = path
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._version: Optional[str] = None
+        self._ids = np.zeros((0,), dtype=np.int64)
+        self._mat: Optional[np.ndarray] = None
+        self._max_id = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.lookup_s = 0.0
+        self.saved_s = 0.0
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id             INTEGER PRIMARY KEY AUTOINCREMENT,
+                question       TEXT NOT NULL,
+                question_norm  TEXT NOT NULL,
+                embedding      BLOB,
+                answer         TEXT NOT NULL,
+                citations      TEXT,
+                corpus_version TEXT NOT NULL,
+                gen_seconds    REAL NOT NULL DEFAULT 0,
+                created_at     REAL NOT NULL,
+                accessed_at    REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_answers_norm ON answers(corpus_version, question_norm);
+            CREATE INDEX IF NOT EXISTS idx_answers_accessed ON answers(accessed_at);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _sync(self, version: str) -> None:
+        """Đồng bộ ma trận trong RAM với DB (gọi khi đã giữ self._lock)."""
+        conn = self._conn()
+        if version != self._version:
+            removed = conn.execute("DELETE FROM answers WHERE corpus_version != ?", (version,)).rowcount
+            if removed:
+                print(f"--- [RAG CACHE] corpus đổi, xoá {removed} câu trả lời cũ ---")
+            self._version, self._ids, self._mat, self._max_id = version, np.zeros((0,), dtype=np.int64), None, 0
+        rows = conn.execute(
+            "SELECT id, embedding FROM answers WHERE corpus_version=? AND id > ? AND embedding IS NOT NULL ORDER BY id",
+            (version, self._max_id),
+        ).fetchall()
+        if not rows:
+            return
+        new = np.stack([np.frombuffer(b, dtype=np.float32) for _, b in rows])
+        self._ids = np.concatenate([self._ids, np.array([i for i, _ in rows], dtype=np.int64)])
+        self._mat = new if self._mat is None else np.vstack([self._mat, new])
+        self._max_id = int(self._ids[-1])
+
+    def _fetch(self, conn: sqlite3.Connection, where: str, params: tuple) -> Optional[tuple]:
+        return conn.execute(
+            f"SELECT id, question, answer, citations, gen_seconds, created_at FROM answers WHERE {where}", params
+        ).fetchone()
+
+    def _hit(self, row: tuple, similarity: float) -> Optional[CachedAnswer]:
+        rid, question, answer, citations, gen_seconds, created_at = row
+        conn = self._conn()
+        now = time.time()
+        if now - created_at > self.ttl_s:
+            conn.execute("DELETE FROM answers WHERE id=?", (rid,))
+            with self._lock:
+                self._version = None  # bỏ vector của bản ghi vừa xoá khỏi ma trận
+            return None
+        conn.execute("UPDATE answers SET accessed_at=? WHERE id=?", (now, rid))
+        return CachedAnswer(question, answer, json.loads(citations) if citations else [], similarity, gen_seconds)
+
+    def lookup_text(self, question: str, version: str) -> Optional[CachedAnswer]:
+        """Trúng khi câu hỏi trùng nguyên văn (sau chuẩn hoá); không tính là miss nếu trượt."""
+        t0 = time.perf_counter()
+        try:
+            with self._lock:
+                self._sync(version)
+            row = self._fetch(self._conn(), "corpus_version=? AND question_norm=? ORDER BY id DESC LIMIT 1",
+                              (version, normalize_question(question)))
+            hit = self._hit(row, 1.0) if row else None
+        except sqlite3.Error as e:
+            print(f"--- [RAG CACHE WARN] lookup failed: {e}")
+            return None
+        with self._lock:
+            self.lookup_s += time.perf_counter() - t0
+            if hit:
+                self.hits += 1
+                self.exact_hits += 1
+                self.saved_s += hit.gen_seconds
+        return hit
+
+    def lookup(self, question: str, embedding: Sequence[float], version: str,
+               known_documents: Sequence[str] = ()) -> Optional[CachedAnswer]:
+        """`known_documents`: các document_number của corpus, để so số hiệu văn bản câu hỏi nêu."""
+        t0 = time.perf_counter()
+        hit = None
+        try:
+            with self._lock:
+                self._sync(version)
+                mat, ids = self._mat, self._ids
+            if mat is not None and mat.shape[0]:
+                sims = mat @ _unit(embedding)
+                top = np.argsort(-sims)[:max(1, RAG_CACHE_CANDIDATES)]
+                scope = question_scope(question, known_documents)
+                # xét lần lượt các câu hỏi trên ngưỡng (giảm dần), lấy câu đầu tiên cùng Điều/văn bản
+                for j in top:
+                    if sims[j] < self.threshold:
+                        break
+                    row = self._fetch(self._conn(), "id=?", (int(ids[j]),))
+                    if row is None:
+                        continue
+                    if question_scope(row[1], known_documents) != scope:
+                        print(f"--- [RAG CACHE] sim={sims[j]:.3f} nhưng khác Điều/văn bản với '{row[1]}', bỏ qua ---")
+                        continue
+                    hit = self._hit(row, float(sims[j]))
+                    if hit is not None:
+                        break
+        except (sqlite3.Error, ValueError) as e:
+            print(f"--- [RAG CACHE WARN] lookup failed: {e}")
+        with self._lock:
+            self.lookup_s += time.perf_counter() - t0
+            if hit:
+                self.hits += 1
+                self.saved_s += hit.gen_seconds
+            else:
+                self.misses += 1
+        return hit
+
+    def put(self, question: str, embedding: Optional[Sequence[float]], answer: str,
+            citations: List[Dict[str, Any]], version: str, gen_seconds: float = 0.0) -> None:
+        now = time.time()
+        blob = _unit(embedding).tobytes() if embedding is not None else None
+        try:
+            self._conn().execute(
+                "INSERT INTO answers(question, question_norm, embedding, answer, citations, corpus_version, "
+                "gen_seconds, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (question, normalize_question(question), blob, answer,
+                 json.dumps(citations, ensure_ascii=False), version, float(gen_seconds), now, now),
+            )
+        except sqlite3.Error as e:
+            print(f"--- [RAG CACHE WARN] put failed: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self._EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """Xoá bản ghi hết hạn, rồi theo LRU cho tới khi còn tối đa max_entries."""
+        try:
+            conn = self._conn()
+            removed = conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl_s,)).rowcount
+            total = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if total > self.max_entries:
+                removed += conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY accessed_at ASC LIMIT ?)",
+                    (total - self.max_entries,),
+                ).rowcount
+            if removed:
+                with self._lock:
+                    self._version = None  # nạp lại ma trận ở lần tra cứu sau
+                print(f"--- [RAG CACHE] evicted {removed} entries ---")
+            return removed
+        except sqlite3.Error as e:
+            print(f"--- [RAG CACHE WARN] evict failed: {e}")
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, exact, misses = self.hits, self.exact_hits, self.misses
+            lookup_s, saved_s = self.lookup_s, self.saved_s
+            entries = 0 if self._mat is None else int(self._mat.shape[0])
+        total = hits + misses
+        return {
+            "hits": hits,
+            "exact_hits": exact,
+            "misses": misses,
+            "hit_rate": (hits / total) if total else 0.0,
+            "entries": entries,
+            "avg_lookup_ms": (lookup_s / total * 1000) if total else 0.0,
+            "saved_generation_s": round(saved_s, 1),
+        }
+
+
+_CACHE: Optional[AnswerCache] = None
+_CACHE_LOCK = threading.Lock()
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Cache dùng chung trong process; None nếu bị tắt hoặc không mở được file."""
+    global _CACHE
+    if RAG_CACHE_DISABLE:
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                try:
+                    _CACHE = AnswerCache(
+                        RAG_CACHE_PATH,
+                        threshold=RAG_CACHE_THRESHOLD,
+                        ttl_s=RAG_CACHE_TTL_H * 3600,
+                        max_entries=RAG_CACHE_MAX_ENTRIES,
+                    )
+                except Exception as e:
+                    print(f"--- [RAG CACHE ERROR] Không mở được cache {RAG_CACHE_PATH}: {e}")
+                    return None
+    return _CACHE
@@ -0,0 +1,246 @@
+"""
+Rút gọn state hội thoại của agent.
+- Kết quả tool lớn (vd. trademark_search_tool trả tới 100 bản ghi) được lưu ngoài state
+  (SQLite WAL, TOOL_RESULT_PATH) theo `ref`; ToolMessage chỉ giữ top-k dòng + ref.
+  Agent xem thêm bằng tool_result_page_tool(ref, offset, limit).
+- Trước mỗi lần gọi LLM, fit_messages() giữ lịch sử trong ngân sách AGENT_PROMPT_TOKENS:
+  kết quả tool của lượt hiện tại được bung lại đầy đủ nếu còn chỗ, các lượt cũ bị bỏ từ đầu.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from langchain_core.tools import tool
+
+TOOL_RESULT_PATH        = os.getenv("TOOL_RESULT_PATH", os.path.join(".cache", "tool_results.sqlite"))
+TOOL_RESULT_TTL_H       = float(os.getenv("TOOL_RESULT_TTL_H", "24"))
+AGENT_TOOL_INLINE_CHARS = int(os.getenv("AGENT_TOOL_INLINE_CHARS", "3000"))  # lớn hơn → lưu ngoài state
+AGENT_TOOL_TOP_K        = int(os.getenv("AGENT_TOOL_TOP_K", "10"))
+AGENT_TOOL_FIELD_CHARS  = int(os.getenv("AGENT_TOOL_FIELD_CHARS", "200"))
+AGENT_PROMPT_TOKENS     = int(os.getenv("AGENT_PROMPT_TOKENS", "6000"))    # ngân sách lịch sử (không gồm system)
+
+
+def approx_tokens(text: str) -> int:
+    # cùng ước lượng với tools.rag (~3 ký tự/token cho tiếng Việt)
+    return len(text) // 3 + 1
+
+def message_tokens(msg: BaseMessage) -> int:
+    content = msg.content if isinstance(msg.content, str) else json.dumps(msg.content, ensure_ascii=False)
+    n = approx_tokens(content) + 4
+    for call in getattr(msg, "tool_calls", None) or []:
+        n += approx_tokens(json.dumps(call.get("args") or {}, ensure_ascii=False)) + 8
+    return n
+
+
+class ToolResultStore:
+    _EVICT_EVERY = 50
+
+    def __init__(self, path: Optional[str], ttl_s: float):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._mem: Dict[str, Tuple[str, str]] = {}   # khi không có file: giữ trong RAM
+        self._writes = 0
+        if path:
+            d = os.path.dirname(path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._conn().executescript(
+                """
+                CREATE TABLE IF NOT EXISTS tool_results (
+                    ref        TEXT PRIMARY KEY,
+                    tool       TEXT NOT NULL,
+                    content    TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_tool_results_created ON tool_results(created_at);
+                """
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, tool_name: str, content: str) -> str:
+        ref = "tr_" + uuid.uuid4().hex[:12]
+        if not self.path:
+            with self._lock:
+                self._mem[ref] = (tool_name, content)
+            return ref
+        try:
+            self._conn().execute(
+                "INSERT INTO tool_results(ref, tool, content, created_at) VALUES (?, ?, ?, ?)",
+                (ref, tool_name, content, time.time()),
+            )
+        except sqlite3.Error as e:
+            print(f"--- [TOOL STORE WARN] put failed, giữ trong RAM: {e}")
+            with self._lock:
+                self._mem[ref] = (tool_name, content)
+            return ref
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self._EVICT_EVERY == 0
+        if due:
+            self.evict()
+        return ref
+
+    def get(self, ref: str) -> Optional[str]:
+        with self._lock:
+            if ref in self._mem:
+                return self._mem[ref][1]
+        if not self.path:
+            return None
+        try:
+            row = self._conn().execute("SELECT content FROM tool_results WHERE ref=?", (ref,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"--- [TOOL STORE WARN] get failed: {e}")
+            return None
+        return row[0] if row else None
+
+    def evict(self) -> int:
+        try:
+            removed = self._conn().execute("DELETE FROM tool_results WHERE created_at < ?",
+                                           (time.time() - self.ttl_s,)).rowcount
+        except sqlite3.Error as e:
+            print(f"--- [TOOL STORE WARN] evict failed: {e}")
+            return 0
+        if removed:
+            print(f"--- [TOOL STORE] evicted {removed} results ---")
+        return removed
+
+
+_STORE: Optional[ToolResultStore] = None
+_STORE_LOCK = threading.Lock()
+
+def get_tool_result_store() -> ToolResultStore:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                try:
+                    _STORE = ToolResultStore(TOOL_RESULT_PATH, ttl_s=TOOL_RESULT_TTL_H * 3600)
+                except Exception as e:
+                    print(f"--- [TOOL STORE ERROR] Không mở được {TOOL_RESULT_PATH}: {e}")
+                    _STORE = ToolResultStore(None, ttl_s=TOOL_RESULT_TTL_H * 3600)
+    return _STORE
+
+
+def _trim_row(row: Any) -> Any:
+    if not isinstance(row, dict):
+        return row
+    out = {}
+    for k, v in row.items():
+        if isinstance(v, str) and len(v) > AGENT_TOOL_FIELD_CHARS:
+            v = v[:AGENT_TOOL_FIELD_CHARS] + "…"
+        out[k] = v
+    return out
+
+def compact_tool_content(tool_name: str, content: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """(nội dung giữ trong state, artifact {"ref", "rows"}) — giữ nguyên nếu đủ nhỏ."""
+    if len(content) <= AGENT_TOOL_INLINE_CHARS:
+        return content, None
+    ref = get_tool_result_store().put(tool_name, content)
+    try:
+        data = json.loads(content)
+    except ValueError:
+        data = None
+    if isinstance(data, list):
+        head = [_trim_row(r) for r in data[:AGENT_TOOL_TOP_K]]
+        compact = (f"[Kết quả rút gọn: {len(head)}/{len(data)} dòng đầu; ref={ref}. "
+                   f"Dùng tool_result_page_tool để xem các dòng còn lại.]\n"
+                   + json.dumps(head, ensure_ascii=False))
+        return compact, {"ref": ref, "rows": len(data), "chars": len(content)}
+    compact = (f"[Kết quả rút gọn: {AGENT_TOOL_INLINE_CHARS}/{len(content)} ký tự đầu; ref={ref}.]\n"
+               + content[:AGENT_TOOL_INLINE_CHARS])
+    return compact, {"ref": ref, "rows": None, "chars": len(content)}
+
+
+def _turns(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    """Chia lịch sử thành các lượt, mỗi lượt bắt đầu bằng một HumanMessage."""
+    turns: List[List[BaseMessage]] = []
+    for m in messages:
+        if isinstance(m, HumanMessage) or not turns:
+            turns.append([m])
+        else:
+            turns[-1].append(m)
+    return turns
+
+def fit_messages(messages: Sequence[BaseMessage], budget: int = AGENT_PROMPT_TOKENS) -> Tuple[List[BaseMessage], Dict[str, Any]]:
+    """
+    (các message gửi cho LLM, thống kê). Lượt hiện tại luôn được gửi; kết quả tool của nó được
+    bung lại từ store nếu còn ngân sách. Các lượt cũ được thêm từ mới → cũ tới khi hết ngân sách.
+    """
+    turns = _turns(messages)
+    if not turns:
+        return [], {"tokens_est": 0, "messages_sent": 0, "messages_dropped": 0, "hydrated": 0}
+    current = list(turns[-1])
+    used = sum(message_tokens(m) for m in current)
+
+    hydrated = 0
+    store = None
+    for i, m in enumerate(current):
+        ref = (getattr(m, "artifact", None) or {}).get("ref") if isinstance(m, ToolMessage) else None
+        if not ref:
+            continue
+        store = store or get_tool_result_store()
+        full = store.get(ref)
+        if full is None:
+            continue
+        extra = approx_tokens(full) - approx_tokens(m.content)
+        if budget > 0 and used + extra > budget:
+            continue
+        current[i] = ToolMessage(content=full, name=m.name, tool_call_id=m.tool_call_id,
+                                 artifact=m.artifact, status=m.status)
+        used += extra
+        hydrated += 1
+
+    kept: List[List[BaseMessage]] = [current]
+    for turn in reversed(turns[:-1]):
+        n = sum(message_tokens(m) for m in turn)
+        if budget > 0 and used + n > budget:
+            break
+        kept.append(turn)
+        used += n
+    sent = [m for turn in reversed(kept) for m in turn]
+    return sent, {
+        "tokens_est": used,
+        "messages_sent": len(sent),
+        "messages_dropped": len(messages) - len(sent),
+        "hydrated": hydrated,
+    }
+
+
+@tool
+def tool_result_page_tool(ref: str, offset: int = 0, limit: int = 20) -> str:
+    """
+    Xem tiếp một kết quả tool đã bị rút gọn (ref dạng 'tr_...'): trả về các dòng
+    từ `offset`, tối đa `limit` dòng (kết quả văn bản: `offset` là số trang).
+    """
+    full = get_tool_result_store().get(ref.strip())
+    if full is None:
+        return f"Không tìm thấy kết quả với ref={ref} (có thể đã hết hạn)."
+    offset = max(0, int(offset or 0))
+    limit = max(1, min(int(limit or 20), 50))
+    try:
+        data = json.loads(full)
+    except ValueError:
+        data = None
+    if isinstance(data, list):
+        rows = [_trim_row(r) for r in data[offset:offset + limit]]
+        return (f"[Dòng {offset + 1}-{offset + len(rows)} / {len(data)}; ref={ref}]\n"
+                + json.dumps(rows, ensure_ascii=False))
+    # kết quả dạng văn bản: offset tính theo trang AGENT_TOOL_INLINE_CHARS ký tự
+    size = AGENT_TOOL_INLINE_CHARS
+    start = offset * size
+    return f"[Trang {offset + 1}, ký tự {start}-{min(start + size, len(full))} / {len(full)}]\n" + full[start:start + size]
@@ -1,39 +1,172 @@
 from langchain_core.tools import tool
-from thefuzz import fuzz
+from thefuzz import fuzz, utils as fuzz_utils
 import numpy as np
 from PIL import Image
-import io, base64
+from typing import List, Optional, Sequence, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import io, base64, hashlib, os, threading
+
+try:
+    # rapidfuzz: chấm điểm hàng loạt bằng C (process.cdist); không có thì quay về thefuzz
+    from rapidfuzz import fuzz as _rf_fuzz, process as _rf_process
+except ImportError:
+    _rf_fuzz = _rf_process = None
+
+from .embedding_store import get_embedding_store, image_key
+from .lazy import lazy_component
+
+CLIP_BATCH_SIZE     = int(os.getenv("CLIP_BATCH_SIZE", "16"))
+CLIP_DECODE_WORKERS = int(os.getenv("CLIP_DECODE_WORKERS", "4"))
 
 # Lazy loader cho CLIP
-_CLIP_MODEL = None
 _CLIP_DEVICE = None
 
+@lazy_component("clip")
+def _clip_model():
+    global _CLIP_DEVICE
+    print("--- [TOOL LOG] Load 'clip-ViT-B-32' (RAM only) ---")
+    from sentence_transformers import SentenceTransformer
+    import torch
+    _CLIP_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    model = SentenceTransformer("clip-ViT-B-32", device=_CLIP_DEVICE)
+    print(f"--- [TOOL LOG] CLIP ready on {_CLIP_DEVICE} ---")
+    return model
+
 def _load_clip():
-    global _CLIP_MODEL, _CLIP_DEVICE
-    if _CLIP_MODEL is None:
-        print("--- [TOOL LOG] Load 'clip-ViT-B-32' (RAM only) ---")
-        from sentence_transformers import SentenceTransformer
-        import torch
-        _CLIP_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-        _CLIP_MODEL = SentenceTransformer("clip-ViT-B-32", device=_CLIP_DEVICE)
-        print(f"--- [TOOL LOG] CLIP ready on {_CLIP_DEVICE} ---")
-    return _CLIP_MODEL
+    return _clip_model()
 
-def _embed_image_b64(b64_str: str) -> np.ndarray:
+def _decode_image_b64(b64_str: str) -> Image.Image:
     if not b64_str:
         raise ValueError("empty base64 image")
     raw = base64.b64decode(b64_str)
     img = Image.open(io.BytesIO(raw)).convert("RGB")
+    del raw
+    return img
+
+def _encode_images(imgs: List[Image.Image], batch_size: int) -> np.ndarray:
     model = _load_clip()
-    emb = model.encode([img], batch_size=1, convert_to_numpy=True, normalize_embeddings=True)
+    return model.encode(imgs, batch_size=max(1, batch_size), convert_to_numpy=True,
+                        normalize_embeddings=True).astype(np.float32, copy=False)
+
+def _embed_image_b64(b64_str: str) -> np.ndarray:
+    img = _decode_image_b64(b64_str)
+    emb = _encode_images([img], batch_size=1)
     # xoá tham chiếu tạm
-    del raw, img
+    del img
     return emb[0]
 
+def _embed_many(b64s: Sequence[str], batch_size: Optional[int] = None) -> np.ndarray:
+    """
+    Decode song song rồi encode theo lô (batch_size ảnh mỗi forward pass).
+    Ảnh lỗi → hàng NaN để caller biết bỏ qua.
+    """
+    if not b64s:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    def _safe_decode(b64: str) -> Optional[Image.Image]:
+        try:
+            return _decode_image_b64(b64)
+        except Exception as e:
+            print(f"--- [TOOL WARN] Decode logo failed: {e}")
+            return None
+
+    if len(b64s) > 1 and CLIP_DECODE_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=min(CLIP_DECODE_WORKERS, len(b64s))) as pool:
+            imgs = list(pool.map(_safe_decode, b64s))
+    else:
+        imgs = [_safe_decode(b) for b in b64s]
+
+    ok = [i for i, img in enumerate(imgs) if img is not None]
+    if not ok:
+        raise ValueError("không decode được ảnh nào")
+    embs = _encode_images([imgs[i] for i in ok], batch_size or CLIP_BATCH_SIZE)
+    out = np.full((len(b64s), embs.shape[1]), np.nan, dtype=np.float32)
+    out[ok] = embs
+    del imgs
+    return out
+
 def _cosine_scaled(a: np.ndarray, b: np.ndarray) -> float:
     val = float(np.dot(a, b))  # đã normalize
     return max(0.0, min(1.0, (val + 1.0) / 2.0))
 
+# Memo trong RAM cho ảnh không có applicationNumber (logo người dùng): không ghi ra đĩa
+_MEM_EMB: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_MEM_EMB_MAX = 256
+_MEM_EMB_LOCK = threading.Lock()
+
+def embed_logo(b64_str: str) -> np.ndarray:
+    """Embedding của một ảnh (thường là logo người dùng), chỉ tính 1 lần cho mỗi ảnh."""
+    key = hashlib.sha1(b64_str.encode("ascii", "ignore")).hexdigest()
+    with _MEM_EMB_LOCK:
+        if key in _MEM_EMB:
+            _MEM_EMB.move_to_end(key)
+            return _MEM_EMB[key]
+    emb = _embed_image_b64(b64_str).astype(np.float32)
+    with _MEM_EMB_LOCK:
+        _MEM_EMB[key] = emb
+        while len(_MEM_EMB) > _MEM_EMB_MAX:
+            _MEM_EMB.popitem(last=False)
+    return emb
+
+def embed_candidate_logos(items: Sequence[Tuple[str, str]], batch_size: Optional[int] = None) -> np.ndarray:
+    """
+    items = [(applicationNumber, logo_b64), ...] → ma trận (N, D) float32.
+    Tra kho embedding trên đĩa trước, chỉ encode (theo lô) những ảnh chưa có rồi ghi lại.
+    Ảnh không decode được → hàng NaN.
+    """
+    if not items:
+        return np.zeros((0, 0), dtype=np.float32)
+    store = get_embedding_store()
+    keys = [image_key(app_no, b64) for app_no, b64 in items]
+    found = store.get_many(keys) if store is not None else {}
+    miss = [i for i, k in enumerate(keys) if k not in found]
+    miss = list({keys[i]: i for i in miss}.values())  # mỗi ảnh chỉ encode 1 lần
+    if miss:
+        embs = _embed_many([items[i][1] for i in miss], batch_size)
+        good = [j for j in range(len(miss)) if not np.isnan(embs[j, 0])]
+        for j in range(len(miss)):
+            found[keys[miss[j]]] = embs[j]
+        if store is not None and good:
+            store.put_many([keys[miss[j]] for j in good], embs[good])
+    print(f"--- [TOOL LOG] Candidate embeddings: {len(items) - len(miss)} từ kho, {len(miss)} mới ---")
+    return np.stack([found[k] for k in keys]).astype(np.float32, copy=False)
+
+def logo_similarity_scores(query_emb: np.ndarray, cand_embs: np.ndarray) -> np.ndarray:
+    """Cosine (đã normalize) của 1 query với N ứng viên bằng một phép nhân ma trận, thang 0..1."""
+    if cand_embs.size == 0:
+        return np.zeros((0,), dtype=np.float32)
+    sims = cand_embs @ query_emb.astype(np.float32, copy=False)
+    return np.clip((sims + 1.0) / 2.0, 0.0, 1.0)
+
+# ===================== Name similarity (bulk) =====================
+def _normalize_name(s: str) -> str:
+    # đúng bước tiền xử lý mặc định của fuzz.token_set_ratio để điểm không đổi
+    return fuzz_utils.full_process((s or "").lower(), force_ascii=True)
+
+def score_names(query: str, names: Sequence[str], threshold: Optional[float] = None) -> np.ndarray:
+    """
+    Chấm token_set_ratio của 1 query với nhiều tên trong 1 lần gọi, trả về mảng điểm 0..1
+    (cùng thứ tự `names`). Query chỉ chuẩn hoá 1 lần; có `threshold` thì các cặp dưới
+    ngưỡng bị cắt sớm trong rapidfuzz và nhận điểm 0.
+    """
+    if not names:
+        return np.zeros((0,), dtype=np.float64)
+    q = _normalize_name(query)
+    procd = [_normalize_name(n) for n in names]
+    # điểm gốc được làm tròn tới số nguyên (như thefuzz) nên cutoff lùi 0.5
+    cutoff = max(0.0, threshold * 100.0 - 0.5) if threshold is not None else 0.0
+    if _rf_process is not None:
+        raw = _rf_process.cdist(
+            [q], procd, scorer=_rf_fuzz.token_set_ratio, processor=None,
+            score_cutoff=cutoff, dtype=np.float32, workers=-1,
+        )[0]
+    else:
+        raw = np.array([fuzz.token_set_ratio(q, n, full_process=False) for n in procd], dtype=np.float32)
+        raw[raw < cutoff] = 0.0
+    # float64 để 70/100 == 0.7 đúng như điểm thefuzz khi so với ngưỡng
+    return np.rint(raw).astype(np.float64) / 100.0
+
 @tool
 def compare_text_similarity_tool(text1: str, text2: str) -> float:
     """
@@ -41,7 +174,7 @@ def compare_text_similarity_tool(text1: str, text2: str) -> float:
     Phương pháp này hiệu quả trong việc bỏ qua các từ mô tả và tập trung vào yếu tố chính của nhãn hiệu.
     """
     print(f"--- [TOOL LOG] Text compare (token set): '{text1}' vs '{text2}' ---")
-    return fuzz.token_set_ratio((text1 or "").lower(), (text2 or "").lower()) / 100.0
+    return float(score_names(text1, [text2])[0])
 
 @tool
 def compare_logo_similarity_tool(user_logo_b64: str, candidate_logo_b64: str) -> float:
@@ -51,8 +184,8 @@ def compare_logo_similarity_tool(user_logo_b64: str, candidate_logo_b64: str) ->
     """
     print("--- [TOOL LOG] CLIP compare (RAM) ---")
     try:
-        e1 = _embed_image_b64(user_logo_b64)
-        e2 = _embed_image_b64(candidate_logo_b64)
+        e1 = embed_logo(user_logo_b64)
+        e2 = embed_logo(candidate_logo_b64)
         score = _cosine_scaled(e1, e2)
         print(f"--- [TOOL LOG] CLIP cosine (0..1): {score:.4f} ---")
         # xoá tham chiếu tạm
@@ -61,3 +194,26 @@ def compare_logo_similarity_tool(user_logo_b64: str, candidate_logo_b64: str) ->
     except Exception as e:
         print(f"--- [TOOL ERROR] CLIP compare failed: {e}")
         return 0.0
+
+def compare_logo_batch(
+    user_logo_b64: str,
+    candidate_logo_b64s: Sequence[str],
+    app_nos: Optional[Sequence[str]] = None,
+    batch_size: Optional[int] = None,
+) -> List[Optional[float]]:
+    """
+    So khớp 1 logo với nhiều logo ứng viên trong 1 lần gọi: logo người dùng embed 1 lần,
+    ứng viên decode song song và encode theo lô, điểm tính bằng 1 phép nhân ma trận.
+    Có app_nos → dùng kho embedding trên đĩa; không có → chỉ tính trong RAM.
+    Trả về điểm 0..1 theo đúng thứ tự input (None nếu ảnh ứng viên lỗi).
+    """
+    if not candidate_logo_b64s:
+        return []
+    print(f"--- [TOOL LOG] CLIP batch compare: {len(candidate_logo_b64s)} ứng viên ---")
+    query = embed_logo(user_logo_b64)
+    if app_nos is not None:
+        cand = embed_candidate_logos(list(zip(app_nos, candidate_logo_b64s)), batch_size)
+    else:
+        cand = _embed_many(candidate_logo_b64s, batch_size)
+    scores = logo_similarity_scores(query, cand)
+    return [None if np.isnan(v) else round(float(v), 4) for v in scores]
@@ -0,0 +1,118 @@
+"""
+Kho embedding CLIP của logo ứng viên trên đĩa.
+- Khoá: "{applicationNumber}:{sha1(ảnh base64)}" → đổi ảnh thì tự sinh khoá mới.
+- Vector float32 ghi nối tiếp vào một file nhị phân, đọc lại qua np.memmap
+  (các process dùng chung page cache, không nạp toàn bộ vào RAM).
+- Chỉ mục khoá → số dòng nằm trong SQLite; transaction ghi của SQLite đóng vai trò
+  khoá giữa các process khi nối thêm vector.
+"""
+import os
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+EMBED_STORE_DIR = os.getenv("EMBED_STORE_DIR", os.path.join(".cache", "clip_embeddings"))
+EMBED_DIM = int(os.getenv("EMBED_DIM", "512"))  # clip-ViT-B-32
+
+
+def image_key(app_no: str, b64: str) -> str:
+    return f"{app_no}:{hashlib.sha1(b64.encode('ascii', 'ignore')).hexdigest()}"
+
+
+class EmbeddingStore:
+    def __init__(self, directory: str, dim: int):
+        self.dim = dim
+        self.vec_path = os.path.join(directory, f"vectors_{dim}.f32")
+        self.idx_path = os.path.join(directory, f"index_{dim}.sqlite")
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.vec_path):
+            open(self.vec_path, "ab").close()
+        self._local = threading.local()
+        self._mm: Optional[np.memmap] = None
+        self._mm_rows = 0
+        self._mm_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS vec (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.idx_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _matrix(self, need_rows: int) -> np.memmap:
+        """Memmap chỉ đọc; map lại khi file đã được process khác nối thêm."""
+        with self._mm_lock:
+            if self._mm is None or self._mm_rows < need_rows:
+                rows = os.path.getsize(self.vec_path) // (4 * self.dim)
+                self._mm = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else None
+                self._mm_rows = rows
+            return self._mm
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        conn = self._conn()
+        rows: Dict[str, int] = {}
+        uniq = list(dict.fromkeys(keys))
+        for i in range(0, len(uniq), 500):
+            part = uniq[i:i + 500]
+            q = f"SELECT key, row FROM vec WHERE key IN ({','.join('?' * len(part))})"
+            rows.update(dict(conn.execute(q, part).fetchall()))
+        if not rows:
+            return {}
+        mm = self._matrix(max(rows.values()) + 1)
+        if mm is None:
+            return {}
+        return {k: np.array(mm[r]) for k, r in rows.items() if r < mm.shape[0]}
+
+    def put_many(self, keys: Sequence[str], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(keys) != vectors.shape[0] or not keys:
+            return
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            existing = set()
+            for i in range(0, len(keys), 500):
+                part = list(keys[i:i + 500])
+                q = f"SELECT key FROM vec WHERE key IN ({','.join('?' * len(part))})"
+                existing.update(r[0] for r in conn.execute(q, part))
+            new = [(k, i) for i, k in enumerate(keys) if k not in existing]
+            new = list({k: i for k, i in new}.items())  # bỏ khoá trùng trong cùng lô
+            if new:
+                with open(self.vec_path, "ab") as f:
+                    start = f.tell() // (4 * self.dim)
+                    f.write(vectors[[i for _, i in new]].tobytes())
+                conn.executemany(
+                    "INSERT INTO vec(key, row) VALUES (?, ?)",
+                    [(k, start + j) for j, (k, _) in enumerate(new)],
+                )
+            conn.execute("COMMIT")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            print(f"--- [EMBED STORE WARN] put failed: {e}")
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM vec").fetchone()[0]
+
+
+_STORE: Optional[EmbeddingStore] = None
+_STORE_LOCK = threading.Lock()
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                try:
+                    _STORE = EmbeddingStore(EMBED_STORE_DIR, EMBED_DIM)
+                except Exception as e:
+                    print(f"--- [EMBED STORE ERROR] Không mở được {EMBED_STORE_DIR}: {e}")
+                    return None
+    return _STORE
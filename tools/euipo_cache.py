@@ -0,0 +1,186 @@
+"""
+Cache bền (SQLite) cho chi tiết nhãn hiệu EUIPO và logo đã chuẩn hoá, khoá theo applicationNumber.
+- Lưu JPEG base64 512px đã chuẩn hoá, hoặc kết quả âm "không có ảnh".
+- Lưu bản rút gọn của detail record.
+- Hết hạn theo TTL (kết quả âm có TTL ngắn hơn), giới hạn dung lượng bằng LRU.
+- SQLite ở chế độ WAL nên nhiều process/worker dùng chung được một file.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+EUIPO_CACHE_PATH       = os.getenv("EUIPO_CACHE_PATH", os.path.join(".cache", "euipo_cache.sqlite"))
+EUIPO_CACHE_DISABLE    = os.getenv("EUIPO_CACHE_DISABLE", "0").strip().lower() in {"1", "true", "yes"}
+EUIPO_CACHE_TTL_H      = float(os.getenv("EUIPO_CACHE_TTL_H", str(7 * 24)))
+EUIPO_CACHE_NEG_TTL_H  = float(os.getenv("EUIPO_CACHE_NEG_TTL_H", "24"))
+EUIPO_CACHE_MAX_MB     = float(os.getenv("EUIPO_CACHE_MAX_MB", "256"))
+
+# Các trường giữ lại trong detail (bỏ ảnh nhúng và các nhánh lớn)
+_DETAIL_KEYS = (
+    "applicationNumber", "markFeature", "markBasis", "markKind", "status",
+    "applicationDate", "registrationDate", "expiryDate", "niceClasses", "wordMarkSpecification",
+)
+
+def trim_detail(detail: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not isinstance(detail, dict):
+        return None
+    out = {k: detail[k] for k in _DETAIL_KEYS if k in detail}
+    applicants = detail.get("applicants")
+    if isinstance(applicants, list):
+        out["applicants"] = [{"name": a.get("name")} for a in applicants if isinstance(a, dict)]
+    return out
+
+
+@dataclass
+class CachedMark:
+    app_no: str
+    logo_b64: Optional[str]           # None = đã biết là không có ảnh
+    detail: Optional[Dict[str, Any]]
+
+
+class EuipoCache:
+    _EVICT_EVERY = 50  # kiểm tra dung lượng sau mỗi N lần ghi
+
+    def __init__(self, path: str, max_bytes: int, ttl_s: float, neg_ttl_s: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.neg_ttl_s = neg_ttl_s
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS marks (
+                app_no      TEXT PRIMARY KEY,
+                logo_b64    TEXT,
+                has_image   INTEGER NOT NULL,
+                detail      TEXT,
+                size        INTEGER NOT NULL,
+                created_at  REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_marks_accessed ON marks(accessed_at);
+            """
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Mỗi luồng một connection (pool tải ảnh chạy nhiều luồng)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, app_no: str) -> Optional[CachedMark]:
+        """Trả về CachedMark nếu còn hạn, ngược lại None (kể cả khi đã hết TTL)."""
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT logo_b64, has_image, detail, created_at FROM marks WHERE app_no=?", (app_no,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            logo_b64, has_image, detail, created_at = row
+            ttl = self.ttl_s if has_image else self.neg_ttl_s
+            now = time.time()
+            if now - created_at > ttl:
+                conn.execute("DELETE FROM marks WHERE app_no=?", (app_no,))
+                self.misses += 1
+                return None
+            conn.execute("UPDATE marks SET accessed_at=? WHERE app_no=?", (now, app_no))
+            self.hits += 1
+            return CachedMark(app_no, logo_b64 if has_image else None, json.loads(detail) if detail else None)
+        except sqlite3.Error as e:
+            print(f"--- [CACHE WARN] get {app_no} failed: {e}")
+            return None
+
+    def put(self, app_no: str, logo_b64: Optional[str], detail: Optional[Dict[str, Any]] = None) -> None:
+        """Ghi logo (hoặc kết quả âm khi logo_b64=None) cùng detail đã rút gọn."""
+        detail_js = json.dumps(trim_detail(detail), ensure_ascii=False) if detail else None
+        size = len(logo_b64 or "") + len(detail_js or "") + len(app_no)
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO marks(app_no, logo_b64, has_image, detail, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (app_no, logo_b64, 1 if logo_b64 else 0, detail_js, size, now, now),
+            )
+        except sqlite3.Error as e:
+            print(f"--- [CACHE WARN] put {app_no} failed: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self._EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """Xoá bản ghi hết hạn, rồi xoá theo LRU cho tới khi dưới max_bytes."""
+        try:
+            conn = self._conn()
+            now = time.time()
+            removed = conn.execute(
+                "DELETE FROM marks WHERE (has_image=1 AND created_at < ?) OR (has_image=0 AND created_at < ?)",
+                (now - self.ttl_s, now - self.neg_ttl_s),
+            ).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM marks").fetchone()[0]
+            if total > self.max_bytes:
+                over = total - self.max_bytes
+                freed = 0
+                victims = []
+                for app_no, size in conn.execute("SELECT app_no, size FROM marks ORDER BY accessed_at ASC"):
+                    victims.append((app_no,))
+                    freed += size
+                    if freed >= over:
+                        break
+                conn.executemany("DELETE FROM marks WHERE app_no=?", victims)
+                removed += len(victims)
+            if removed:
+                print(f"--- [CACHE LOG] evicted {removed} entries ---")
+            return removed
+        except sqlite3.Error as e:
+            print(f"--- [CACHE WARN] evict failed: {e}")
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0}
+
+
+_CACHE: Optional[EuipoCache] = None
+_CACHE_LOCK = threading.Lock()
+
+def get_euipo_cache() -> Optional[EuipoCache]:
+    """Cache dùng chung trong process; None nếu bị tắt hoặc không mở được file."""
+    global _CACHE
+    if EUIPO_CACHE_DISABLE:
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                try:
+                    _CACHE = EuipoCache(
+                        EUIPO_CACHE_PATH,
+                        max_bytes=int(EUIPO_CACHE_MAX_MB * 1024 * 1024),
+                        ttl_s=EUIPO_CACHE_TTL_H * 3600,
+                        neg_ttl_s=EUIPO_CACHE_NEG_TTL_H * 3600,
+                    )
+                except Exception as e:
+                    print(f"--- [CACHE ERROR] Không mở được cache {EUIPO_CACHE_PATH}: {e}")
+                    return None
+    return _CACHE
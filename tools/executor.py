@@ -0,0 +1,184 @@
+"""
+Node thực thi tool cho đồ thị agent, thay cho ToolNode tuần tự.
+- Các tool_call trong cùng một AIMessage độc lập với nhau → chạy song song trên thread pool
+  (tối đa AGENT_TOOL_WORKERS luồng); mỗi lượt chỉ tốn bằng tool chậm nhất thay vì tổng.
+- Mỗi tool có timeout riêng (AGENT_TOOL_TIMEOUT_S, ghi đè bằng AGENT_TOOL_TIMEOUTS=
+  "trademark_search_tool=60,patent_search_tool=20"); quá hạn → ToolMessage lỗi, không chặn lượt.
+- ToolMessage trả về theo đúng thứ tự tool_call; thời gian chạy từng tool được ghi vào state.
+- Kết quả lớn được rút gọn theo tools.compaction (bản đầy đủ lưu ngoài state theo ref).
+- acall()/arun(): cùng hành vi cho đường async (astream_events), không giữ luồng khi chờ.
+- RunnableConfig của node (callbacks, tags, ...) được chuyển tiếp cho từng tool; luồng trong pool
+  chạy trong bản sao contextvars của lượt gọi, nên tracing/stream sự kiện tool vẫn đúng run cha.
+"""
+import os
+import json
+import time
+import asyncio
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+from .compaction import compact_tool_content
+
+AGENT_TOOL_WORKERS   = int(os.getenv("AGENT_TOOL_WORKERS", "4"))
+AGENT_TOOL_TIMEOUT_S = float(os.getenv("AGENT_TOOL_TIMEOUT_S", "90"))
+
+
+def _parse_timeouts(spec: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            try:
+                out[name.strip()] = float(value)
+            except ValueError:
+                print(f"--- [EXECUTOR WARN] Bỏ qua timeout không hợp lệ: '{part}'")
+    return out
+
+AGENT_TOOL_TIMEOUTS = _parse_timeouts(os.getenv("AGENT_TOOL_TIMEOUTS", ""))
+
+
+def tool_content(output: Any) -> str:
+    """Chuỗi đưa vào ToolMessage (giống ToolNode: giữ str, còn lại dump JSON)."""
+    if isinstance(output, str):
+        return output
+    try:
+        return json.dumps(output, ensure_ascii=False)
+    except Exception:
+        return str(output)
+
+
+class ParallelToolExecutor:
+    def __init__(self, tools: Sequence[Any], max_workers: int = AGENT_TOOL_WORKERS,
+                 timeout_s: float = AGENT_TOOL_TIMEOUT_S, timeouts: Optional[Dict[str, float]] = None):
+        self.tools = {t.name: t for t in tools}
+        self.max_workers = max(1, max_workers)
+        self.timeout_s = timeout_s
+        self.timeouts = dict(AGENT_TOOL_TIMEOUTS if timeouts is None else timeouts)
+
+    def timeout_for(self, name: str) -> float:
+        return self.timeouts.get(name, self.timeout_s)
+
+    def _run_one(self, call: Dict[str, Any], started: Dict[str, float],
+                 config: Optional[Dict[str, Any]] = None) -> ToolMessage:
+        started[call["id"]] = time.perf_counter()
+        tool = self.tools.get(call["name"])
+        if tool is None:
+            return ToolMessage(content=f"Error: tool '{call['name']}' không tồn tại. "
+                                       f"Các tool hợp lệ: {', '.join(self.tools)}",
+                               name=call["name"], tool_call_id=call["id"], status="error")
+        try:
+            output = tool.invoke(call.get("args") or {}, config)
+        except Exception as e:
+            return ToolMessage(content=f"Error: {e!r}\n Please fix your mistakes.",
+                               name=call["name"], tool_call_id=call["id"], status="error")
+        # Kết quả lớn lưu ngoài state, ToolMessage chỉ giữ bản rút gọn + ref
+        content, artifact = compact_tool_content(call["name"], tool_content(output))
+        return ToolMessage(content=content, name=call["name"], tool_call_id=call["id"], artifact=artifact)
+
+    def _records(self, calls: List[Dict[str, Any]], messages: Dict[str, ToolMessage],
+                 timings: Dict[str, Dict[str, Any]], wall: float) -> tuple:
+        ordered = [messages[c["id"]] for c in calls]
+        records = [
+            {"tool": c["name"], "tool_call_id": c["id"], "seconds": round(timings[c["id"]]["seconds"], 3),
+             "timed_out": timings[c["id"]]["timed_out"], "error": messages[c["id"]].status == "error"}
+            for c in calls
+        ]
+        total = sum(r["seconds"] for r in records)
+        print(f"--- [EXECUTOR LOG] {len(calls)} tool song song: {wall:.2f}s (tuần tự sẽ là ~{total:.2f}s) | "
+              + ", ".join(f"{r['tool']}={r['seconds']:.2f}s" for r in records) + " ---")
+        return ordered, records
+
+    def _timeout_message(self, call: Dict[str, Any]) -> ToolMessage:
+        limit = self.timeout_for(call["name"])
+        print(f"--- [EXECUTOR WARN] {call['name']} timeout sau {limit:.0f}s ---")
+        return ToolMessage(content=f"Error: '{call['name']}' quá thời gian {limit:.0f}s, không có kết quả.",
+                           name=call["name"], tool_call_id=call["id"], status="error")
+
+    def run(self, calls: List[Dict[str, Any]], config: Optional[Dict[str, Any]] = None) -> tuple:
+        """(ToolMessage theo thứ tự calls, thời gian từng tool)."""
+        if not calls:
+            return [], []
+        started: Dict[str, float] = {}
+        messages: Dict[str, ToolMessage] = {}
+        timings: Dict[str, Dict[str, Any]] = {}
+        t0 = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=min(self.max_workers, len(calls)),
+                                  thread_name_prefix="agent-tool")
+        try:
+            # mỗi tool một bản sao context riêng (một Context không chạy đồng thời ở hai luồng được)
+            futures = {pool.submit(contextvars.copy_context().run, self._run_one, c, started, config): c
+                       for c in calls}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+                now = time.perf_counter()
+                for fut in done:
+                    c = futures[fut]
+                    messages[c["id"]] = fut.result()
+                    timings[c["id"]] = {"seconds": now - started.get(c["id"], t0), "timed_out": False}
+                for fut in list(pending):
+                    c = futures[fut]
+                    begin = started.get(c["id"])
+                    limit = self.timeout_for(c["name"])
+                    if begin is not None and now - begin > limit:
+                        # Không dừng được luồng đang chạy; bỏ kết quả và trả lỗi cho agent
+                        pending.discard(fut)
+                        fut.cancel()
+                        messages[c["id"]] = self._timeout_message(c)
+                        timings[c["id"]] = {"seconds": now - begin, "timed_out": True}
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return self._records(calls, messages, timings, time.perf_counter() - t0)
+
+    async def _arun_one(self, call: Dict[str, Any], sem: asyncio.Semaphore,
+                        messages: Dict[str, ToolMessage], timings: Dict[str, Dict[str, Any]],
+                        config: Optional[Dict[str, Any]] = None) -> None:
+        async with sem:
+            begin = time.perf_counter()
+            tool = self.tools.get(call["name"])
+            timed_out = False
+            if tool is None:
+                msg = self._run_one(call, {})
+            else:
+                try:
+                    # tool đồng bộ được langchain đẩy sang thread pool; timeout chỉ bỏ chờ, không dừng luồng
+                    output = await asyncio.wait_for(tool.ainvoke(call.get("args") or {}, config),
+                                                    timeout=self.timeout_for(call["name"]))
+                    content, artifact = compact_tool_content(call["name"], tool_content(output))
+                    msg = ToolMessage(content=content, name=call["name"], tool_call_id=call["id"], artifact=artifact)
+                except asyncio.TimeoutError:
+                    msg, timed_out = self._timeout_message(call), True
+                except Exception as e:
+                    msg = ToolMessage(content=f"Error: {e!r}\n Please fix your mistakes.",
+                                      name=call["name"], tool_call_id=call["id"], status="error")
+            messages[call["id"]] = msg
+            timings[call["id"]] = {"seconds": time.perf_counter() - begin, "timed_out": timed_out}
+
+    async def arun(self, calls: List[Dict[str, Any]], config: Optional[Dict[str, Any]] = None) -> tuple:
+        """Bản async của run(): các tool chạy đồng thời trên event loop, tối đa max_workers cùng lúc."""
+        if not calls:
+            return [], []
+        messages: Dict[str, ToolMessage] = {}
+        timings: Dict[str, Dict[str, Any]] = {}
+        t0 = time.perf_counter()
+        sem = asyncio.Semaphore(self.max_workers)
+        await asyncio.gather(*(self._arun_one(c, sem, messages, timings, config) for c in calls))
+        return self._records(calls, messages, timings, time.perf_counter() - t0)
+
+    @staticmethod
+    def _calls(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        last = state["messages"][-1]
+        return list(getattr(last, "tool_calls", None) or []) if isinstance(last, AIMessage) else []
+
+    # tham số `config`: RunnableLambda tự truyền RunnableConfig của node vào
+    def __call__(self, state: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> dict:
+        messages, records = self.run(self._calls(state), config)
+        return {"messages": messages, "tool_timings": records}
+
+    async def acall(self, state: Dict[str, Any], config: Optional[Dict[str, Any]] = None) -> dict:
+        messages, records = await self.arun(self._calls(state), config)
+        return {"messages": messages, "tool_timings": records}
+
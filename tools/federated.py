@@ -0,0 +1,26 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Union
+
+from langchain_core.tools import tool
+
+from api_src import federated_search_all
+
+
+@tool
+def multi_source_trademark_search_tool(brands: str, nice_class: Optional[Union[int, str]] = None) -> List[Dict[str, Any]]:
+    """
+    Tra cứu nhãn hiệu đồng thời trên mọi nguồn đăng bạ đang bật (EUIPO, ...) cho một hoặc
+    nhiều biến thể tên (phân tách bằng dấu phẩy). Nguồn chậm chỉ trả kết quả một phần.
+    """
+    names = [b.strip() for b in str(brands).split(",") if b.strip()]
+    # các nguồn nhận một Nhóm Nice; lấy nhóm đầu tiên nếu được truyền nhiều nhóm
+    first = str(nice_class or "").split(",")[0].strip()
+    cls = int(first) if first.isdigit() else None
+    print(f"--- [TOOL LOG] Tra cứu liên nguồn {names} class={cls} ---")
+    hits = federated_search_all(names, cls)
+    if not hits:
+        return [{"message": "Không tìm thấy nhãn hiệu nào trên các nguồn tra cứu."}]
+    return [asdict(h) for h in hits]
@@ -0,0 +1,150 @@
+"""
+Khởi tạo trễ cho các thành phần nặng (model, vector store, LLM client, nguồn tra cứu).
+- @lazy_component("ten") biến hàm factory thành đối tượng gọi được: lần gọi đầu mới
+  khởi tạo (có khoá, an toàn đa luồng), các lần sau trả về cùng một instance.
+- warm_up(...) khởi tạo trước (mặc định ở luồng nền) để request đầu không phải chờ.
+- startup_report() cho biết thành phần nào đã nạp, mất bao lâu, RSS tăng bao nhiêu.
+"""
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+try:
+    import psutil
+    _PROC = psutil.Process(os.getpid())
+except Exception:
+    _PROC = None
+
+
+def _rss_mb() -> Optional[float]:
+    if _PROC is None:
+        return None
+    try:
+        return _PROC.memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+class LazyComponent:
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.__doc__ = factory.__doc__
+        self._value: Any = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.seconds: Optional[float] = None
+        self.rss_delta_mb: Optional[float] = None
+        self.error: Optional[str] = None
+        self.loaded_by: Optional[str] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> Any:
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                rss0 = _rss_mb()
+                t0 = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    print(f"--- [LAZY ERROR] Khởi tạo '{self.name}' thất bại: {e}")
+                    raise
+                self.seconds = time.perf_counter() - t0
+                rss1 = _rss_mb()
+                self.rss_delta_mb = (rss1 - rss0) if rss0 is not None and rss1 is not None else None
+                self.loaded_by = threading.current_thread().name
+                self.error = None
+                self._loaded = True
+                print(f"--- [LAZY LOG] '{self.name}' sẵn sàng sau {self.seconds:.2f}s ---")
+        return self._value
+
+    __call__ = get
+
+
+_REGISTRY: Dict[str, LazyComponent] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+def lazy_component(name: str) -> Callable[[Callable[[], Any]], LazyComponent]:
+    def _wrap(factory: Callable[[], Any]) -> LazyComponent:
+        comp = LazyComponent(name, factory)
+        with _REGISTRY_LOCK:
+            _REGISTRY[name] = comp
+        return comp
+    return _wrap
+
+def components() -> Dict[str, LazyComponent]:
+    with _REGISTRY_LOCK:
+        return dict(_REGISTRY)
+
+
+def warm_up(names: Optional[Iterable[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+    """
+    Khởi tạo trước các thành phần (mặc định: tất cả đã đăng ký). Lỗi của một thành phần
+    không chặn các thành phần khác; nó sẽ được thử lại ở lần dùng thật.
+    """
+    selected = list(names) if names is not None else list(components())
+
+    def _run() -> None:
+        t0 = time.perf_counter()
+        for name in selected:
+            comp = components().get(name)
+            if comp is None:
+                print(f"--- [LAZY WARN] Không có thành phần '{name}' ---")
+                continue
+            try:
+                comp.get()
+            except Exception:
+                pass
+        print(f"--- [LAZY LOG] Warm-up xong sau {time.perf_counter() - t0:.2f}s ---")
+        print_startup_report()
+
+    if not background:
+        _run()
+        return None
+    th = threading.Thread(target=_run, name="lazy-warmup", daemon=True)
+    th.start()
+    return th
+
+def warm_up_from_env() -> Optional[threading.Thread]:
+    """LAZY_WARMUP=all | tên1,tên2 | (trống = không warm-up)."""
+    spec = os.getenv("LAZY_WARMUP", "").strip()
+    if not spec:
+        return None
+    names = None if spec.lower() == "all" else [n.strip() for n in spec.split(",") if n.strip()]
+    return warm_up(names, background=True)
+
+
+def startup_report() -> List[Dict[str, Any]]:
+    return [
+        {
+            "component": c.name,
+            "loaded": c.loaded,
+            "seconds": None if c.seconds is None else round(c.seconds, 3),
+            "rss_delta_mb": None if c.rss_delta_mb is None else round(c.rss_delta_mb, 1),
+            "loaded_by": c.loaded_by,
+            "error": c.error,
+        }
+        for c in components().values()
+    ]
+
+def print_startup_report() -> None:
+    print("--- [LAZY LOG] Startup report ---")
+    for row in startup_report():
+        state = "loaded" if row["loaded"] else ("error" if row["error"] else "lazy")
+        secs = "-" if row["seconds"] is None else f"{row['seconds']:.2f}s"
+        rss = "-" if row["rss_delta_mb"] is None else f"{row['rss_delta_mb']:+.0f}MB"
+        print(f"    {row['component']:<22} {state:<7} {secs:>8} {rss:>8}")
+
+
+# Nguồn tra cứu trong api_src (tự memo); đăng ký ở đây để có trong warm-up/báo cáo
+@lazy_component("euipo_sources")
+def euipo_sources():
+    from api_src import get_available_sources
+    return get_available_sources()
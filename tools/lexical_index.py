@@ -0,0 +1,268 @@
+"""
+Chỉ mục từ khoá (BM25) cho corpus văn bản luật, đặt cạnh Vector DB.
+- Dựng lúc ingest bởi rag_builder.py (LexicalSink), cùng chunk_id với Chroma nên
+  upsert/xoá tăng dần khớp với index dense.
+- SQLite FTS5 (tokenizer unicode61, giữ dấu tiếng Việt): bảng `chunks` chứa nội dung +
+  metadata, bảng ảo `chunks_fts` (external content) đồng bộ qua trigger.
+- Bắt được token chính xác mà embedding thể hiện yếu: "Điều 74", "65/2023/NĐ-CP".
+- Bảng `parents` giữ toàn văn từng Điều (chunk cha) cho truy xuất parent-child:
+  tìm trên chunk nhỏ (Khoản), đưa cả Điều vào prompt.
+"""
+import os
+import re
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+LEXICAL_DB_NAME = "lexical.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    rowid INTEGER PRIMARY KEY,
+    chunk_id TEXT UNIQUE NOT NULL,
+    document_number TEXT,
+    metadata TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS chunks_docnum ON chunks(document_number);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    content, content='chunks', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 0'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+END;
+CREATE TABLE IF NOT EXISTS parents (
+    parent_id TEXT PRIMARY KEY,
+    source_file TEXT NOT NULL,
+    file_hash TEXT NOT NULL,
+    document_number TEXT,
+    article TEXT,
+    metadata TEXT,
+    content TEXT
+);
+CREATE INDEX IF NOT EXISTS parents_file ON parents(source_file);
+CREATE INDEX IF NOT EXISTS parents_article ON parents(document_number, article);
+"""
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+# "65/2023/NĐ-CP", "11/VBHN-VPQH", "65/2023" ...
+_DOC_CODE = re.compile(r"(?<![\w/])(\d{1,4}/(?:\d{4}/)?[\wĐđ]+(?:-[\wĐđ]+)*|\d{1,4}/\d{4})", re.UNICODE)
+_ARTICLE = re.compile(r"\b(điều|khoản|chương|mục)\s+(\d+[a-zđ]?)\b", re.IGNORECASE | re.UNICODE)
+
+
+def fts_query(text: str) -> str:
+    """Câu truy vấn FTS5: OR các token (đã quote) + cụm "điều N"/"khoản N" để cộng điểm khớp chính xác."""
+    tokens = list(dict.fromkeys(t.lower() for t in _WORD.findall(text or "")))
+    phrases = [f"{kind.lower()} {num.lower()}" for kind, num in _ARTICLE.findall(text or "")]
+    terms = [f'"{p}"' for p in dict.fromkeys(phrases)] + [f'"{t}"' for t in tokens]
+    return " OR ".join(terms)
+
+
+def article_refs(text: str) -> List[str]:
+    """Các "Điều N" được nêu trong câu hỏi (đúng dạng metadata `article`)."""
+    return list(dict.fromkeys(f"Điều {num.lower()}" for kind, num in _ARTICLE.findall(text or "")
+                              if kind.lower() == "điều"))
+
+
+def document_codes(text: str) -> List[str]:
+    return [m.strip("/-") for m in _DOC_CODE.findall(text or "")]
+
+
+def match_document_numbers(text: str, known: Sequence[str]) -> List[str]:
+    """Các `document_number` trong corpus được nhắc tới trong câu hỏi (theo số hiệu)."""
+    out: List[str] = []
+    for code in document_codes(text):
+        pat = re.compile(r"(?<![\d])" + re.escape(code.lower()))
+        out.extend(dn for dn in known if pat.search(dn.lower()) and dn not in out)
+    return out
+
+
+class LexicalIndex:
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        self._doc_numbers: Optional[List[str]] = None
+        if not readonly:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # --- ghi (rag_builder) ---
+    def upsert(self, ids: Sequence[str], contents: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(conn, ids)
+            conn.executemany(
+                "INSERT INTO chunks(chunk_id, document_number, metadata, content) VALUES (?, ?, ?, ?)",
+                [
+                    (cid, (meta or {}).get("document_number"), json.dumps(meta or {}, ensure_ascii=False), text)
+                    for cid, text, meta in zip(ids, contents, metadatas)
+                ],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._doc_numbers = None
+
+    def delete(self, ids: Sequence[str]) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(conn, ids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._doc_numbers = None
+
+    def clear(self) -> int:
+        """Xoá mọi chunk (kèm FTS qua trigger) và mọi Điều cha; trả về số chunk đã xoá."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = conn.execute("DELETE FROM chunks").rowcount
+            conn.execute("DELETE FROM parents")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._doc_numbers = None
+        return removed
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, ids: Sequence[str]) -> None:
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({','.join('?' * len(part))})", part)
+
+    def put_parents(self, source_file: str, file_hash: str, parents: Sequence[Dict[str, Any]]) -> None:
+        """parents: [{"parent_id", "content", ...metadata}] — các Điều của một file."""
+        rows = []
+        for p in parents:
+            meta = {k: v for k, v in p.items() if k not in ("parent_id", "content")}
+            rows.append((p["parent_id"], source_file, file_hash, meta.get("document_number"), meta.get("article"),
+                         json.dumps(meta, ensure_ascii=False), p["content"]))
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO parents(parent_id, source_file, file_hash, document_number, article, "
+                "metadata, content) VALUES (?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_parents(self, source_file: str, keep_hash: Optional[str] = None) -> int:
+        """Xoá Điều cha của file (trừ phiên bản `keep_hash` nếu có)."""
+        if keep_hash is None:
+            cur = self._conn().execute("DELETE FROM parents WHERE source_file=?", (source_file,))
+        else:
+            cur = self._conn().execute("DELETE FROM parents WHERE source_file=? AND file_hash != ?",
+                                       (source_file, keep_hash))
+        return cur.rowcount
+
+    def get_parents(self, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        out: Dict[str, Dict[str, Any]] = {}
+        ids = list(dict.fromkeys(i for i in ids if i))
+        conn = self._conn()
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            q = f"SELECT parent_id, metadata, content FROM parents WHERE parent_id IN ({','.join('?' * len(part))})"
+            try:
+                rows = conn.execute(q, part).fetchall()
+            except sqlite3.OperationalError:
+                return out  # index dựng trước khi có bảng parents
+            for pid, meta, content in rows:
+                out[pid] = {"parent_id": pid, "content": content, **json.loads(meta or "{}")}
+        return out
+
+    def find_articles(self, document_numbers: Sequence[str], articles: Sequence[str]) -> List[Dict[str, Any]]:
+        """Tra thẳng Điều theo (số hiệu văn bản, "Điều N") — dùng khi câu hỏi nêu cả hai."""
+        if not document_numbers or not articles:
+            return []
+        q = (f"SELECT parent_id, metadata, content FROM parents "
+             f"WHERE document_number IN ({','.join('?' * len(document_numbers))}) "
+             f"AND article IN ({','.join('?' * len(articles))})")
+        try:
+            rows = self._conn().execute(q, [*document_numbers, *articles]).fetchall()
+        except sqlite3.OperationalError:
+            return []  # index dựng trước khi có bảng parents
+        return [{"parent_id": pid, "content": content, **json.loads(meta or "{}")} for pid, meta, content in rows]
+
+    def count(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()[0])
+
+    # --- đọc (tools/rag.py) ---
+    def get_chunks(self, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """chunk_id → {"content", "metadata"} (kho nội dung cho backend vector int8)."""
+        out: Dict[str, Dict[str, Any]] = {}
+        ids = list(dict.fromkeys(ids))
+        conn = self._conn()
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            q = f"SELECT chunk_id, metadata, content FROM chunks WHERE chunk_id IN ({','.join('?' * len(part))})"
+            for cid, meta, content in conn.execute(q, part):
+                out[cid] = {"content": content, "metadata": json.loads(meta or "{}")}
+        return out
+
+    def document_numbers(self) -> List[str]:
+        if self._doc_numbers is None:
+            rows = self._conn().execute(
+                "SELECT DISTINCT document_number FROM chunks WHERE document_number IS NOT NULL"
+            ).fetchall()
+            self._doc_numbers = sorted(r[0] for r in rows)
+        return self._doc_numbers
+
+    def search(self, query: str, k: int = 20,
+               document_numbers: Optional[Sequence[str]] = None) -> List[Tuple[str, str, Dict[str, Any], float]]:
+        """[(chunk_id, content, metadata, bm25)] theo độ liên quan giảm dần (bm25 càng âm càng tốt)."""
+        match = fts_query(query)
+        if not match:
+            return []
+        sql = ("SELECT c.chunk_id, c.content, c.metadata, bm25(chunks_fts) AS score "
+               "FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid "
+               "WHERE chunks_fts MATCH ?")
+        params: List[Any] = [match]
+        if document_numbers:
+            sql += f" AND c.document_number IN ({','.join('?' * len(document_numbers))})"
+            params.extend(document_numbers)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(int(k))
+        try:
+            rows = self._conn().execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"--- [RAG WARN] Truy vấn BM25 lỗi: {e} ---")
+            return []
+        return [(cid, content, json.loads(meta or "{}"), float(score)) for cid, content, meta, score in rows]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60,
+                           weights: Optional[Sequence[float]] = None) -> List[Tuple[str, float]]:
+    """RRF: điểm = Σ w / (k + hạng). Trả về [(key, điểm)] giảm dần."""
+    scores: Dict[str, float] = {}
+    for i, ranking in enumerate(rankings):
+        w = 1.0 if weights is None else float(weights[i])
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + w / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
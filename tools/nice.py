@@ -1,24 +1,175 @@
 import json
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 from langchain_core.tools import tool
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 import os
 import re
 
+from .lazy import lazy_component
+
 # --- LLM Setup (Tái sử dụng các biến môi trường) ---
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
 OLLAMA_MODEL    = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
 OLLAMA_API_KEY  = os.getenv("OLLAMA_API_KEY", "ollama")
 
-# Sử dụng một LLM riêng cho việc phân loại
-classifier_llm = ChatOpenAI(
-    base_url=OLLAMA_BASE_URL,
-    api_key=OLLAMA_API_KEY,
-    model=OLLAMA_MODEL,
-    temperature=0,
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NICE_DATA_PATH  = os.getenv("NICE_DATA_PATH", os.path.join(_ROOT, "data", "nice_classes.json"))
+# Tuỳ chọn: danh mục hàng hoá/dịch vụ chi tiết [{"class": 9, "item": "..."}] để phân loại mịn hơn
+NICE_ITEMS_PATH = os.getenv("NICE_ITEMS_PATH", os.path.join(_ROOT, "data", "nice_items.json"))
+NICE_INDEX_CACHE = os.getenv("NICE_INDEX_CACHE", os.path.join(".cache", "nice_index.npz"))
+
+# Phân loại bằng embedding; chỉ hỏi LLM khi độ tin cậy thấp
+NICE_CONFIDENT   = float(os.getenv("NICE_CONFIDENT", "0.55"))  # cosine tối thiểu của nhóm đứng đầu
+NICE_MARGIN      = float(os.getenv("NICE_MARGIN", "0.05"))     # nhận thêm nhóm cách nhóm đầu không quá margin
+NICE_MAX_CLASSES = int(os.getenv("NICE_MAX_CLASSES", "3"))
+NICE_LLM_SHORTLIST = int(os.getenv("NICE_LLM_SHORTLIST", "8"))  # số nhóm đưa vào prompt khi phải hỏi LLM
+NICE_USE_LLM     = os.getenv("NICE_USE_LLM", "1").strip().lower() in {"1", "true", "yes"}
+
+# Sử dụng một LLM riêng cho việc phân loại (tạo ở lần dùng đầu)
+@lazy_component("nice_classifier_llm")
+def classifier_llm():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        base_url=OLLAMA_BASE_URL,
+        api_key=OLLAMA_API_KEY,
+        model=OLLAMA_MODEL,
+        temperature=0,
+    )
+
+@lazy_component("nice_data")
+def nice_data() -> Dict[int, str]:
+    """Nhóm Nice → mô tả, đọc một lần."""
+    with open(NICE_DATA_PATH, "r", encoding="utf-8") as f:
+        return {int(item["class"]): item["description"] for item in json.load(f)}
+
+def _nice_entries() -> List[Tuple[int, str]]:
+    """
+    Các dòng được embed: cả mô tả nhóm, từng mục tách theo ";" trong mô tả, và (nếu có)
+    danh mục hàng hoá/dịch vụ chi tiết. Điểm của nhóm = điểm cao nhất trong các dòng của nó.
+    """
+    entries: List[Tuple[int, str]] = []
+    for cls, desc in nice_data().items():
+        entries.append((cls, desc))
+        parts = [p.strip(" .") for p in desc.split(";")]
+        entries.extend((cls, p) for p in parts if len(parts) > 1 and len(p) > 3)
+    if os.path.exists(NICE_ITEMS_PATH):
+        with open(NICE_ITEMS_PATH, "r", encoding="utf-8") as f:
+            entries.extend((int(it["class"]), it["item"]) for it in json.load(f) if it.get("item"))
+    return entries
+
+def _unit_rows(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / (np.linalg.norm(x, axis=-1, keepdims=True) + 1e-12)
+
+@lazy_component("nice_index")
+def nice_index() -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ma trận embedding đã normalize, nhãn nhóm) — tính một lần rồi lưu ở NICE_INDEX_CACHE,
+    khoá theo model + nội dung dữ liệu nên đổi file Nice là tự tính lại.
+    """
+    from .rag import embedding_model, model_name
+
+    entries = _nice_entries()
+    key = hashlib.sha1(json.dumps([model_name, entries], ensure_ascii=False).encode("utf-8")).hexdigest()
+    if os.path.exists(NICE_INDEX_CACHE):
+        try:
+            with np.load(NICE_INDEX_CACHE) as z:
+                if str(z["key"]) == key:
+                    return z["vectors"], z["labels"]
+        except Exception as e:
+            print(f"--- [TOOL WARN] Bỏ qua cache Nice hỏng: {e}")
+    vectors = _unit_rows(embedding_model().embed_documents([text for _, text in entries]))
+    labels = np.array([cls for cls, _ in entries], dtype=np.int16)
+    d = os.path.dirname(NICE_INDEX_CACHE)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    np.savez(NICE_INDEX_CACHE, key=key, vectors=vectors, labels=labels)
+    print(f"--- [TOOL LOG] Đã tính embedding {len(entries)} dòng Nice ---")
+    return vectors, labels
+
+def embed_descriptions(descriptions: List[str]) -> np.ndarray:
+    """(n, D) đã normalize — một lần gọi model cho cả lô."""
+    from .rag import embedding_model
+
+    return _unit_rows(embedding_model().embed_documents(list(descriptions))).reshape(len(descriptions), -1)
+
+def class_scores(query_vectors: np.ndarray) -> np.ndarray:
+    """(n, 46): cột c = cosine cao nhất giữa mô tả và các dòng của Nhóm c (cột 0 bỏ trống)."""
+    vectors, labels = nice_index()
+    sims = np.atleast_2d(query_vectors) @ vectors.T
+    scores = np.full((sims.shape[0], 46), -1.0, dtype=np.float32)
+    for c in range(1, 46):
+        cols = labels == c
+        if cols.any():
+            scores[:, c] = sims[:, cols].max(axis=1)
+    return scores
+
+def ranked_from_scores(row: np.ndarray) -> List[Tuple[int, float]]:
+    order = np.argsort(-row[1:]) + 1
+    return [(int(c), float(row[c])) for c in order]
+
+def rank_nice_classes(product_description: str) -> List[Tuple[int, float]]:
+    """[(nhóm, cosine)] giảm dần cho cả 45 nhóm."""
+    return ranked_from_scores(class_scores(embed_descriptions([product_description]))[0])
+
+def pick_classes(ranked: List[Tuple[int, float]]) -> Tuple[List[int], bool]:
+    """(các nhóm chọn, có đủ tin cậy không) từ kết quả xếp hạng embedding."""
+    if not ranked:
+        return [], False
+    top = ranked[0][1]
+    picked = [c for c, s in ranked[:NICE_MAX_CLASSES] if s >= top - NICE_MARGIN]
+    return picked, top >= NICE_CONFIDENT
+
+classification_prompt = ChatPromptTemplate.from_template(
+    """Bạn là chuyên gia phân loại sản phẩm.
+    Nhiệm vụ của bạn là đọc mô tả sản phẩm và chọn ra **TẤT CẢ CÁC Nhóm Nice có thể phù hợp** từ danh sách dưới đây.
+    Hãy suy nghĩ kỹ, một sản phẩm có thể thuộc nhiều nhóm.
+    Chỉ trả lời bằng **các số của nhóm, cách nhau bởi dấu phẩy**, không giải thích gì thêm. Ví dụ: 9, 42
+
+    **Mô tả sản phẩm:**
+    {description}
+
+    **Danh sách các Nhóm Nice:**
+    {nice_list}
+
+    **Các Nhóm Nice phù hợp là (chỉ ghi số, cách nhau bởi dấu phẩy):**
+    """
 )
 
+def classify_with_llm(product_description: str, candidates: Optional[List[int]] = None) -> List[int]:
+    """Hỏi LLM; nếu có `candidates` thì chỉ đưa các nhóm đó vào prompt (ngắn hơn nhiều so với 45 nhóm)."""
+    data = nice_data()
+    classes = candidates or sorted(data)
+    nice_list_str = "\n".join(f"- Nhóm {c}: {data[c]}" for c in classes if c in data)
+    chain = classification_prompt | classifier_llm() | StrOutputParser()
+    result = chain.invoke({"description": product_description, "nice_list": nice_list_str})
+    found = [int(n) for n in re.findall(r'\d+', result)]
+    return list(dict.fromkeys(n for n in found if 1 <= n <= 45))
+
+def classify_product(product_description: str,
+                     ranked: Optional[List[Tuple[int, float]]] = None) -> Tuple[List[int], str]:
+    """
+    (các nhóm Nice, nguồn: "embedding" | "llm" | "embedding-fallback"). `ranked`: kết quả xếp hạng
+    đã tính sẵn. "embedding-fallback": LLM lỗi nên dùng tạm kết quả embedding kém tin cậy.
+    """
+    if ranked is None:
+        ranked = rank_nice_classes(product_description)
+    picked, confident = pick_classes(ranked)
+    print(f"--- [TOOL LOG] Nice embedding: top {[(c, round(s, 3)) for c, s in ranked[:5]]} ---")
+    if confident or not NICE_USE_LLM:
+        return picked, "embedding"
+    shortlist = [c for c, _ in ranked[:NICE_LLM_SHORTLIST]]
+    try:
+        classes = classify_with_llm(product_description, shortlist)
+    except Exception as e:
+        print(f"--- [TOOL WARN] LLM phân loại lỗi, dùng kết quả embedding: {e}")
+        return picked, "embedding-fallback"
+    return (classes or picked), "llm"
+
 @tool
 def suggest_nice_class_tool(product_description: str) -> str:
     """
@@ -26,47 +177,22 @@ def suggest_nice_class_tool(product_description: str) -> str:
     Trả về một chuỗi chứa các số của nhóm, cách nhau bởi dấu phẩy (ví dụ: '9, 39').
     """
     print(f"--- [TOOL LOG] Bắt đầu suy luận (nhiều) Nhóm Nice cho mô tả: '{product_description[:50]}...' ---")
-    
+
+    from .nice_service import get_nice_service
+
+    service = get_nice_service()
     try:
-        with open(r'data\nice_classes.json', 'r', encoding='utf-8') as f:
-            nice_data = json.load(f)
-        nice_list_str = "\n".join([f"- Nhóm {item['class']}: {item['description']}" for item in nice_data])
-    except Exception as e:
+        result = service.classify(product_description)
+    except (OSError, ValueError) as e:
         print(f"--- [TOOL ERROR] Không thể đọc file nice_classes.json: {e}")
         return "Lỗi: Không tìm thấy file phân loại Nice."
 
-    classification_prompt = ChatPromptTemplate.from_template(
-        """Bạn là chuyên gia phân loại sản phẩm.
-        Nhiệm vụ của bạn là đọc mô tả sản phẩm và chọn ra **TẤT CẢ CÁC Nhóm Nice có thể phù hợp** từ danh sách dưới đây.
-        Hãy suy nghĩ kỹ, một sản phẩm có thể thuộc nhiều nhóm.
-        Chỉ trả lời bằng **các số của nhóm, cách nhau bởi dấu phẩy**, không giải thích gì thêm. Ví dụ: 9, 42
+    cleaned_result = ", ".join(str(c) for c in result.classes)
+    print(f"--- [TOOL LOG] Nhóm Nice ({result.source}, {result.latency_ms:.0f}ms): {cleaned_result} "
+          f"| {service.stats()} ---")
 
-        **Mô tả sản phẩm:**
-        {description}
-
-        **Danh sách các Nhóm Nice:**
-        {nice_list}
-
-        **Các Nhóm Nice phù hợp là (chỉ ghi số, cách nhau bởi dấu phẩy):**
-        """
-    )
-    
-    chain = classification_prompt | classifier_llm | StrOutputParser()
-    
-    result = chain.invoke({
-        "description": product_description,
-        "nice_list": nice_list_str
-    })
-    
-    found_numbers = re.findall(r'\d+', result)
-    
-    valid_numbers = [num for num in found_numbers if 1 <= int(num) <= 45]
-    cleaned_result = ", ".join(valid_numbers)
-    
-    print(f"--- [TOOL LOG] LLM đã suy luận ra các Nhóm Nice: {cleaned_result} ---")
-    
     if not cleaned_result:
-        print("--- [TOOL WARN] LLM không trả về số nào hợp lệ, trả về None ---")
+        print("--- [TOOL WARN] Không suy luận được nhóm hợp lệ, trả về None ---")
         return None
-        
-    return cleaned_result
\ No newline at end of file
+
+    return cleaned_result
@@ -0,0 +1,278 @@
+"""
+Dịch vụ phân loại Nhóm Nice có nhớ kết quả, dùng cho suggest_nice_class_tool và nhập danh mục hàng loạt.
+- Chuẩn hoá mô tả (chữ thường, gộp khoảng trắng, bỏ dấu câu cuối) → tra hash chính xác trước,
+  sau đó tra gần trùng bằng embedding (cosine >= NICE_CACHE_NEAR).
+- Kết quả lưu SQLite (WAL) nên còn sau khi khởi động lại; gắn `version` (model, dữ liệu Nice,
+  ngưỡng) để đổi cấu hình là tự bỏ kết quả cũ.
+- classify_many(): một lần tra cache cho cả lô, một lần embed cho các mô tả chưa có, chấm
+  45 nhóm bằng một phép nhân ma trận; chỉ các mô tả kém tin cậy mới hỏi LLM (song song có giới hạn).
+
+Dòng lệnh:  python -m tools.nice_service danh_muc.txt > ket_qua.jsonl   (mỗi dòng một mô tả)
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+NICE_CACHE_PATH    = os.getenv("NICE_CACHE_PATH", os.path.join(".cache", "nice_cache.sqlite"))
+NICE_CACHE_DISABLE = os.getenv("NICE_CACHE_DISABLE", "0").strip().lower() in {"1", "true", "yes"}
+NICE_CACHE_NEAR    = float(os.getenv("NICE_CACHE_NEAR", "0.97"))
+NICE_LLM_WORKERS   = int(os.getenv("NICE_LLM_WORKERS", "4"))
+
+
+def normalize_description(text: str) -> str:
+    return re.sub(r"\s+", " ", (text or "").strip().lower()).strip(" .;,!?")
+
+
+def description_key(text: str) -> str:
+    return hashlib.sha1(normalize_description(text).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class NiceResult:
+    description: str
+    classes: List[int] = field(default_factory=list)
+    source: str = ""            # "embedding" | "llm" | "embedding-fallback" | "cache" | "cache-near" | "error"
+    latency_ms: float = 0.0
+    error: Optional[str] = None
+
+
+class NiceClassificationService:
+    def __init__(self, path: Optional[str], near_threshold: float = NICE_CACHE_NEAR,
+                 llm_workers: int = NICE_LLM_WORKERS):
+        self.path = path
+        self.near_threshold = near_threshold
+        self.llm_workers = max(1, llm_workers)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._keys: List[str] = []
+        self._mat: Optional[np.ndarray] = None
+        self._max_id = 0
+        self.metrics = {"calls": 0, "exact_hits": 0, "near_hits": 0, "misses": 0, "llm_calls": 0,
+                        "errors": 0, "total_ms": 0.0}
+        if path:
+            d = os.path.dirname(path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._conn().executescript(
+                """
+                CREATE TABLE IF NOT EXISTS nice_cache (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key         TEXT NOT NULL,
+                    version     TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    classes     TEXT NOT NULL,
+                    source      TEXT NOT NULL,
+                    embedding   BLOB,
+                    created_at  REAL NOT NULL,
+                    UNIQUE(key, version)
+                );
+                """
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def current_version() -> str:
+        from .nice import NICE_CONFIDENT, NICE_MARGIN, NICE_MAX_CLASSES, NICE_USE_LLM, nice_data
+        from .rag import model_name
+        data = hashlib.sha1(json.dumps(nice_data(), sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        return f"{model_name}|{data}|{NICE_CONFIDENT}|{NICE_MARGIN}|{NICE_MAX_CLASSES}|{int(NICE_USE_LLM)}"
+
+    # --- cache ---
+    def _sync(self, version: str) -> None:
+        """Nạp embedding của các bản ghi mới (cùng version) vào ma trận tra gần trùng."""
+        if not self.path:
+            return
+        with self._lock:
+            conn = self._conn()
+            if version != self._version:
+                conn.execute("DELETE FROM nice_cache WHERE version != ?", (version,))
+                self._version, self._keys, self._mat, self._max_id = version, [], None, 0
+            rows = conn.execute(
+                "SELECT id, key, embedding FROM nice_cache WHERE version=? AND id > ? AND embedding IS NOT NULL "
+                "ORDER BY id", (version, self._max_id),
+            ).fetchall()
+            if rows:
+                new = np.stack([np.frombuffer(b, dtype=np.float32) for _, _, b in rows])
+                self._mat = new if self._mat is None else np.vstack([self._mat, new])
+                self._keys.extend(k for _, k, _ in rows)
+                self._max_id = int(rows[-1][0])
+
+    def _get_exact(self, keys: Sequence[str], version: str) -> Dict[str, List[int]]:
+        out: Dict[str, List[int]] = {}
+        if not self.path:
+            return out
+        keys = list(dict.fromkeys(keys))
+        conn = self._conn()
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            q = f"SELECT key, classes FROM nice_cache WHERE version=? AND key IN ({','.join('?' * len(part))})"
+            for k, classes in conn.execute(q, [version, *part]):
+                out[k] = json.loads(classes)
+        return out
+
+    def _put(self, rows: List[tuple]) -> None:
+        if not self.path or not rows:
+            return
+        try:
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO nice_cache(key, version, description, classes, source, embedding, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+        except sqlite3.Error as e:
+            print(f"--- [NICE CACHE WARN] put failed: {e}")
+
+    # --- API ---
+    def classify(self, description: str) -> NiceResult:
+        return self.classify_many([description])[0]
+
+    def classify_many(self, descriptions: Sequence[str]) -> List[NiceResult]:
+        """Phân loại cả lô; thứ tự kết quả theo thứ tự đầu vào, mô tả trùng chỉ tính một lần."""
+        from .nice import class_scores, classify_product, embed_descriptions, pick_classes, ranked_from_scores
+
+        t0 = time.perf_counter()
+        descriptions = list(descriptions)
+        results = [NiceResult(description=d) for d in descriptions]
+        version = self.current_version()
+        self._sync(version)
+
+        keys = [description_key(d) for d in descriptions]
+        exact = self._get_exact(keys, version)
+        for r, k in zip(results, keys):
+            if k in exact:
+                r.classes, r.source = exact[k], "cache"
+
+        # mô tả chưa có: embed một lần cho cả lô (bỏ trùng)
+        todo: Dict[str, int] = {}
+        for i, (r, k) in enumerate(zip(results, keys)):
+            if not r.source and normalize_description(r.description):
+                todo.setdefault(k, i)
+        if todo:
+            idx = list(todo.values())
+            vecs = embed_descriptions([normalize_description(descriptions[i]) for i in idx])
+
+            near: Dict[str, str] = {}
+            with self._lock:
+                mat, cache_keys = self._mat, list(self._keys)
+            if mat is not None and mat.shape[0]:
+                sims = vecs @ mat.T
+                best = sims.argmax(axis=1)
+                for j, k in enumerate(todo):
+                    if sims[j, best[j]] >= self.near_threshold:
+                        near[k] = cache_keys[int(best[j])]
+            near_classes = self._get_exact(list(near.values()), version)
+
+            scores = class_scores(vecs)
+            need_llm: List[tuple] = []
+            new_rows: List[tuple] = []
+            resolved: Dict[str, tuple] = {}
+            for j, (k, i) in enumerate(todo.items()):
+                if k in near and near[k] in near_classes:
+                    resolved[k] = (near_classes[near[k]], "cache-near", None)
+                    continue
+                ranked = ranked_from_scores(scores[j])
+                picked, confident = pick_classes(ranked)
+                if confident:
+                    resolved[k] = (picked, "embedding", None)
+                    new_rows.append((k, version, descriptions[i], json.dumps(picked), "embedding",
+                                     vecs[j].tobytes(), time.time()))
+                else:
+                    need_llm.append((k, i, j, ranked))
+
+            if need_llm:
+                def _run(item: tuple) -> tuple:
+                    k, i, j, ranked = item
+                    try:
+                        classes, source = classify_product(descriptions[i], ranked=ranked)
+                        return k, j, classes, source, None
+                    except Exception as e:
+                        return k, j, [], "error", str(e)
+
+                with ThreadPoolExecutor(max_workers=min(self.llm_workers, len(need_llm))) as pool:
+                    for k, j, classes, source, err in pool.map(_run, need_llm):
+                        resolved[k] = (classes, source, err)
+                        if source == "llm":
+                            with self._lock:
+                                self.metrics["llm_calls"] += 1
+                        # LLM lỗi → kết quả embedding tạm thời, không ghi cache để lần sau hỏi lại
+                        if err is None and classes and source != "embedding-fallback":
+                            new_rows.append((k, version, descriptions[todo[k]], json.dumps(classes), source,
+                                             vecs[j].tobytes(), time.time()))
+            self._put(new_rows)
+
+            for r, k in zip(results, keys):
+                if not r.source and k in resolved:
+                    r.classes, r.source, r.error = resolved[k]
+
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        for r in results:
+            if not r.source:
+                r.source, r.error = "error", "Mô tả trống"
+            r.latency_ms = round(elapsed_ms / max(1, len(results)), 2)
+        with self._lock:
+            for r in results:
+                self.metrics["calls"] += 1
+                if r.source == "cache":
+                    self.metrics["exact_hits"] += 1
+                elif r.source == "cache-near":
+                    self.metrics["near_hits"] += 1
+                elif r.source == "error":
+                    self.metrics["errors"] += 1
+                else:
+                    self.metrics["misses"] += 1
+            self.metrics["total_ms"] += elapsed_ms
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            m = dict(self.metrics)
+        calls = m["calls"]
+        m["hit_rate"] = ((m["exact_hits"] + m["near_hits"]) / calls) if calls else 0.0
+        m["avg_ms"] = (m.pop("total_ms") / calls) if calls else 0.0
+        return m
+
+
+_SERVICE: Optional[NiceClassificationService] = None
+_SERVICE_LOCK = threading.Lock()
+
+def get_nice_service() -> NiceClassificationService:
+    """Dịch vụ dùng chung trong process; cache đĩa tắt được bằng NICE_CACHE_DISABLE=1."""
+    global _SERVICE
+    if _SERVICE is None:
+        with _SERVICE_LOCK:
+            if _SERVICE is None:
+                path = None if NICE_CACHE_DISABLE else NICE_CACHE_PATH
+                try:
+                    _SERVICE = NiceClassificationService(path)
+                except Exception as e:
+                    print(f"--- [NICE CACHE ERROR] Không mở được cache {path}: {e}")
+                    _SERVICE = NiceClassificationService(None)
+    return _SERVICE
+
+
+if __name__ == "__main__":
+    src = open(sys.argv[1], "r", encoding="utf-8") if len(sys.argv) > 1 else sys.stdin
+    with src:
+        lines = [line.strip() for line in src if line.strip()]
+    service = get_nice_service()
+    for r in service.classify_many(lines):
+        print(json.dumps(asdict(r), ensure_ascii=False))
+    print(f"--- [NICE] {service.stats()} ---", file=sys.stderr)
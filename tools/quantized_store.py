@@ -0,0 +1,290 @@
+"""
+Backend vector lượng tử hoá int8 cho corpus văn bản luật (thay cho/đi cùng Chroma).
+Thư mục `{vector_db}/int8`:
+  vectors.i8    (N, D) int8     — vector đã normalize, lượng tử đối xứng theo từng dòng
+  scales.f32    (N,) float32    — hệ số của từng dòng (x ≈ scale * int8)
+  vectors.f32   (N, D) float32  — bản gốc, chỉ đọc các dòng trong shortlist để chấm lại chính xác
+  rows.sqlite   dòng → chunk_id / document_number / alive, và `generation` (tăng mỗi lần ghi)
+Mọi file vector đọc qua np.memmap nên các worker Streamlit trên cùng máy dùng chung page cache;
+phần nóng (int8) chỉ bằng 1/4 float32. Nội dung/metadata của chunk nằm ở chỉ mục lexical.
+Ghi theo kiểu nối thêm + tombstone; compact() dọn dòng chết khi tỉ lệ đủ lớn.
+"""
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+QUANT_DIR_NAME = "int8"
+_BLOCK = 8192  # số dòng int8 đổi sang float32 mỗi lần khi chấm thô
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(vector đã normalize float32, int8, scale) — lượng tử đối xứng theo dòng."""
+    x = np.asarray(vectors, dtype=np.float32)
+    x = x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-12)
+    scales = np.abs(x).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(x / scales[:, None]), -127, 127).astype(np.int8)
+    return x, q, scales.astype(np.float32)
+
+
+class QuantizedVectorStore:
+    def __init__(self, directory: str, readonly: bool = False):
+        self.directory = directory
+        self.readonly = readonly
+        self.i8_path = os.path.join(directory, "vectors.i8")
+        self.scale_path = os.path.join(directory, "scales.f32")
+        self.f32_path = os.path.join(directory, "vectors.f32")
+        self.db_path = os.path.join(directory, "rows.sqlite")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+        self.dim = 0
+        self.rows = 0
+        self._i8 = self._f32 = self._scales = None
+        self._alive = np.zeros((0,), dtype=bool)
+        self._doc_idx = np.zeros((0,), dtype=np.int32)
+        self._doc_names: List[str] = []
+        self._chunk_ids: List[str] = []
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+            self._conn().executescript(
+                """
+                CREATE TABLE IF NOT EXISTS rows (
+                    row INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL,
+                    document_number TEXT,
+                    alive INTEGER NOT NULL DEFAULT 1
+                );
+                CREATE INDEX IF NOT EXISTS rows_chunk ON rows(chunk_id, alive);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                """
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, key: str, default: str = "0") -> str:
+        row = self._conn().execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _bump(self, conn: sqlite3.Connection) -> None:
+        conn.execute("INSERT INTO meta(key, value) VALUES ('generation', '1') "
+                     "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    # --- ghi (rag_builder) ---
+    def upsert(self, ids: Sequence[str], vectors: Sequence[Sequence[float]],
+               document_numbers: Sequence[Optional[str]]) -> None:
+        if not ids:
+            return
+        x, q, scales = quantize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # khoá ghi giữa các process
+        try:
+            dim = int(self._meta("dim"))
+            if dim and dim != x.shape[1]:
+                raise ValueError(f"Số chiều {x.shape[1]} khác store ({dim})")
+            if not dim:
+                conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('dim', ?)", (str(x.shape[1]),))
+            start = (os.path.getsize(self.scale_path) // 4) if os.path.exists(self.scale_path) else 0
+            # lần ghi trước bị ngắt giữa chừng: cắt phần thừa để các file thẳng hàng theo dòng
+            for path, row_bytes in ((self.i8_path, x.shape[1]), (self.f32_path, 4 * x.shape[1])):
+                if os.path.exists(path) and os.path.getsize(path) > start * row_bytes:
+                    os.truncate(path, start * row_bytes)
+            self._tombstone(conn, ids)
+            with open(self.i8_path, "ab") as f:
+                f.write(q.tobytes())
+            with open(self.f32_path, "ab") as f:
+                f.write(x.tobytes())
+            with open(self.scale_path, "ab") as f:  # ghi cuối: số dòng hợp lệ = kích thước file này
+                f.write(scales.tobytes())
+            conn.executemany(
+                "INSERT OR REPLACE INTO rows(row, chunk_id, document_number, alive) VALUES (?, ?, ?, 1)",
+                [(start + i, cid, dn) for i, (cid, dn) in enumerate(zip(ids, document_numbers))],
+            )
+            self._bump(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, ids: Sequence[str]) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._tombstone(conn, ids)
+            self._bump(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self) -> int:
+        """Xoá mọi dòng và cắt rỗng các file vector; trả về số dòng còn sống trước khi xoá."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = int(conn.execute("SELECT COUNT(*) FROM rows WHERE alive=1").fetchone()[0])
+            conn.execute("DELETE FROM rows")
+            conn.execute("DELETE FROM meta WHERE key='dim'")
+            for path in (self.i8_path, self.f32_path, self.scale_path):
+                if os.path.exists(path):
+                    os.truncate(path, 0)
+            self._bump(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    @staticmethod
+    def _tombstone(conn: sqlite3.Connection, ids: Sequence[str]) -> None:
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            conn.execute(f"UPDATE rows SET alive=0 WHERE alive=1 AND chunk_id IN ({','.join('?' * len(part))})", part)
+
+    def count(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM rows WHERE alive=1").fetchone()[0])
+
+    def compact(self, min_dead_ratio: float = 0.25) -> int:
+        """Ghi lại các dòng còn sống khi tỉ lệ dòng chết >= min_dead_ratio. Trả về số dòng đã bỏ."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            total = int(conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0])
+            alive = conn.execute("SELECT row, chunk_id, document_number FROM rows WHERE alive=1 ORDER BY row").fetchall()
+            dead = total - len(alive)
+            dim = int(self._meta("dim"))
+            if not total or not dim or dead / total < min_dead_ratio:
+                conn.execute("ROLLBACK")
+                return 0
+            n = os.path.getsize(self.scale_path) // 4
+            keep = np.array([r for r, _, _ in alive], dtype=np.int64)
+            for path, dtype, width in ((self.i8_path, np.int8, dim), (self.f32_path, np.float32, dim),
+                                       (self.scale_path, np.float32, None)):
+                shape = (n, width) if width else (n,)
+                src = np.memmap(path, dtype=dtype, mode="r", shape=shape)
+                with open(path + ".tmp", "wb") as f:
+                    for s in range(0, keep.shape[0], _BLOCK):
+                        f.write(np.ascontiguousarray(src[keep[s:s + _BLOCK]]).tobytes())
+                del src
+                os.replace(path + ".tmp", path)
+            conn.execute("DELETE FROM rows")
+            conn.executemany("INSERT INTO rows(row, chunk_id, document_number, alive) VALUES (?, ?, ?, 1)",
+                             [(i, cid, dn) for i, (_, cid, dn) in enumerate(alive)])
+            self._bump(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"--- [INT8] compact: bỏ {dead} dòng chết, còn {len(alive)} ---")
+        return dead
+
+    # --- đọc (tools/rag.py) ---
+    def _refresh(self) -> None:
+        """Map lại file và nạp bảng dòng khi `generation` đổi (builder vừa ghi)."""
+        gen = int(self._meta("generation"))
+        if gen == self._generation:
+            return
+        with self._lock:
+            if gen == self._generation:
+                return
+            dim = int(self._meta("dim"))
+            n = (os.path.getsize(self.scale_path) // 4) if dim and os.path.exists(self.scale_path) else 0
+            rows = self._conn().execute("SELECT row, chunk_id, document_number, alive FROM rows WHERE row < ?",
+                                        (n,)).fetchall()
+            alive = np.zeros((n,), dtype=bool)
+            doc_idx = np.full((n,), -1, dtype=np.int32)
+            chunk_ids = [""] * n
+            names: Dict[str, int] = {}
+            for r, cid, dn, ok in rows:
+                chunk_ids[r] = cid
+                alive[r] = bool(ok)
+                if dn is not None:
+                    doc_idx[r] = names.setdefault(dn, len(names))
+            if n:
+                self._i8 = np.memmap(self.i8_path, dtype=np.int8, mode="r", shape=(n, dim))
+                self._f32 = np.memmap(self.f32_path, dtype=np.float32, mode="r", shape=(n, dim))
+                self._scales = np.memmap(self.scale_path, dtype=np.float32, mode="r", shape=(n,))
+            self.dim, self.rows = dim, n
+            self._alive, self._doc_idx, self._chunk_ids = alive, doc_idx, chunk_ids
+            self._doc_names = list(names)
+            self._generation = gen
+
+    def search(self, query: Sequence[float], k: int = 10, document_numbers: Optional[Sequence[str]] = None,
+               rescore: int = 4) -> List[Tuple[str, float]]:
+        """
+        [(chunk_id, cosine)] giảm dần. Chấm thô trên int8 cho toàn bộ dòng còn sống (lọc theo
+        document_number nếu có), lấy shortlist k * rescore rồi chấm lại bằng float32.
+        """
+        self._refresh()
+        if not self.rows:
+            return []
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        mask = self._alive
+        if document_numbers:
+            want = [self._doc_names.index(d) for d in document_numbers if d in self._doc_names]
+            mask = mask & np.isin(self._doc_idx, want)
+        short = max(k, k * rescore)
+        cand_rows: List[np.ndarray] = []
+        cand_scores: List[np.ndarray] = []
+        for s in range(0, self.rows, _BLOCK):
+            m = mask[s:s + _BLOCK]
+            if not m.any():
+                continue
+            idx = np.flatnonzero(m)
+            approx = (np.asarray(self._i8[s:s + _BLOCK][idx], dtype=np.float32) @ q) * self._scales[s:s + _BLOCK][idx]
+            if approx.shape[0] > short:
+                top = np.argpartition(-approx, short - 1)[:short]
+                idx, approx = idx[top], approx[top]
+            cand_rows.append(idx + s)
+            cand_scores.append(approx)
+        if not cand_rows:
+            return []
+        rows = np.concatenate(cand_rows)
+        approx = np.concatenate(cand_scores)
+        if rows.shape[0] > short:
+            rows = rows[np.argpartition(-approx, short - 1)[:short]]
+        rows = np.sort(rows)  # đọc memmap theo thứ tự trên đĩa
+        exact = np.asarray(self._f32[rows], dtype=np.float32) @ q
+        order = np.argsort(-exact)[:k]
+        return [(self._chunk_ids[int(rows[i])], float(exact[i])) for i in order]
+
+    def sample(self, n: int, seed: int = 0) -> Tuple[List[str], np.ndarray]:
+        """n dòng còn sống ngẫu nhiên (chunk_id, vector float32) — dùng để đo recall."""
+        self._refresh()
+        live = np.flatnonzero(self._alive)
+        if not live.shape[0]:
+            return [], np.zeros((0, self.dim), dtype=np.float32)
+        rows = np.sort(np.random.default_rng(seed).choice(live, size=min(n, live.shape[0]), replace=False))
+        return [self._chunk_ids[int(r)] for r in rows], np.asarray(self._f32[rows], dtype=np.float32)
+
+    def exact_search(self, query: Sequence[float], k: int = 10) -> List[Tuple[str, float]]:
+        """Duyệt toàn bộ float32 (chuẩn để so recall), không dùng khi phục vụ."""
+        self._refresh()
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        scores = np.full((self.rows,), -np.inf, dtype=np.float32)
+        for s in range(0, self.rows, _BLOCK):
+            scores[s:s + _BLOCK] = np.asarray(self._f32[s:s + _BLOCK], dtype=np.float32) @ q
+        scores[~self._alive] = -np.inf
+        top = np.argsort(-scores)[:k]
+        return [(self._chunk_ids[int(r)], float(scores[r])) for r in top if np.isfinite(scores[r])]
+
+    def memory_report(self) -> Dict[str, float]:
+        def _mb(p: str) -> float:
+            return round(os.path.getsize(p) / (1024 * 1024), 2) if os.path.exists(p) else 0.0
+        return {"int8_mb": _mb(self.i8_path), "float32_mb": _mb(self.f32_path),
+                "scales_mb": _mb(self.scale_path), "rows_db_mb": _mb(self.db_path)}
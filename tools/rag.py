@@ -1,50 +1,247 @@
 import os
+import time
+import sqlite3
+from typing import List, Optional, Sequence
 from dotenv import load_dotenv
 from langchain_core.tools import tool
 
-# For RAG
-from langchain_chroma import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_core.runnables import RunnablePassthrough
+# For RAG (model, vector store và LLM chỉ được tạo ở lần dùng đầu — xem tools/lazy.py)
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
+
+from .lazy import lazy_component
+from .answer_cache import get_answer_cache
+from .quantized_store import QUANT_DIR_NAME, QuantizedVectorStore
+from .lexical_index import (
+    LEXICAL_DB_NAME, LexicalIndex, article_refs, match_document_numbers, reciprocal_rank_fusion,
+)
 
 load_dotenv()
 
 # --- RAG Setup ---
 model_name = "bkai-foundation-models/vietnamese-bi-encoder"
-embedding_model = HuggingFaceEmbeddings(model_name=model_name)
 vector_db_path = "./vector_db"
-vectorstore = Chroma(persist_directory=vector_db_path, embedding_function=embedding_model)
-retriever = vectorstore.as_retriever()
+
+# Truy xuất: "hybrid" = BM25 (lexical.sqlite do rag_builder.py dựng) + dense, gộp bằng RRF; "dense" = chỉ vector
+RAG_RETRIEVAL    = os.getenv("RAG_RETRIEVAL", "hybrid").lower()
+# Nhánh dense: "chroma" hoặc "int8" (memmap lượng tử, dựng bằng rag_builder.py --backend int8|both)
+RAG_VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma").lower()
+RAG_TOP_K        = int(os.getenv("RAG_TOP_K", "4"))          # số đoạn (Điều hoặc chunk) đưa vào prompt
+RAG_CANDIDATES_K = int(os.getenv("RAG_CANDIDATES_K", "20"))  # số ứng viên mỗi nhánh trước khi gộp
+RAG_RRF_K        = int(os.getenv("RAG_RRF_K", "60"))
+# Parent-child: khớp trên Khoản, đưa cả Điều vào prompt nếu Điều không quá dài
+RAG_PARENT_MAX_CHARS = int(os.getenv("RAG_PARENT_MAX_CHARS", "4000"))
+# Ngân sách ngữ cảnh (token ước lượng) cho phần trích dẫn trong prompt; luôn giữ ít nhất 1 đoạn
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "2500"))
+
+# Rerank bằng cross-encoder (tuỳ chọn): lấy dư ứng viên, chấm theo lô trên CPU, quá thời gian thì giữ thứ tự cũ
+RAG_RERANK            = os.getenv("RAG_RERANK", "0").strip().lower() in {"1", "true", "yes"}
+RAG_RERANK_MODEL      = os.getenv("RAG_RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RAG_RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "50"))
+RAG_RERANK_BATCH      = int(os.getenv("RAG_RERANK_BATCH", "16"))
+RAG_RERANK_BUDGET_MS  = float(os.getenv("RAG_RERANK_BUDGET_MS", "800"))
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
 OLLAMA_MODEL    = os.getenv("OLLAMA_MODEL", "qwen2.5:7b-instruct")
 OLLAMA_API_KEY  = os.getenv("OLLAMA_API_KEY", "ollama")
 
-rag_llm = ChatOpenAI(
-    base_url=OLLAMA_BASE_URL,
-    api_key=OLLAMA_API_KEY,
-    model=OLLAMA_MODEL,
-    temperature=0,
-)
+@lazy_component("rag_embeddings")
+def embedding_model():
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+@lazy_component("rag_vectorstore")
+def vectorstore():
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=vector_db_path, embedding_function=embedding_model())
+
+@lazy_component("rag_int8_store")
+def int8_store():
+    directory = os.path.join(vector_db_path, QUANT_DIR_NAME)
+    if not os.path.exists(os.path.join(directory, "rows.sqlite")):
+        return None
+    return QuantizedVectorStore(directory, readonly=True)
+
+@lazy_component("rag_lexical")
+def lexical_index():
+    path = os.path.join(vector_db_path, LEXICAL_DB_NAME)
+    if not os.path.exists(path):
+        print(f"--- [RAG WARN] Chưa có chỉ mục BM25 tại {path}, chỉ dùng dense (chạy lại rag_builder.py) ---")
+        return None
+    return LexicalIndex(path, readonly=True)
+
+@lazy_component("rag_reranker")
+def reranker():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RAG_RERANK_MODEL, device="cpu", max_length=512)
+
+@lazy_component("rag_llm")
+def rag_llm():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        base_url=OLLAMA_BASE_URL,
+        api_key=OLLAMA_API_KEY,
+        model=OLLAMA_MODEL,
+        temperature=0,
+    )
+
+def citation_of(meta: dict) -> str:
+    """"Khoản 2 Điều 74 của Luật ..." từ metadata dựng sẵn lúc ingest (chỉ số hiệu nếu index cũ)."""
+    doc_num = meta.get('document_number') or meta.get('source') or 'Không rõ nguồn'
+    article = meta.get("article")
+    if not article:
+        return doc_num
+    clause = meta.get("clause")
+    return f"{clause + ' ' if clause else ''}{article} của {doc_num}"
 
 def format_docs(docs):
     formatted_context = ""
     for doc in docs:
-        doc_num = doc.metadata.get('document_number', doc.metadata.get('source', 'Không rõ nguồn'))
-        formatted_context += f"--- Trích dẫn từ: {doc_num} ---\n{doc.page_content}\n\n"
+        header = citation_of(doc.metadata)
+        clauses = doc.metadata.get("matched_clauses")
+        if clauses:
+            header += f" (liên quan: {', '.join(clauses)})"
+        formatted_context += f"--- Trích dẫn từ: {header} ---\n{doc.page_content}\n\n"
     return formatted_context.strip()
 
+def _doc_key(doc: Document) -> str:
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+def dense_search(query_vec: Sequence[float], k: int, doc_numbers: List[str]) -> List[Document]:
+    """Nhánh dense theo RAG_VECTOR_BACKEND; int8 cần chỉ mục lexical để lấy nội dung chunk."""
+    if RAG_VECTOR_BACKEND == "int8":
+        store, lex = int8_store(), lexical_index()
+        if store is not None and lex is not None:
+            hits = store.search(query_vec, k=k, document_numbers=doc_numbers or None)
+            chunks = lex.get_chunks([cid for cid, _ in hits])
+            return [Document(page_content=chunks[cid]["content"], metadata=chunks[cid]["metadata"])
+                    for cid, _ in hits if cid in chunks]
+        print("--- [RAG WARN] Chưa có backend int8 (hoặc chỉ mục lexical), dùng Chroma ---")
+    where = {"document_number": {"$in": doc_numbers}} if doc_numbers else None
+    return vectorstore().similarity_search_by_vector(list(query_vec), k=k, filter=where)
+
+def retrieve_candidates(query: str, query_vec: Optional[Sequence[float]] = None,
+                        k: int = RAG_CANDIDATES_K) -> List[Document]:
+    """
+    Dense + BM25, gộp bằng reciprocal rank fusion (danh sách chunk con đã xếp hạng). Nếu câu hỏi
+    nêu số hiệu văn bản ("65/2023/NĐ-CP") thì cả hai nhánh chỉ tìm trong các văn bản đó; nêu cả
+    "Điều N" thì Điều đó được tra thẳng và xếp đầu.
+    `query_vec`: embedding câu hỏi đã tính sẵn (để không embed lại).
+    """
+    t0 = time.perf_counter()
+    store = lexical_index()
+    lex = store if RAG_RETRIEVAL == "hybrid" else None
+    doc_numbers = match_document_numbers(query, store.document_numbers()) if store is not None else []
+
+    if query_vec is None:
+        query_vec = embedding_model().embed_query(query)
+    dense = dense_search(query_vec, k if lex is not None or RAG_RERANK else RAG_TOP_K, doc_numbers)
+    if lex is None:
+        return dense
+
+    by_key = {_doc_key(d): d for d in dense}
+    lexical_keys = []
+    for _, content, meta, _ in lex.search(query, k=k, document_numbers=doc_numbers or None):
+        doc = Document(page_content=content, metadata=meta)
+        key = _doc_key(doc)
+        by_key.setdefault(key, doc)
+        lexical_keys.append(key)
+
+    fused = reciprocal_rank_fusion([[_doc_key(d) for d in dense], lexical_keys], k=RAG_RRF_K)
+    pinned = [
+        Document(page_content=p["content"], metadata={**{f: v for f, v in p.items() if f != "content"}, "clause": ""})
+        for p in lex.find_articles(doc_numbers, article_refs(query))
+    ]
+    docs = pinned + [by_key[key] for key, _ in fused]
+    print(f"--- [RAG LOG] hybrid ({RAG_VECTOR_BACKEND}): dense={len(dense)} bm25={len(lexical_keys)} "
+          f"ghim={len(pinned)} → {len(docs)} ứng viên"
+          f"{' | lọc ' + ', '.join(doc_numbers) if doc_numbers else ''} | {(time.perf_counter() - t0) * 1000:.0f}ms ---")
+    return docs
+
+def expand_to_parents(docs: List[Document], limit: int) -> List[Document]:
+    """Thay chunk con bằng toàn văn Điều cha (gộp các Khoản cùng Điều), giữ thứ tự xếp hạng."""
+    lex = lexical_index()
+    parents = lex.get_parents([d.metadata.get("parent_id") for d in docs]) if lex is not None else {}
+    out: List[Document] = []
+    by_parent = {}
+    seen = set()
+    for d in docs:
+        pid = d.metadata.get("parent_id") or ""
+        parent = parents.get(pid)
+        clause = d.metadata.get("clause")
+        if pid in by_parent:
+            if clause and clause not in by_parent[pid].metadata["matched_clauses"]:
+                by_parent[pid].metadata["matched_clauses"].append(clause)
+            continue
+        if len(out) >= limit:
+            break
+        if parent is not None and len(parent["content"]) <= RAG_PARENT_MAX_CHARS:
+            meta = {**d.metadata, "clause": "", "matched_clauses": [clause] if clause else []}
+            by_parent[pid] = Document(page_content=parent["content"], metadata=meta)
+            out.append(by_parent[pid])
+        elif _doc_key(d) not in seen:
+            seen.add(_doc_key(d))
+            out.append(d)
+    return out
+
+def rerank(query: str, docs: List[Document], budget_ms: float = RAG_RERANK_BUDGET_MS) -> List[Document]:
+    """
+    Chấm (câu hỏi, chunk) bằng cross-encoder theo lô. Hết ngân sách thời gian trước khi chấm xong
+    (kể cả thời gian nạp model lần đầu) thì trả lại nguyên thứ tự cũ.
+    """
+    if len(docs) < 2:
+        return docs
+    t0 = time.perf_counter()
+    deadline = t0 + budget_ms / 1000.0
+    try:
+        model = reranker()
+        scores: List[float] = []
+        for i in range(0, len(docs), RAG_RERANK_BATCH):
+            if time.perf_counter() > deadline:
+                print(f"--- [RAG WARN] Rerank quá {budget_ms:.0f}ms sau {len(scores)}/{len(docs)} ứng viên, "
+                      f"giữ thứ tự gốc ---")
+                return docs
+            batch = docs[i:i + RAG_RERANK_BATCH]
+            scores.extend(float(x) for x in model.predict([(query, d.page_content) for d in batch],
+                                                         batch_size=RAG_RERANK_BATCH))
+    except Exception as e:
+        print(f"--- [RAG WARN] Rerank lỗi, giữ thứ tự gốc: {e}")
+        return docs
+    order = sorted(range(len(docs)), key=lambda j: scores[j], reverse=True)
+    print(f"--- [RAG LOG] Rerank {len(docs)} ứng viên trong {(time.perf_counter() - t0) * 1000:.0f}ms ---")
+    return [docs[j] for j in order]
+
+def _approx_tokens(text: str) -> int:
+    # ước lượng thô cho tiếng Việt với tokenizer BPE (~3 ký tự/token), đủ để chặn độ dài prompt
+    return len(text) // 3 + 1
+
+def fit_token_budget(docs: List[Document], budget: int = RAG_CONTEXT_TOKENS) -> List[Document]:
+    if budget <= 0:
+        return docs
+    out, used = [], 0
+    for d in docs:
+        n = _approx_tokens(d.page_content)
+        if out and used + n > budget:
+            continue  # đoạn sau ngắn hơn vẫn có thể vừa
+        out.append(d)
+        used += n
+    return out
+
+def retrieve(query: str, query_vec: Optional[Sequence[float]] = None) -> List[Document]:
+    if RAG_RERANK:
+        candidates = rerank(query, retrieve_candidates(query, query_vec, k=RAG_RERANK_CANDIDATES))
+    else:
+        candidates = retrieve_candidates(query, query_vec)
+    return fit_token_budget(expand_to_parents(candidates, RAG_TOP_K))
+
 rag_prompt = ChatPromptTemplate.from_template(
     """Bạn là một trợ lý pháp lý chuyên nghiệp, cẩn thận và chính xác.
     Nhiệm vụ của bạn là trả lời câu hỏi của người dùng một cách súc tích, chỉ dựa vào các đoạn trích dẫn được cung cấp.
     **QUY TẮC TRÍCH DẪN BẮT BUỘC:**
-    1.  Khi bạn lấy thông tin từ một đoạn trích, hãy tìm **số Điều** (ví dụ: "Điều 16", "Điều 84") có trong nội dung của đoạn trích đó.
-    2.  Kết hợp **số Điều** bạn tìm được với **số hiệu văn bản** được cung cấp trong tiêu đề trích dẫn (ví dụ: "--- Trích dẫn từ: Nghị định số 65/2023/NĐ-CP ---").
-    3.  Hãy trích dẫn theo mẫu sau: **(theo Điều X của [Số hiệu văn bản])**.
-    4.  **TUYỆT ĐỐI KHÔNG** được đề cập đến tên file, đường dẫn, hay số trang.
+    1.  Tiêu đề mỗi trích dẫn đã ghi Điều (Khoản) và số hiệu văn bản, ví dụ: "--- Trích dẫn từ: Điều 74 của Luật Sở hữu trí tuệ số 50/2005/QH11 ---". Nếu tiêu đề chưa có số Điều thì lấy số Điều trong nội dung.
+    2.  Hãy trích dẫn theo mẫu sau: **(theo Điều X của [Số hiệu văn bản])**, lấy đúng từ tiêu đề.
+    3.  **TUYỆT ĐỐI KHÔNG** được đề cập đến tên file, đường dẫn, hay số trang.
     ---
     **CÁC TRÍCH DẪN ĐƯỢC CUNG CẤP:**
     {context}
@@ -54,12 +251,42 @@ rag_prompt = ChatPromptTemplate.from_template(
     """
 )
 
-rag_chain = (
-    {"context": retriever | format_docs, "question": RunnablePassthrough()}
-    | rag_prompt
-    | rag_llm
-    | StrOutputParser()
-)
+@lazy_component("rag_answer_chain")
+def answer_chain():
+    """{"context", "question"} → câu trả lời (không gồm bước truy xuất)."""
+    return rag_prompt | rag_llm() | StrOutputParser()
+
+def corpus_version() -> str:
+    """Đổi khi manifest của Vector DB đổi (index lại) hoặc đổi model/tham số truy xuất."""
+    path = os.path.join(vector_db_path, "ingest_manifest.sqlite")
+    manifest = "none"
+    if os.path.exists(path):
+        try:
+            # rag_builder tăng `generation` sau mỗi file index/xoá
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key='generation'").fetchone()
+            finally:
+                conn.close()
+            manifest = row[0] if row else "0"
+        except sqlite3.Error:
+            pass
+    reranked = RAG_RERANK_MODEL if RAG_RERANK else "-"
+    return f"{manifest}|{model_name}|{OLLAMA_MODEL}|{RAG_RETRIEVAL}|{RAG_VECTOR_BACKEND}|{RAG_TOP_K}|{reranked}|{RAG_CONTEXT_TOKENS}"
+
+def citations_of(docs: List[Document]) -> List[dict]:
+    return [
+        {"citation": citation_of(d.metadata), "document_number": d.metadata.get("document_number"),
+         "article": d.metadata.get("article") or None, "chunk_id": d.metadata.get("chunk_id")}
+        for d in docs
+    ]
+
+def with_citations(answer: str, citations: List[dict]) -> str:
+    """Câu trả lời kèm danh sách nguồn đã dùng (không trùng lặp)."""
+    cited = list(dict.fromkeys(c.get("citation") for c in citations if c.get("citation")))
+    if not cited:
+        return answer
+    return answer.rstrip() + "\n\nNguồn trích dẫn:\n" + "\n".join(f"- {c}" for c in cited)
 
 @tool
 def legal_rag_tool(query: str) -> str:
@@ -68,4 +295,27 @@ def legal_rag_tool(query: str) -> str:
     Sử dụng khi cần tìm hiểu về một khái niệm hoặc quy định pháp luật.
     """
     print(f"--- [TOOL LOG] Đang thực thi RAG với câu hỏi: '{query}' ---")
-    return rag_chain.invoke(query)
\ No newline at end of file
+    t0 = time.perf_counter()
+    cache = get_answer_cache()
+    version = corpus_version()
+    query_vec = None
+    hit = cache.lookup_text(query, version) if cache else None
+    if hit is None:
+        query_vec = embedding_model().embed_query(query)
+        if cache:
+            lex = lexical_index()
+            hit = cache.lookup(query, query_vec, version, lex.document_numbers() if lex is not None else ())
+    if hit is not None:
+        print(f"--- [RAG CACHE] HIT (sim={hit.similarity:.3f}, '{hit.question}') sau "
+              f"{(time.perf_counter() - t0) * 1000:.0f}ms | {cache.stats()} ---")
+        return with_citations(hit.answer, hit.citations)
+
+    docs = retrieve(query, query_vec)
+    t_gen = time.perf_counter()
+    answer = answer_chain().invoke({"context": format_docs(docs), "question": query})
+    gen_seconds = time.perf_counter() - t_gen
+    citations = citations_of(docs)
+    if cache:
+        cache.put(query, query_vec, answer, citations, version, gen_seconds)
+        print(f"--- [RAG CACHE] MISS, sinh câu trả lời mất {gen_seconds:.1f}s | {cache.stats()} ---")
+    return with_citations(answer, citations)
\ No newline at end of file
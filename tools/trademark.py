@@ -1,4 +1,5 @@
-import os, time, re, io, base64, requests
+import os, time, re, io, base64
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from typing import List, Dict, Any, Optional, Tuple, Union
 from requests.exceptions import RequestException, JSONDecodeError
@@ -15,12 +16,25 @@ except Exception:
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 load_dotenv()
 
-from .compare import compare_text_similarity_tool, compare_logo_similarity_tool
+from api_src.http_client import http_get, http_post
+from api_src.register_mirror import get_register_mirror, REGISTER_MAX_CANDIDATES
+from .compare import score_names, compare_logo_batch
+from .euipo_cache import get_euipo_cache
 
 # Context để app.py set ảnh (tránh nhét base64 vào prompt)
 USER_LOGO_B64_CTX: Optional[str] = None
 
 
+# Số luồng tải ảnh ứng viên song song (giới hạn theo host nằm ở api_src.http_client)
+EUIPO_FETCH_WORKERS = int(os.getenv("EUIPO_FETCH_WORKERS", "8"))
+# Kiểm tra độ mới của bản ghi mirror: tuổi tối đa và số kết quả đầu bảng được kiểm tra
+REGISTER_MAX_AGE_DAYS = float(os.getenv("REGISTER_MAX_AGE_DAYS", "7"))
+REGISTER_REFRESH_TOP  = int(os.getenv("REGISTER_REFRESH_TOP", "20"))
+# Endpoint EUIPO (đổi sang stub cục bộ khi chạy thử, xem dev_stub.py)
+EUIPO_TM_API    = os.getenv("EUIPO_TM_API", "https://api-sandbox.euipo.europa.eu/trademark-search/trademarks")
+EUIPO_TOKEN_URL = os.getenv("EUIPO_TOKEN_URL", "https://auth-sandbox.euipo.europa.eu/oidc/accessToken")
+
+
 # ===================== Base64 helpers =====================
 def decode_any_base64(s: str) -> Tuple[Optional[bytes], Optional[str]]:
     """
@@ -73,13 +87,12 @@ def _get_euipo_sandbox_access_token() -> Optional[str]:
     if not cid or not csec:
         print("--- [TOOL ERROR] Missing EU_SANDBOX_ID/SECRET ---")
         return None
-    token_url = "https://auth-sandbox.euipo.europa.eu/oidc/accessToken"
+    token_url = EUIPO_TOKEN_URL
     try:
-        r = requests.post(
+        r = http_post(
             token_url,
             headers={"Content-Type": "application/x-www-form-urlencoded"},
             data={"grant_type": "client_credentials", "client_id": cid, "client_secret": csec, "scope": "uid"},
-            timeout=10,
         )
         r.raise_for_status()
         data = r.json()
@@ -161,7 +174,7 @@ def _to_jpeg_b64_smart(raw_bytes: bytes, content_type: Optional[str] = None, sou
 
 def _download_bytes(url: str, timeout: int = 15) -> Tuple[Optional[bytes], Optional[str]]:
     try:
-        r = requests.get(
+        r = http_get(
             url,
             timeout=timeout,
             allow_redirects=True,
@@ -175,25 +188,30 @@ def _download_bytes(url: str, timeout: int = 15) -> Tuple[Optional[bytes], Optio
 
 
 # ===================== EUIPO image endpoints =====================
-def _fetch_image_from_endpoints(app_no: str, headers: Dict[str, str], prefer_thumb: bool = True) -> Optional[str]:
+def _fetch_image_from_endpoints(app_no: str, headers: Dict[str, str],
+                                prefer_thumb: bool = True) -> Tuple[Optional[str], bool]:
     """
     Thử lấy ảnh qua endpoint ảnh khi detail không nhúng inline:
       1) /trademarks/{app}/image/thumbnail (nhanh, nhỏ)
       2) /trademarks/{app}/image          (đầy đủ)
-    Trả về JPEG base64 hoặc None.
+    Trả về (JPEG base64 hoặc None, definitive). definitive=True khi mọi endpoint đều trả lời chắc
+    chắn là không có ảnh (404, hoặc 200 nhưng không dùng được); lỗi mạng, 429, 5xx → False.
     """
-    base = "https://api-sandbox.euipo.europa.eu/trademark-search/trademarks"
+    base = EUIPO_TM_API
     order = [f"{base}/{app_no}/image/thumbnail", f"{base}/{app_no}/image"]
     if not prefer_thumb:
         order = [order[1], order[0]]
 
+    definitive = True
     for url in order:
         try:
             h = dict(headers)
             h["Accept"] = "image/*"
-            r = requests.get(url, headers=h, timeout=20, allow_redirects=True)
+            r = http_get(url, headers=h, allow_redirects=True)
             if r.status_code != 200:
                 print(f"[DEBUG] image endpoint {url} -> {r.status_code}")
+                if r.status_code != 404:
+                    definitive = False
                 continue
             ct = r.headers.get("Content-Type", "")
             if not ct.startswith("image/") and ct not in ("image/jpeg", "image/png", "image/gif", "image/webp"):
@@ -201,10 +219,11 @@ def _fetch_image_from_endpoints(app_no: str, headers: Dict[str, str], prefer_thu
             b64 = _to_jpeg_b64_smart(r.content, ct, source_hint=f"{app_no}:{url.rsplit('/',1)[-1]}")
             if b64:
                 print(f"[DEBUG] fetched image via endpoint: {url} | bytes={len(r.content)}")
-                return b64
+                return b64, True
         except Exception as e:
             print(f"[WARN] image endpoint failed: {e} | {url}")
-    return None
+            definitive = False
+    return None, definitive
 
 
 # ===================== markImage parsing =====================
@@ -236,12 +255,20 @@ def extract_logo_b64_from_detail(app_no: str, headers: Dict[str, str]) -> Option
     """
     Gọi /trademarks/{applicationNumber} rồi quét mọi nhánh có thể chứa ảnh (đệ quy).
     Nếu không có inline image, fallback gọi endpoint ảnh /image/thumbnail rồi /image.
+    Kết quả (ảnh hoặc "không có ảnh") được lưu vào cache bền theo applicationNumber.
     """
-    base = "https://api-sandbox.euipo.europa.eu/trademark-search/trademarks"
+    cache = get_euipo_cache()
+    if cache is not None:
+        hit = cache.get(app_no)
+        if hit is not None:
+            print(f"[DEBUG] cache hit {app_no} image={'yes' if hit.logo_b64 else 'no'}")
+            return hit.logo_b64
+
+    base = EUIPO_TM_API
 
     def _try_inline(params: Optional[Dict[str, str]]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
         try:
-            r = requests.get(f"{base}/{app_no}", headers=headers, params=params, timeout=20)
+            r = http_get(f"{base}/{app_no}", headers=headers, params=params)
             r.raise_for_status()
             detail = r.json()
         except Exception as e:
@@ -311,23 +338,125 @@ def extract_logo_b64_from_detail(app_no: str, headers: Dict[str, str]) -> Option
         "figurativeReproductions(image(content,contentType,imageUrl,imageId,binaryObjectId)),"
         "graphicalRepresentations(image(content,contentType,imageUrl,imageId,binaryObjectId))"
     )
+    def _remember(b64: Optional[str], detail: Optional[Dict[str, Any]]) -> Optional[str]:
+        # Chỉ ghi kết quả âm khi đã lấy được detail (lỗi mạng thì không cache)
+        if cache is not None and (b64 or detail):
+            cache.put(app_no, b64, detail)
+        return b64
+
     b64, detail1 = _try_inline({"fields": fields})
     if b64:
-        return b64
+        return _remember(b64, detail1)
 
     # Lần 2: bỏ fields (một số record chỉ nhúng content nếu không lọc)
     b64, detail2 = _try_inline(None)
     if b64:
-        return b64
+        return _remember(b64, detail2 or detail1)
 
     # Lần 3: dùng endpoint ảnh (đã bật)
     print(f"[DEBUG] try image endpoints for app {app_no}")
-    b64 = _fetch_image_from_endpoints(app_no, headers, prefer_thumb=True)
+    b64, definitive = _fetch_image_from_endpoints(app_no, headers, prefer_thumb=True)
     if b64:
-        return b64
+        return _remember(b64, detail2 or detail1)
 
     print(f"[DEBUG] no inline/endpoint image for {app_no}")
-    return None
+    if not definitive:
+        # endpoint ảnh lỗi tạm thời (timeout/429/5xx): không ghi "không có ảnh" cho cả TTL âm
+        return None
+    return _remember(None, detail2 or detail1)
+
+def resolve_candidate_logos(
+    app_nos: List[str],
+    headers: Dict[str, str],
+    want: int,
+    max_misses: int,
+) -> Dict[str, Optional[str]]:
+    """
+    Lấy ảnh cho nhiều ứng viên song song (mỗi ứng viên vẫn giữ thứ tự fallback
+    của extract_logo_b64_from_detail). Kết quả được xét theo đúng thứ tự app_nos,
+    nên cùng một input luôn cho cùng tập ảnh; dừng khi đủ `want` ảnh hoặc
+    khi số record không có ảnh chạm `max_misses`, các request chưa chạy bị huỷ.
+    """
+    results: Dict[str, Optional[str]] = {}
+    if not app_nos or want <= 0:
+        return results
+
+    got, misses = 0, 0
+    pool = ThreadPoolExecutor(
+        max_workers=max(1, min(EUIPO_FETCH_WORKERS, len(app_nos))),
+        thread_name_prefix="euipo-logo",
+    )
+    try:
+        futures = [pool.submit(extract_logo_b64_from_detail, app_no, headers) for app_no in app_nos]
+        for app_no, fut in zip(app_nos, futures):
+            try:
+                b64 = fut.result()
+            except Exception as e:
+                print(f"--- [TOOL WARN] Logo fetch failed {app_no}: {e}")
+                b64 = None
+            results[app_no] = b64
+            if b64:
+                got += 1
+            else:
+                misses += 1
+                print(f"[DEBUG] figurative but no image: app={app_no}, misses={misses}")
+            if got >= want:
+                print(f"[DEBUG] reached target images: {got}")
+                break
+            if misses >= max_misses:
+                print("[DEBUG] too many misses; skip logo compare for rest")
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+# ===================== Mirror freshness =====================
+def refresh_stale_records(records: List[Dict[str, Any]], headers: Dict[str, str]) -> int:
+    """
+    Cập nhật status/niceClasses cho bản ghi mirror cũ hơn REGISTER_MAX_AGE_DAYS:
+    ưu tiên detail đã rút gọn trong cache EUIPO, thiếu mới gọi API (song song).
+    Trả về số bản ghi đã cập nhật.
+    """
+    cutoff = time.time() - REGISTER_MAX_AGE_DAYS * 86400
+    stale = [r for r in records if r.get("_synced_at") is not None and r["_synced_at"] < cutoff]
+    if not stale:
+        return 0
+    cache = get_euipo_cache()
+    base = EUIPO_TM_API
+
+    def _fresh_detail(app_no: str) -> Optional[Dict[str, Any]]:
+        hit = cache.get(app_no) if cache is not None else None
+        if hit is not None and hit.detail:
+            return hit.detail
+        try:
+            r = http_get(f"{base}/{app_no}", headers=headers,
+                         params={"fields": "applicationNumber,status,niceClasses,wordMarkSpecification"})
+            r.raise_for_status()
+            return r.json()
+        except Exception as e:
+            print(f"--- [TOOL WARN] Freshness check failed {app_no}: {e}")
+            return None
+
+    updated = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(EUIPO_FETCH_WORKERS, len(stale))),
+                            thread_name_prefix="euipo-fresh") as pool:
+        details = list(pool.map(lambda r: _fresh_detail(str(r.get("applicationNumber"))), stale))
+    now = time.time()
+    persisted: Dict[str, Dict[str, Any]] = {}
+    for rec, detail in zip(stale, details):
+        if not detail:
+            continue
+        fields = {k: detail[k] for k in ("status", "niceClasses") if k in detail}
+        rec.update(fields)
+        rec["_synced_at"] = now
+        persisted[str(rec.get("applicationNumber"))] = fields
+        updated += 1
+    # Ghi lại vào mirror: lần tra cứu sau không hỏi EUIPO lại cho tới hết REGISTER_MAX_AGE_DAYS
+    mirror = get_register_mirror()
+    written = mirror.update_records(persisted, synced_at=now) if mirror is not None else 0
+    print(f"[DEBUG] freshness: {updated}/{len(stale)} bản ghi mirror đã cập nhật ({written} ghi vào mirror)")
+    return updated
 
 
 # ===================== Misc =====================
@@ -361,18 +490,25 @@ def trademark_search_tool(
     if not sanitized_name:
         return [{"error": "Tên sau khi làm sạch rỗng."}]
 
+    # Có mirror cục bộ → vẫn tra cứu được khi không lấy được token (bỏ tải ảnh/làm mới trạng thái)
+    mirror = get_register_mirror()
     token = _get_euipo_sandbox_access_token()
-    if not token:
+    headers: Optional[Dict[str, str]] = None
+    if token:
+        headers = {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {token}",
+            "X-IBM-Client-Id": os.environ.get("EU_SANDBOX_ID"),
+        }
+    elif mirror is None:
         return [{"error": "Xác thực EUIPO Sandbox thất bại."}]
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {token}",
-        "X-IBM-Client-Id": os.environ.get("EU_SANDBOX_ID"),
-    }
+    else:
+        print("--- [TOOL WARN] Không có token EUIPO; chỉ dùng mirror đăng bạ cục bộ ---")
 
-    api = "https://api-sandbox.euipo.europa.eu/trademark-search/trademarks"
+    api = EUIPO_TM_API
     # --- Build query gốc ---
     q_base = f"wordMarkSpecification.verbalElement==*{sanitized_name}*"
+    class_list: List[int] = []
     if nice_class:
         # Chuyển đổi input thành list các số nguyên
         class_list = [int(c.strip()) for c in str(nice_class).split(',') if c.strip().isdigit()]
@@ -388,7 +524,7 @@ def trademark_search_tool(
     def _fetch_list(q: str) -> List[Dict[str, Any]]:
         try:
             print(f"[DEBUG] list query: {q}")
-            r = requests.get(api, headers=headers, params={**params, "query": q}, timeout=20)
+            r = http_get(api, headers=headers, params={**params, "query": q})
             r.raise_for_status()
             js = r.json() or {}
             items = js.get("trademarks", [])
@@ -429,7 +565,16 @@ def trademark_search_tool(
     print(f"[DEBUG] has_user_logo={has_user_logo}")
 
     # --- Tách luồng: WORD (tên) và NON-WORD (logo+Tên khi có logo) ---
-    if has_user_logo:
+    # Có mirror cục bộ → sinh ứng viên trong process (trigram + lọc Nhóm Nice), không gọi list API
+    if mirror is not None:
+        if has_user_logo:
+            candidates_word = mirror.search(sanitized_name, class_list, REGISTER_MAX_CANDIDATES, mark_feature="WORD")
+            candidates_fig  = mirror.search(sanitized_name, class_list, REGISTER_MAX_CANDIDATES,
+                                            exclude_feature="WORD", mark_basis="EU_TRADEMARK")
+        else:
+            candidates_word = mirror.search(sanitized_name, class_list, REGISTER_MAX_CANDIDATES)
+            candidates_fig  = []
+    elif has_user_logo:
         q_word = q_base + " and markFeature==WORD"
         # Ưu tiên EU_TRADEMARK để tăng cơ hội có ảnh inline/endpoint
         q_fig  = q_base + " and markFeature!=WORD and markBasis==EU_TRADEMARK"
@@ -450,13 +595,17 @@ def trademark_search_tool(
     thr = threshold if threshold is not None else 0.85
     filtered: List[Dict[str, Any]] = []
 
+    def _named(cands: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], float]]:
+        # chấm điểm tên hàng loạt cho cả danh sách trong 1 lần gọi
+        cands = [c for c in cands if (c.get("wordMarkSpecification") or {}).get("verbalElement")]
+        names = [c["wordMarkSpecification"]["verbalElement"] for c in cands]
+        scores = score_names(original_name, names, threshold=thr)
+        return list(zip(cands, scores.tolist()))
+
     # --- 1) WORD: chỉ điểm tên ---
-    for c in candidates_word:
-        cand_name = (c.get("wordMarkSpecification") or {}).get("verbalElement", "")
-        if not cand_name:
-            continue
-        name_score = compare_text_similarity_tool.invoke({"text1": original_name, "text2": cand_name})
-        print(f"[SCORE WORD] '{original_name}' vs '{cand_name}': {name_score:.3f}")
+    word_scored = _named(candidates_word)
+    print(f"[SCORE WORD] {sum(1 for _, sc in word_scored if sc >= thr)}/{len(word_scored)} đạt ngưỡng {thr}")
+    for c, name_score in word_scored:
         if name_score >= thr:
             c["similarity_score"] = round(float(name_score), 3)
             c["logo_similarity"] = None
@@ -464,50 +613,45 @@ def trademark_search_tool(
             filtered.append(c)
 
     # --- 2) NON-WORD: tên + (nếu có) logo ---
-    want_images, got, misses = 5, 0, 0
+    want_images = 5
     max_misses = 20  # dừng sớm nếu sandbox không có ảnh cho nhiều bản ghi
 
-    for c in candidates_fig:
-        cand_name = (c.get("wordMarkSpecification") or {}).get("verbalElement", "")
-        if not cand_name:
-            continue
-        name_score = compare_text_similarity_tool.invoke({"text1": original_name, "text2": cand_name})
-        print(f"[SCORE FIG] '{original_name}' vs '{cand_name}': {name_score:.3f}")
+    fig_passed: List[Dict[str, Any]] = []
+    fig_scored = _named(candidates_fig)
+    print(f"[SCORE FIG] {sum(1 for _, sc in fig_scored if sc >= thr)}/{len(fig_scored)} đạt ngưỡng {thr}")
+    for c, name_score in fig_scored:
         if name_score < thr:
             continue
         c["similarity_score"] = round(float(name_score), 3)
         c["logo_similarity"]  = None
+        fig_passed.append(c)
+
+    # Tải ảnh ứng viên song song; record ngoài tập ảnh vẫn vào filtered với điểm tên
+    logos: Dict[str, Optional[str]] = {}
+    if has_user_logo and fig_passed and headers is not None:
+        app_nos = [str(c.get("applicationNumber")) for c in fig_passed]
+        logos = resolve_candidate_logos(app_nos, headers, want=want_images, max_misses=max_misses)
+
+    # Chấm logo theo lô: logo người dùng embed 1 lần, ứng viên tra kho/encode theo lô
+    logo_scores: Dict[str, float] = {}
+    with_img = [(app_no, b64) for app_no, b64 in logos.items() if b64]
+    if with_img:
+        try:
+            scores = compare_logo_batch(
+                user_b64, [b64 for _, b64 in with_img], app_nos=[a for a, _ in with_img]
+            )
+            for (app_no, _), sc in zip(with_img, scores):
+                if sc is None:
+                    continue
+                logo_scores[app_no] = sc
+                print(f"--- [CLIP LOG] {app_no} logo_sim={sc}")
+        except Exception as e:
+            print(f"--- [TOOL WARN] CLIP compare failed: {e}")
 
-        if has_user_logo:
-            app_no = str(c.get("applicationNumber"))
-            # 1) inline / 2) không fields / 3) endpoint ảnh
-            cand_b64 = extract_logo_b64_from_detail(app_no, headers)
-            if not cand_b64:
-                misses += 1
-                print(f"[DEBUG] figurative but no image: app={app_no}, misses={misses}")
-                if misses >= max_misses:
-                    print("[DEBUG] too many misses; skip logo compare for rest")
-                    # vẫn cộng vào filtered với điểm tên
-                else:
-                    # tiếp tục duyệt các record khác
-                    pass
-            else:
-                print(f"[DEBUG] image ready for app {app_no}, b64len={len(cand_b64)}")
-                try:
-                    ls = compare_logo_similarity_tool.invoke(
-                        {"user_logo_b64": user_b64, "candidate_logo_b64": cand_b64}
-                    )
-                    print(f"[DEBUG] compare result for app {app_no}: {ls}")
-                    if ls is not None:
-                        c["logo_similarity"] = float(ls)
-                        print(f"--- [CLIP LOG] {app_no} logo_sim={c['logo_similarity']}")
-                        got += 1
-                except Exception as e:
-                    print(f"--- [TOOL WARN] CLIP compare failed: {e}")
-
-                if got >= want_images:
-                    print(f"[DEBUG] reached target images: {got}")
-                    # không break; vẫn để tên các record khác vào filtered
+    for c in fig_passed:
+        app_no = str(c.get("applicationNumber"))
+        if app_no in logo_scores:
+            c["logo_similarity"] = logo_scores[app_no]
 
         if c["logo_similarity"] is not None:
             c["combined_score"] = round(0.5 * c["similarity_score"] + 0.5 * c["logo_similarity"], 4)
@@ -521,6 +665,10 @@ def trademark_search_tool(
 
     filtered.sort(key=lambda x: x.get("combined_score", 0.0), reverse=True)
 
+    # Bản ghi từ mirror: chỉ kiểm tra độ mới (trạng thái) với EUIPO cho các kết quả đầu bảng
+    if mirror is not None and headers is not None:
+        refresh_stale_records(filtered[:REGISTER_REFRESH_TOP], headers)
+
     # Trả về gọn: không bao gồm ảnh
     out: List[Dict[str, Any]] = []
     for c in filtered:
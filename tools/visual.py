@@ -0,0 +1,110 @@
+"""
+Tra cứu logo theo hình ảnh trên kho ảnh nhãn hiệu cục bộ (không phụ thuộc tên).
+Index IVF (inverted file) trên đĩa, dựng offline bởi logo_index_builder.py:
+  centroids.npy   (nlist, D) float32   — nạp vào RAM (nhỏ)
+  offsets.npy     (nlist + 1,) int64   — vị trí mỗi danh sách trong vectors
+  vectors.f16     (N, D) float16       — đọc qua np.memmap, xếp liền theo danh sách
+  ids.bin         (N,) bytes cố định   — applicationNumber tương ứng, memmap
+  meta.json       {"dim", "count", "nlist", "id_width"}
+Mỗi truy vấn chỉ chạm nprobe danh sách gần nhất nên không cần nạp toàn bộ vector.
+"""
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.tools import tool
+from langchain_core.pydantic_v1 import BaseModel, Field
+
+LOGO_INDEX_DIR    = os.getenv("LOGO_INDEX_DIR", os.path.join("data", "logo_index"))
+LOGO_INDEX_NPROBE = int(os.getenv("LOGO_INDEX_NPROBE", "16"))
+
+
+class LogoIndex:
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = int(meta["dim"])
+        self.count = int(meta["count"])
+        self.nlist = int(meta["nlist"])
+        self.centroids = np.load(os.path.join(directory, "centroids.npy")).astype(np.float32)
+        self.offsets = np.load(os.path.join(directory, "offsets.npy")).astype(np.int64)
+        self.vectors = np.memmap(os.path.join(directory, "vectors.f16"), dtype=np.float16,
+                                 mode="r", shape=(self.count, self.dim))
+        self.ids = np.memmap(os.path.join(directory, "ids.bin"), dtype=f"S{int(meta['id_width'])}",
+                             mode="r", shape=(self.count,))
+
+    def search(self, query: np.ndarray, top_k: int = 10, nprobe: int = LOGO_INDEX_NPROBE) -> List[Tuple[str, float]]:
+        """Trả về [(applicationNumber, cosine)] giảm dần. `query` phải đã normalize."""
+        q = query.astype(np.float32, copy=False).reshape(-1)
+        nprobe = max(1, min(nprobe, self.nlist))
+        lists = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+
+        best_rows: List[np.ndarray] = []
+        best_scores: List[np.ndarray] = []
+        for li in lists:
+            start, end = int(self.offsets[li]), int(self.offsets[li + 1])
+            if end <= start:
+                continue
+            sims = np.asarray(self.vectors[start:end], dtype=np.float32) @ q
+            k = min(top_k, sims.shape[0])
+            part = np.argpartition(-sims, k - 1)[:k]
+            best_rows.append(part + start)
+            best_scores.append(sims[part])
+        if not best_rows:
+            return []
+        rows = np.concatenate(best_rows)
+        scores = np.concatenate(best_scores)
+        order = np.argsort(-scores)[:top_k]
+        return [(self.ids[rows[i]].decode("ascii", "ignore"), float(scores[i])) for i in order]
+
+
+_INDEX: Optional[LogoIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+def get_logo_index() -> Optional[LogoIndex]:
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                if not os.path.exists(os.path.join(LOGO_INDEX_DIR, "meta.json")):
+                    print(f"--- [TOOL WARN] Chưa có logo index tại {LOGO_INDEX_DIR} ---")
+                    return None
+                _INDEX = LogoIndex(LOGO_INDEX_DIR)
+                print(f"--- [TOOL LOG] Logo index: {_INDEX.count} ảnh, {_INDEX.nlist} danh sách ---")
+    return _INDEX
+
+
+class VisualSearchInput(BaseModel):
+    top_k: int = Field(default=10, description="Số nhãn hiệu giống nhất về hình ảnh cần trả về.")
+    user_logo_b64: Optional[str] = Field(default=None, description="(Optional) Base64 logo; bỏ trống để dùng logo người dùng đã tải lên.")
+
+@tool(args_schema=VisualSearchInput)
+def visual_trademark_search_tool(top_k: int = 10, user_logo_b64: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Tìm các nhãn hiệu có logo giống logo người dùng nhất về hình ảnh (CLIP),
+    kể cả khi phần chữ khác hoàn toàn. Chỉ dùng khi người dùng có logo.
+    """
+    from .trademark import USER_LOGO_B64_CTX, decode_any_base64, _to_jpeg_b64_smart
+    from .compare import embed_logo
+
+    src = user_logo_b64 if user_logo_b64 and not user_logo_b64.strip().lower().startswith("logo_b64") else USER_LOGO_B64_CTX
+    if not src:
+        return [{"error": "Không có logo người dùng."}]
+    raw, _ = decode_any_base64(src)
+    logo = _to_jpeg_b64_smart(raw, None, source_hint="user_logo") if raw else None
+    if not logo:
+        return [{"error": "Logo người dùng không hợp lệ."}]
+
+    index = get_logo_index()
+    if index is None:
+        return [{"error": "Chưa dựng kho ảnh nhãn hiệu cục bộ."}]
+
+    top_k = max(1, min(int(top_k or 10), 100))
+    hits = index.search(embed_logo(logo), top_k=top_k)
+    print(f"--- [TOOL LOG] Visual search: {len(hits)} kết quả ---")
+    return [
+        {"applicationNumber": app_no, "logo_similarity": round(max(0.0, min(1.0, (s + 1.0) / 2.0)), 4)}
+        for app_no, s in hits
+    ]